@@ -1,9 +1,23 @@
 import streamlit as st
-import json
-import os
+import streamlit.components.v1 as components
+import calendar
 import datetime
-import pandas as pd
-import plotly.express as px  # Para criar gráficos interativos
+import importlib
+import threading
+import time
+import armazenamento
+import diagnostico
+from armazenamento import (CATEGORIAS_GASTO, FACETAS_BUSCA, MESES, TIPO_OPERACAO, agrupar_registros_por_ano_mes,
+                           anos_arquivados, anos_com_gastos, anos_com_registros, area_do_talhao, buscar_operacoes,
+                           carregar_gastos_do_ano, carregar_gastos_tabela, carregar_registros, carregar_registros_do_ano,
+                           carregar_resumos_mensais, estatisticas_cache, fazendas_com_talhoes, indexar_por_id,
+                           ler_registro, validar_campos, versao_dados)
+from diagnostico import instrumentar, medir_trecho
+from importacao import importar_arquivos
+from relatorios import (ABAS_EXPORTACAO, CATEGORIAS_CUSTO_HECTARE, GRANULARIDADES, consumo_produtos,
+                        custo_por_hectare, gerar_excel_operacoes, series_tendencia, tabela_exportacao_colunar)
+from talhoes import importar_kml, mapa_html
+from tarefas import FALHOU, TERMINADAS, artefatos, descartar_tarefa, enviar_tarefa, resultado_tarefa, situacao_tarefa
 
 
 # --- Constantes ---
@@ -12,185 +26,277 @@ PAGINA_EDITOR = "Editor operacional"
 PAGINA_EXPORTAR_EXCEL = "Exportar Excel"
 PAGINA_FINANCEIRO = "Financeiro"
 PAGINA_GRAFICOS = "Gráficos"  # Novo menu de gráficos
+PAGINA_IMPORTAR = "Importar dados"
+PAGINA_TENDENCIAS = "Tendências"
+PAGINA_MAPA = "Mapa dos talhões"
 SUBMENU_REGISTRAR_GASTO = "Registrar Novo Gasto"
 SUBMENU_EDITAR_REGISTRO = "Editar Registro"
-MESES = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
-         "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
-TIPO_OPERACAO = ["Operação Aérea", "Operação Terrestre"]
+TAMANHOS_PAGINA_EDITOR = [10, 25, 50, 100]
+LIMITE_BUSCA_EDITOR = 50
+SEM_FILTRO = "Todos"
+ROTULOS_FACETAS = {"ano": "Ano", "tipo_operacao": "Operação", "nome_fazenda": "Fazenda", "cultura": "Cultura",
+                   "aeronave": "Aeronave", "responsavel": "Responsável"}
+TODAS_FAZENDAS = "Todas"
+ALTURA_MAPA = 600
+TAREFA_EXCEL = "Arquivo Excel"
+TAREFA_GRAFICOS = "Consumo e custo por hectare"
+INTERVALO_PROGRESSO = 1.0  # Segundos entre as atualizações do progresso das tarefas em segundo plano
+MIME_EXCEL = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+AJUDA_HECTARES_TALHAO = "Área calculada dos limites do talhão importados do KML (página Mapa dos talhões)."
+# Menor hectare e dose aceitos no navegador: validar_campos exige valores maiores que 0
+MINIMO_POSITIVO = 0.01
+AJUDA_DOSE_TOTAL = "A dose total (hectares × dose por hectare) é calculada ao salvar."
+AJUDA_FAZENDA_GASTO = "Use o mesmo nome das operações para o gasto entrar no custo por hectare da fazenda."
+ESTILO_REGISTRO_EDITOR = """
+<style>
+.registro-container {
+    border: 1px solid #4CAF50;
+    border-radius: 5px;
+    padding: 10px;
+    margin-bottom: 10px;
+    display: flex;
+    flex-direction: column;
+    align-items: center;
+    text-align: center;
+    width: 95%;
+    margin-left: auto;
+    margin-right: auto;
+}
+.registro-container .stButton>button {
+    background-color: #4CAF50;
+    color: white;
+    border: none;
+    border-radius: 5px;
+    padding: 5px 10px;
+    cursor: pointer;
+}
+.registro-container .stButton>button:hover {
+    background-color: #45a049;
+}
+</style>
+"""
+
+# --- Diagnóstico ---
+# As medições ficam em diagnostico.py; aqui só o painel exibido na barra lateral.
+
+def exibir_painel_diagnostico(painel, total_ms):
+    """Preenche o painel de diagnóstico da barra lateral com as medições desta execução."""
+    bytes_banco = diagnostico.bytes_da_execucao()
+    with painel.container():
+        with st.expander("Diagnóstico", expanded=False):
+            st.write(f"**Execução:** {total_ms:.1f} ms")
+            st.write(f"**Lidos do banco:** {bytes_banco['lidos']:,} bytes")
+            st.write(f"**Gravados no banco:** {bytes_banco['gravados']:,} bytes")
+            cache = estatisticas_cache()
+            st.write(f"**Cache:** {cache['acertos']} acertos, {cache['falhas']} falhas")
+            for medicao in diagnostico.medicoes_ordenadas():
+                recuo = "  " * medicao["nivel"]
+                st.text(f"{recuo}{medicao['trecho']}: {medicao['ms']:.1f} ms")
 
 # --- Funções de utilidade ---
+# A leitura e a gravação ficam em armazenamento.py; estas versões exibem na página o erro de uma gravação
+# e devolvem se ela deu certo.
 
-def carregar_registros():
-    """Carrega os registros do arquivo JSON e adiciona o ano, se necessário."""
+def salvar_registro(registro):
+    """Insere ou atualiza um único registro no banco."""
     try:
-        with open("registros.json", "r") as arquivo:
-            registros = json.load(arquivo)
-            ano_atual = datetime.datetime.now().year
-        for registro in registros:
-            if "ano" not in registro:
-                registro["ano"] = ano_atual
-        return registros
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
-def salvar_registros(registros):
-    """Salva os registros no arquivo JSON."""
-    try:
-        with open("registros.json", "w") as arquivo:
-            json.dump(registros, arquivo, indent=4)
+        armazenamento.salvar_registro(registro)
     except Exception as e:
         st.error(f"Erro ao salvar registros: {e}")
+        return False
+    return True
 
-def carregar_gastos():
-    """Carrega os gastos do arquivo JSON."""
+def excluir_registro(id_registro):
+    """Remove um único registro do banco."""
     try:
-        with open("gastos.json", "r") as arquivo:
-            gastos = json.load(arquivo)
-        return gastos
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
-
-def salvar_gastos(gastos):
-    """Salva os gastos no arquivo JSON."""
+        armazenamento.excluir_registro(id_registro)
+    except Exception as e:
+        st.error(f"Erro ao excluir registro: {e}")
+        return False
+    return True
+
+def salvar_gasto(gasto):
+    """Insere ou atualiza um único gasto no banco."""
     try:
-        with open("gastos.json", "w") as arquivo:
-            json.dump(gastos, arquivo, indent=4)
+        armazenamento.salvar_gasto(gasto)
     except Exception as e:
         st.error(f"Erro ao salvar gastos: {e}")
-
-def validar_campos(dados):
-    """Valida os campos do formulário."""
-    erros = {}
-    if dados.get("hectares_totais") is not None and dados["hectares_totais"] <= 0:
-        erros["hectares_totais"] = "Hectares totais deve ser maior que 0"
-    if "produtos" in dados:
-        for i, produto in enumerate(dados["produtos"]):
-            if produto.get("dose_por_hectare") is not None and produto["dose_por_hectare"] <= 0:
-                erros[f"produto_{i}_dose"] = "Dose deve ser maior que 0"
-    return erros
-
-def gerar_campos_formulario(dados, finalizando=False):
-    """Gera os campos do formulário, adaptando-se ao tipo de operação."""
-    mes = st.selectbox("Mês", MESES, index=MESES.index(dados.get("mes", "Janeiro")) if "mes" in dados else 0,
-                     disabled=finalizando, key="mes")
-    ano_atual = datetime.datetime.now().year
-    ano = st.number_input("Ano", min_value=2000, max_value=2100, value=dados.get("ano", ano_atual),
-                         disabled=finalizando, key="ano")
-
+        return False
+    return True
+
+def _com_fazenda(gasto, fazenda):
+    """Copia o gasto com a fazenda informada, ou sem ela se o campo ficar em branco."""
+    gasto = {chave: valor for chave, valor in gasto.items() if chave != "nome_fazenda"}
+    if fazenda.strip():
+        gasto["nome_fazenda"] = fazenda.strip()
+    return gasto
+
+def excluir_gasto(id_gasto):
+    """Remove um único gasto do banco."""
+    try:
+        armazenamento.excluir_gasto(id_gasto)
+    except Exception as e:
+        st.error(f"Erro ao excluir gasto: {e}")
+        return False
+    return True
+
+def _valor_positivo(valor):
+    """Valor inicial de um campo com MINIMO_POSITIVO: vazio (None) se o valor gravado não é positivo."""
+    return valor if isinstance(valor, (int, float)) and valor >= MINIMO_POSITIVO else None
+
+def _campo_hectares(dados, nome_fazenda, talhao_aplicado, finalizando):
+    """Campo de hectares: a área do talhão, travada, se os limites dele foram importados (KML), ou o valor digitado."""
+    area = area_do_talhao(nome_fazenda, talhao_aplicado) if talhao_aplicado.strip() else None
+    if area is None:
+        return st.number_input("Hectares totais", min_value=MINIMO_POSITIVO,
+                               value=_valor_positivo(dados.get("hectares_totais")), disabled=finalizando,
+                               key="hectares_totais")
+    area = round(area, 2)
+    st.number_input("Hectares totais", value=area, disabled=True, key="hectares_talhao", help=AJUDA_HECTARES_TALHAO)
+    return area
+
+def _campos_dinamicos(dados, finalizando):
+    """Campos fora do st.form, que mudam o formulário: tipo de operação, fazenda e talhão (que definem se os
+    hectares vêm do KML) e número de produtos. Mudá-los reexecuta só o fragmento do formulário."""
     # Usamos st.session_state para manter o tipo de operação selecionado
     if "tipo_operacao" not in st.session_state:
         st.session_state.tipo_operacao = ""
-
-    tipo_operacao = st.selectbox("Operação", [""] + TIPO_OPERACAO,
-                                 index=TIPO_OPERACAO.index(st.session_state.tipo_operacao) + 1 if st.session_state.tipo_operacao else 0,
-                                 key="tipo_operacao_select")
-
+    coluna_tipo, coluna_produtos = st.columns(2)
+    tipo_operacao = coluna_tipo.selectbox(
+        "Operação", [""] + TIPO_OPERACAO,
+        index=TIPO_OPERACAO.index(st.session_state.tipo_operacao) + 1 if st.session_state.tipo_operacao else 0,
+        key="tipo_operacao_select")
     st.session_state.tipo_operacao = tipo_operacao
 
+    if tipo_operacao not in TIPO_OPERACAO:
+        return tipo_operacao, "", "", 0
     if tipo_operacao == "Operação Terrestre":
-        nome_fazenda = st.text_input("Nome da fazenda", value=dados.get("nome_fazenda", ""), disabled=finalizando,
-                                   key="nome_fazenda")
-        talhao_aplicado = st.text_input("Talhão aplicado", value=dados.get("talhao_aplicado", ""),
-                                       disabled=finalizando, key="talhao_aplicado")
-        hectares_totais = st.number_input("Hectares totais", min_value=0.0, value=dados.get("hectares_totais", 0.0),
-                                         disabled=finalizando, key="hectares_totais")
-        cultura = st.text_input("Cultura", value=dados.get("cultura", ""), disabled=finalizando, key="cultura")
-        trator = st.text_input("Trator", value=dados.get("trator", ""), disabled=finalizando, key="trator")
-        implemento = st.text_input("Implemento", value=dados.get("implemento", ""), disabled=finalizando,
-                                   key="implemento")
-
-        # --- Campos de produtos para Operação Terrestre ---
-        num_produtos_terrestre = st.number_input("Número de Produtos", min_value=0, value=dados.get("num_produtos_terrestre", 1), step=1, disabled=finalizando, key="num_produtos_terrestre")
-        produtos_terrestre = []
-        for i in range(num_produtos_terrestre):
-            produto_atual = dados.get("produtos", [{}])[i] if i < len(dados.get("produtos", [])) else {"nome_produto": "", "dose": 0.0}
-            with st.container():
-                st.markdown(f"**Produto {i + 1}**")
-                nome_produto = st.text_input("Nome do Produto", value=produto_atual.get("nome_produto", ""), disabled=finalizando, key=f"nome_produto_terrestre_{i}")
-                dose = st.number_input("Dose", min_value=0.0, value=produto_atual.get("dose", 0.0), disabled=finalizando, key=f"dose_terrestre_{i}")
-                produtos_terrestre.append({"nome_produto": nome_produto, "dose": dose})
-        # --- Fim dos campos de produtos ---
-
-        observacao = st.text_area("Observação", value=dados.get("observacao", ""), disabled=finalizando, key="observacao")
-        responsavel = st.text_input("Responsável pela Operação", value=dados.get("responsavel", ""),
-                                   disabled=finalizando, key="responsavel")
-
-        return {
-            "mes": mes,
-            "ano": ano,
-            "tipo_operacao": tipo_operacao,
-            "nome_fazenda": nome_fazenda,
-            "talhao_aplicado": talhao_aplicado,
-            "hectares_totais": hectares_totais,
-            "cultura": cultura,
-            "trator": trator,
-            "implemento": implemento,
-            "produtos": produtos_terrestre,  # Usamos a lista de produtos terrestres
-            "observacao": observacao,
-            "responsavel": responsavel,
-            "status": "Em aberto",
-            "num_produtos_terrestre": num_produtos_terrestre #Adicionado para persistir o numero
-        }
-
-    elif tipo_operacao == "Operação Aérea":
-        nome_fazenda = st.text_input("Nome da fazenda", value=dados.get("nome_fazenda", ""), disabled=finalizando,
-                                   key="nome_fazenda")
-        talhao_aplicado = st.text_input("Talhão aplicado", value=dados.get("talhao_aplicado", ""),
-                                       disabled=finalizando, key="talhao_aplicado")
-        hectares_totais = st.number_input("Hectares totais", min_value=0.0, value=dados.get("hectares_totais", 0.0),
-                                         disabled=finalizando, key="hectares_totais")
-        cultura = st.text_input("Cultura", value=dados.get("cultura", ""), disabled=finalizando, key="cultura")
-        velocidade = st.number_input("Velocidade", min_value=0.0, value=dados.get("velocidade", 0.0), key="velocidade")
-        altura = st.number_input("Altura", min_value=0.0, value=dados.get("altura", 0.0), key="altura")
-        status = st.selectbox("Status", ["Em aberto", "Finalizado"],
-                             index=0 if dados.get("status", "Em aberto") == "Em aberto" else 1, disabled=finalizando,
-                             key="status")
-        num_produtos = st.number_input("Número de Produtos", min_value=0,  value= len(dados.get("produtos",[{}])), #Mudança aqui
-                                      step=1, disabled=finalizando, key="num_produtos")
-
-        produtos = []
-        for i in range(num_produtos):
-            produto_atual = dados.get("produtos", [{}])[i] if i < len(dados.get("produtos", [])) else {
-                "nome": "", "dose_por_hectare": 0.0}
-            with st.container():
-                st.markdown(f"**Produto {i + 1}**")
-                nome_produto = st.text_input("Nome do Produto", value=produto_atual.get("nome", ""),
-                                            disabled=finalizando, key=f"produto_nome_{i}")
-                dose_por_hectare = st.number_input("Dose por Hectare", min_value=0.0,
-                                                 value=produto_atual.get("dose_por_hectare", 0.0),
-                                                 disabled=finalizando, key=f"produto_dose_{i}")
-                dose_total = hectares_totais * dose_por_hectare
-                st.write(f"Dose Total: {dose_total:.2f}")
-                produtos.append(
-                    {"nome": nome_produto, "dose_por_hectare": dose_por_hectare, "dose_total": dose_total})
-
-        aeronave = st.text_input("Aeronave", value=dados.get("aeronave", ""), disabled=finalizando, key="aeronave")
-        responsavel = st.text_input("Responsável pela Aplicação", value=dados.get("responsavel", ""),
-                                   disabled=finalizando, key="responsavel")
-
-        return {
-            "mes": mes,
-            "ano": ano,
-            "tipo_operacao": tipo_operacao,
-            "nome_fazenda": nome_fazenda,
-            "talhao_aplicado": talhao_aplicado,
-            "hectares_totais": hectares_totais,
-            "cultura": cultura,
-            "velocidade": velocidade,
-            "altura": altura,
-            "status": status,
-            "produtos": produtos,
-            "aeronave": aeronave,
-            "responsavel": responsavel,
-        }
+        num_produtos = coluna_produtos.number_input("Número de Produtos", min_value=0,
+                                                    value=dados.get("num_produtos_terrestre", 1), step=1,
+                                                    disabled=finalizando, key="num_produtos_terrestre")
     else:
-        return {
-            "mes": mes,
-            "ano": ano,
-            "tipo_operacao": tipo_operacao,
-            "produtos": []
-        }
-
+        num_produtos = coluna_produtos.number_input("Número de Produtos", min_value=0,
+                                                    value=len(dados.get("produtos", [{}])), step=1,
+                                                    disabled=finalizando, key="num_produtos")
+    coluna_fazenda, coluna_talhao = st.columns(2)
+    nome_fazenda = coluna_fazenda.text_input("Nome da fazenda", value=dados.get("nome_fazenda", ""),
+                                             disabled=finalizando, key="nome_fazenda")
+    talhao_aplicado = coluna_talhao.text_input("Talhão aplicado", value=dados.get("talhao_aplicado", ""),
+                                               disabled=finalizando, key="talhao_aplicado")
+    return tipo_operacao, nome_fazenda, talhao_aplicado, num_produtos
+
+@instrumentar
+def gerar_campos_formulario(dados, finalizando=False, rotulo_envio="Salvar"):
+    """Gera os campos do formulário, adaptando-se ao tipo de operação.
+
+    Os campos ficam num st.form, enviados de uma vez pelo botão `rotulo_envio`: digitar neles não reexecuta o
+    script. Retorna os dados e se o formulário foi enviado nesta execução.
+    """
+    tipo_operacao, nome_fazenda, talhao_aplicado, num_produtos = _campos_dinamicos(dados, finalizando)
+
+    with st.form("form_operacao"):
+        mes = st.selectbox("Mês", MESES, index=MESES.index(dados.get("mes", "Janeiro")) if "mes" in dados else 0,
+                           disabled=finalizando, key="mes")
+        ano_atual = datetime.datetime.now().year
+        ano = st.number_input("Ano", min_value=2000, max_value=2100, value=dados.get("ano", ano_atual),
+                              disabled=finalizando, key="ano")
+
+        if tipo_operacao == "Operação Terrestre":
+            hectares_totais = _campo_hectares(dados, nome_fazenda, talhao_aplicado, finalizando)
+            cultura = st.text_input("Cultura", value=dados.get("cultura", ""), disabled=finalizando, key="cultura")
+            trator = st.text_input("Trator", value=dados.get("trator", ""), disabled=finalizando, key="trator")
+            implemento = st.text_input("Implemento", value=dados.get("implemento", ""), disabled=finalizando,
+                                       key="implemento")
+
+            # --- Campos de produtos para Operação Terrestre ---
+            produtos_terrestre = []
+            for i in range(num_produtos):
+                produto_atual = dados.get("produtos", [{}])[i] if i < len(dados.get("produtos", [])) else {"nome_produto": "", "dose": 0.0}
+                with st.container():
+                    st.markdown(f"**Produto {i + 1}**")
+                    nome_produto = st.text_input("Nome do Produto", value=produto_atual.get("nome_produto", ""), disabled=finalizando, key=f"nome_produto_terrestre_{i}")
+                    dose = st.number_input("Dose", min_value=0.0, value=produto_atual.get("dose", 0.0), disabled=finalizando, key=f"dose_terrestre_{i}")
+                    produtos_terrestre.append({"nome_produto": nome_produto, "dose": dose})
+            # --- Fim dos campos de produtos ---
+
+            observacao = st.text_area("Observação", value=dados.get("observacao", ""), disabled=finalizando, key="observacao")
+            responsavel = st.text_input("Responsável pela Operação", value=dados.get("responsavel", ""),
+                                        disabled=finalizando, key="responsavel")
+            enviado = st.form_submit_button(rotulo_envio, disabled=finalizando)
+
+            return {
+                "mes": mes,
+                "ano": ano,
+                "tipo_operacao": tipo_operacao,
+                "nome_fazenda": nome_fazenda,
+                "talhao_aplicado": talhao_aplicado,
+                "hectares_totais": hectares_totais,
+                "cultura": cultura,
+                "trator": trator,
+                "implemento": implemento,
+                "produtos": produtos_terrestre,  # Usamos a lista de produtos terrestres
+                "observacao": observacao,
+                "responsavel": responsavel,
+                "status": "Em aberto",
+                "num_produtos_terrestre": num_produtos #Adicionado para persistir o numero
+            }, enviado
+
+        elif tipo_operacao == "Operação Aérea":
+            hectares_totais = _campo_hectares(dados, nome_fazenda, talhao_aplicado, finalizando)
+            cultura = st.text_input("Cultura", value=dados.get("cultura", ""), disabled=finalizando, key="cultura")
+            velocidade = st.number_input("Velocidade", min_value=0.0, value=dados.get("velocidade", 0.0),
+                                         key="velocidade")
+            altura = st.number_input("Altura", min_value=0.0, value=dados.get("altura", 0.0), key="altura")
+            status = st.selectbox("Status", ["Em aberto", "Finalizado"],
+                                  index=0 if dados.get("status", "Em aberto") == "Em aberto" else 1,
+                                  disabled=finalizando, key="status")
+
+            produtos = []
+            for i in range(num_produtos):
+                produto_atual = dados.get("produtos", [{}])[i] if i < len(dados.get("produtos", [])) else {
+                    "nome": "", "dose_por_hectare": None}
+                with st.container():
+                    st.markdown(f"**Produto {i + 1}**")
+                    nome_produto = st.text_input("Nome do Produto", value=produto_atual.get("nome", ""),
+                                                 disabled=finalizando, key=f"produto_nome_{i}")
+                    dose_por_hectare = st.number_input("Dose por Hectare", min_value=MINIMO_POSITIVO,
+                                                       value=_valor_positivo(produto_atual.get("dose_por_hectare")),
+                                                       disabled=finalizando, key=f"produto_dose_{i}",
+                                                       help=AJUDA_DOSE_TOTAL)
+                    produtos.append({"nome": nome_produto, "dose_por_hectare": dose_por_hectare,
+                                     "dose_total": (hectares_totais or 0.0) * (dose_por_hectare or 0.0)})
+
+            aeronave = st.text_input("Aeronave", value=dados.get("aeronave", ""), disabled=finalizando,
+                                     key="aeronave")
+            responsavel = st.text_input("Responsável pela Aplicação", value=dados.get("responsavel", ""),
+                                        disabled=finalizando, key="responsavel")
+            enviado = st.form_submit_button(rotulo_envio, disabled=finalizando)
+
+            return {
+                "mes": mes,
+                "ano": ano,
+                "tipo_operacao": tipo_operacao,
+                "nome_fazenda": nome_fazenda,
+                "talhao_aplicado": talhao_aplicado,
+                "hectares_totais": hectares_totais,
+                "cultura": cultura,
+                "velocidade": velocidade,
+                "altura": altura,
+                "status": status,
+                "produtos": produtos,
+                "aeronave": aeronave,
+                "responsavel": responsavel,
+            }, enviado
+        else:
+            enviado = st.form_submit_button(rotulo_envio, disabled=finalizando)
+            return {
+                "mes": mes,
+                "ano": ano,
+                "tipo_operacao": tipo_operacao,
+                "produtos": []
+            }, enviado
+
+@instrumentar
 def exibir_barra_lateral():
     """Exibe a barra lateral."""
     with st.sidebar:
@@ -235,224 +341,304 @@ def exibir_barra_lateral():
             st.session_state.pagina_selecionada = PAGINA_FINANCEIRO
         if st.button("Gráficos"):  # Novo botão para a página de gráficos
             st.session_state.pagina_selecionada = PAGINA_GRAFICOS
-
+        if st.button("Tendências"):
+            st.session_state.pagina_selecionada = PAGINA_TENDENCIAS
+        if st.button("Importar dados"):
+            st.session_state.pagina_selecionada = PAGINA_IMPORTAR
+        if st.button("Mapa dos talhões"):
+            st.session_state.pagina_selecionada = PAGINA_MAPA
+
+@st.fragment
+def _formulario_operacao(dados_edicao, id_registro=None):
+    """Formulário de criação (ou edição de `id_registro`) num fragmento: mudar o tipo ou o número de produtos
+    reexecuta só ele, e um envio com erros de validação também, sem recarregar a barra lateral e os dados."""
+    rotulo = "Criar Registro" if id_registro is None else "Salvar edição"
+    dados, enviado = gerar_campos_formulario(dados_edicao, rotulo_envio=rotulo)
+    if not enviado:
+        return
+    erros = validar_campos(dados)
+    if erros:
+        for erro in erros.values():
+            st.error(erro)
+        return
+    if id_registro is not None:
+        dados["id"] = id_registro
+        if "telemetria" in dados_edicao:  # Os logs de voo não passam pelo formulário
+            dados["telemetria"] = dados_edicao["telemetria"]
+    if salvar_registro(dados):
+        if id_registro is not None:
+            del st.session_state.registro_editando_id
+        st.toast("Registro criado com sucesso!" if id_registro is None else "Registro editado com sucesso!")
+        st.session_state.pagina_selecionada = PAGINA_EDITOR
+        st.rerun()  # Execução completa, para abrir o editor já com o registro salvo
+
+@instrumentar
 def exibir_pagina_registro():
     """Exibe a página de registro."""
     st.header("Registro de operações")
 
-    if "registro_editando" in st.session_state:
-        dados_edicao = st.session_state.registro_editando
+    if "registro_editando_id" in st.session_state:
+        dados_edicao = ler_registro(st.session_state.registro_editando_id)
+        if dados_edicao is None:
+            # O registro foi excluído (por exemplo, em outra sessão) depois de aberto para edição
+            del st.session_state.registro_editando_id
+            st.warning("O registro em edição não existe mais.")
+            return
         st.subheader("Editando Registro")
-        dados = gerar_campos_formulario(dados_edicao)
-        if st.button("Salvar edição", type="secondary"):
-            erros = validar_campos(dados)
-            if not erros:
-                registros = carregar_registros()
-                index_edicao = registros.index(st.session_state.registro_editando)
-                registros[index_edicao] = dados
-                del st.session_state.registro_editando
-                salvar_registros(registros)
-                st.success("Registro editado com sucesso!")
-                st.session_state.pagina_selecionada = PAGINA_EDITOR
+        _formulario_operacao(dados_edicao, st.session_state.registro_editando_id)
     else:
         st.subheader("Novo Registro")
-        dados = gerar_campos_formulario({})
-        if st.button("Criar Registro"):
-            erros = validar_campos(dados)
-            if not erros:
-                registros = carregar_registros()
-                registros.append(dados)
-                salvar_registros(registros)
-                st.success("Registro criado com sucesso!")
-                st.session_state.pagina_selecionada = PAGINA_EDITOR
-            else:
-                for erro in erros.values():
-                    st.error(erro)
+        _formulario_operacao({})
+
+def _exibir_registro_editor(registro, somente_leitura=False):
+    """Exibe um registro do editor com os botões de editar, finalizar e excluir (sem eles, se `somente_leitura`)."""
+    with st.container():
+        st.markdown("<div class='registro-container'>", unsafe_allow_html=True)
+        st.write(f"**Tipo de Operação:** {registro.get('tipo_operacao', 'N/A')}")
+        if registro.get('tipo_operacao') == 'Operação Terrestre':
+            st.write(
+                f"**Fazenda:** {registro.get('nome_fazenda', 'N/A')}, **Talhão:** {registro.get('talhao_aplicado', 'N/A')}")
+            st.write(
+                f"**Hectares:** {registro.get('hectares_totais', 'N/A')}, **Cultura:** {registro.get('cultura', 'N/A')}")
+            st.write(
+                f"**Trator:** {registro.get('trator', 'N/A')}, **Implemento:** {registro.get('implemento', 'N/A')}")
+            st.write("**Produtos:**")
+            for produto in registro.get('produtos', []):
+                st.write(
+                    f"- {produto.get('nome_produto', 'N/A')}: Dose: {produto.get('dose', 'N/A')}")
+            st.write(f"**Observação:** {registro.get('observacao', 'N/A')}")
+            st.write(f"**Responsável:** {registro.get('responsavel', 'N/A')}")
+
+        elif registro.get('tipo_operacao') == 'Operação Aérea':
+            st.write(
+                f"**Fazenda:** {registro.get('nome_fazenda', 'N/A')}, **Talhão:** {registro.get('talhao_aplicado', 'N/A')}, **Status:** {registro.get('status', 'N/A')}")
+            st.write(
+                f"**Hectares:** {registro.get('hectares_totais', 'N/A')}, **Cultura:** {registro.get('cultura', 'N/A')}")
+            st.write(
+                f"**Velocidade:** {registro.get('velocidade', 'N/A')}, **Altura:** {registro.get('altura', 'N/A')}")
+            if registro.get('telemetria'):
+                telemetria = registro['telemetria']
+                st.write(
+                    f"**Logs de voo ({len(telemetria['voos'])}):** {telemetria['hectares_cobertos']} ha cobertos, "
+                    f"{telemetria['volume_litros'] if telemetria['volume_litros'] is not None else 'N/A'} L, "
+                    f"dose real {telemetria['dose_real'] if telemetria['dose_real'] is not None else 'N/A'} L/ha")
+            st.write("**Produtos:**")
+            for produto in registro.get('produtos', []):
+                st.write(
+                    f"- {produto.get('nome', 'N/A')}: {produto.get('dose_por_hectare', 'N/A')} (Dose total: {produto.get('dose_total', 'N/A'):.2f}")
+            st.write(f"**Aeronave:** {registro.get('aeronave', 'N/A')}")
+            st.write(f"**Responsável:** {registro.get('responsavel', 'N/A')}")
+
+        if somente_leitura:
+            st.markdown("</div>", unsafe_allow_html=True)
+            return
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("Editar", key=f"editar_{registro['id']}"):
+                st.session_state.registro_editando_id = registro["id"]
+                st.session_state.pagina_selecionada = PAGINA_REGISTRO
+                st.rerun()
+        with col2:
+            if registro.get('tipo_operacao') == 'Operação Aérea' and registro.get('status') == "Em aberto":
+                if st.button("Finalizar", key=f"finalizar_{registro['id']}"):
+                    if salvar_registro(dict(registro, status="Finalizado")):
+                        st.success("Registro finalizado com sucesso!")
+                        st.rerun()
+        with col3:
+            if st.button("Excluir", key=f"excluir_{registro['id']}"):
+                if excluir_registro(registro["id"]):
+                    st.success("Registro excluído com sucesso!")
+                    st.rerun()
+        st.markdown("</div>", unsafe_allow_html=True)
+
+def _alterar_filtro_busca(faceta):
+    """Guarda o valor escolhido num filtro da busca do editor."""
+    st.session_state.editor_filtros[faceta] = st.session_state[f"editor_faceta_{faceta}"]
+
+def _exibir_busca_editor():
+    """Exibe a busca do editor (texto e filtros por faceta) e seus resultados; devolve se há uma busca ativa."""
+    texto = st.text_input("Buscar", key="editor_busca",
+                          placeholder="Fazenda, talhão, cultura, aeronave, trator, responsável ou produto")
+    # Os filtros ficam guardados à parte: as opções e contagens mudam a cada busca, o que recria os selectbox
+    filtros = {faceta: valor for faceta, valor in st.session_state.setdefault("editor_filtros", {}).items()
+               if valor != SEM_FILTRO}
+    resultado = buscar_operacoes(texto, filtros, limite=LIMITE_BUSCA_EDITOR)
+    with st.expander("Filtros", expanded=bool(filtros)):
+        colunas = st.columns(3)
+        for i, faceta in enumerate(FACETAS_BUSCA):
+            contagens = dict(resultado["facetas"][faceta])
+            opcoes = [SEM_FILTRO] + list(contagens)
+            if faceta in filtros and filtros[faceta] not in contagens:
+                opcoes.append(filtros[faceta])
+            with colunas[i % 3]:
+                st.selectbox(ROTULOS_FACETAS[faceta], opcoes, index=opcoes.index(filtros.get(faceta, SEM_FILTRO)),
+                             key=f"editor_faceta_{faceta}", on_change=_alterar_filtro_busca, args=(faceta,),
+                             format_func=lambda valor, c=contagens: valor if valor == SEM_FILTRO
+                             else f"{valor} ({c.get(valor, 0)})")
+    if not texto.split() and not filtros:
+        return False
+
+    registros = resultado["registros"]
+    if not registros:
+        st.info("Nenhuma operação encontrada.")
+        return True
+    st.caption(f"{resultado['total']} operações encontradas"
+               + (f"; exibindo as {len(registros)} mais recentes." if resultado["total"] > len(registros) else "."))
+    st.markdown(ESTILO_REGISTRO_EDITOR, unsafe_allow_html=True)
+    arquivados = set(anos_arquivados())
+    for registro in registros:
+        st.write(f"**{registro.get('mes', '')}/{registro.get('ano', '')}**")
+        _exibir_registro_editor(registro, registro.get("ano") in arquivados)
+    return True
 
+@instrumentar
 def exibir_pagina_editor():
-    """Exibe a página do editor, separando por anos e meses."""
-    st.header("Editor Operacional")
-    registros = carregar_registros()
+    """Exibe a página do editor, separando por anos e meses.
 
-    registros_por_ano = {}
-    for registro in registros:
-        ano = registro['ano']
-        mes = registro['mes']
-        if ano not in registros_por_ano:
-            registros_por_ano[ano] = {}
-        if mes not in registros_por_ano[ano]:
-            registros_por_ano[ano][mes] = []
-        registros_por_ano[ano][mes].append(registro)
-
-    anos = sorted(registros_por_ano.keys(), reverse=True)
+    Só os registros do ano selecionado são carregados; apenas o mês selecionado é renderizado,
+    e seus registros são paginados. Com uma busca ativa, exibe os resultados dela no lugar.
+    """
+    st.header("Editor Operacional")
+    if _exibir_busca_editor():
+        return
+    anos = anos_com_registros()
     ano_selecionado = st.radio("Selecione o Ano", anos, horizontal=True)
 
     if ano_selecionado:
         st.subheader(f"Registros de {ano_selecionado}")
-        for mes in MESES:
-            if mes in registros_por_ano[ano_selecionado]:
-                with st.expander(f"Mês: {mes}", expanded=False):
-                    for i, registro in enumerate(registros_por_ano[ano_selecionado][mes]):
-                        st.markdown(
-                            f"""
-                            <style>
-                            .registro-container-{ano_selecionado}-{mes}-{registro.get('nome_fazenda', 'N/A')}-{registro.get('talhao_aplicado', 'N/A')} {{
-                                border: 1px solid #4CAF50;
-                                border-radius: 5px;
-                                padding: 10px;
-                                margin-bottom: 10px;
-                                display: flex;
-                                flex-direction: column;
-                                align-items: center;
-                                text-align: center;
-                                width: 95%;
-                                margin-left: auto;
-                                margin-right: auto;
-                            }}
-                            .registro-container-{ano_selecionado}-{mes}-{registro.get('nome_fazenda', 'N/A')}-{registro.get('talhao_aplicado', 'N/A')} .stButton>button {{
-                                background-color: #4CAF50;
-                                color: white;
-                                border: none;
-                                border-radius: 5px;
-                                padding: 5px 10px;
-                                cursor: pointer;
-                            }}
-                            .registro-container-{ano_selecionado}-{mes}-{registro.get('nome_fazenda', 'N/A')}-{registro.get('talhao_aplicado', 'N/A')} .stButton>button:hover {{
-                                background-color: #45a049;
-                            }}
-                            </style>
-                            """,
-                            unsafe_allow_html=True
-                        )
-                        with st.container():
-                            st.markdown(
-                                f"<div class='registro-container-{ano_selecionado}-{mes}-{registro.get('nome_fazenda', 'N/A')}-{registro.get('talhao_aplicado', 'N/A')}'>",
-                                unsafe_allow_html=True)
-                            st.write(f"**Tipo de Operação:** {registro.get('tipo_operacao', 'N/A')}")
-                            if registro.get('tipo_operacao') == 'Operação Terrestre':
-                                st.write(
-                                    f"**Fazenda:** {registro.get('nome_fazenda', 'N/A')}, **Talhão:** {registro.get('talhao_aplicado', 'N/A')}")
-                                st.write(
-                                    f"**Hectares:** {registro.get('hectares_totais', 'N/A')}, **Cultura:** {registro.get('cultura', 'N/A')}")
-                                st.write(
-                                    f"**Trator:** {registro.get('trator', 'N/A')}, **Implemento:** {registro.get('implemento', 'N/A')}")
-                                st.write("**Produtos:**")
-                                for produto in registro.get('produtos', []):
-                                    st.write(
-                                        f"- {produto.get('nome_produto', 'N/A')}: Dose: {produto.get('dose', 'N/A')}")
-                                st.write(f"**Observação:** {registro.get('observacao', 'N/A')}")
-                                st.write(f"**Responsável:** {registro.get('responsavel', 'N/A')}")
-
-                            elif registro.get('tipo_operacao') == 'Operação Aérea':
-                                st.write(
-                                    f"**Fazenda:** {registro.get('nome_fazenda', 'N/A')}, **Talhão:** {registro.get('talhao_aplicado', 'N/A')}, **Status:** {registro.get('status', 'N/A')}")
-                                st.write(
-                                    f"**Hectares:** {registro.get('hectares_totais', 'N/A')}, **Cultura:** {registro.get('cultura', 'N/A')}")
-                                st.write(
-                                    f"**Velocidade:** {registro.get('velocidade', 'N/A')}, **Altura:** {registro.get('altura', 'N/A')}")
-                                st.write("**Produtos:**")
-                                for produto in registro.get('produtos', []):
-                                    st.write(
-                                        f"- {produto.get('nome', 'N/A')}: {produto.get('dose_por_hectare', 'N/A')} (Dose total: {produto.get('dose_total', 'N/A'):.2f}")
-                                st.write(f"**Aeronave:** {registro.get('aeronave', 'N/A')}")
-                                st.write(f"**Responsável:** {registro.get('responsavel', 'N/A')}")
-
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                if st.button("Editar",
-                                             key=f"editar_{registro.get('nome_fazenda', 'N/A')}_{registro.get('talhao_aplicado', 'N/A')}_{registro.get('mes', 'N/A')}_{ano_selecionado}_{i}"):
-                                    st.session_state.registro_editando = registro
-                                    st.session_state.pagina_selecionada = PAGINA_REGISTRO
-                                    st.rerun()
-                            with col2:
-                                if registro.get('tipo_operacao') == 'Operação Aérea' and registro.get('status') == "Em aberto":
-                                    if st.button("Finalizar",
-                                                 key=f"finalizar_{registro.get('nome_fazenda', 'N/A')}_{registro.get('talhao_aplicado', 'N/A')}_{registro.get('mes', 'N/A')}_{ano_selecionado}_{i}"):
-                                        registro['status'] = "Finalizado"
-                                        salvar_registros(registros)
-                                        st.success("Registro finalizado com sucesso!")
-                                        st.rerun()
-                            with col3:
-                                if st.button("Excluir",
-                                             key=f"excluir_{registro.get('nome_fazenda', 'N/A')}_{registro.get('talhao_aplicado', 'N/A')}_{registro.get('mes', 'N/A')}_{ano_selecionado}_{i}"):
-                                    registros.remove(registro)
-                                    salvar_registros(registros)
-                                    st.success("Registro excluído com sucesso!")
-                                    st.rerun()
-                            st.markdown("</div>", unsafe_allow_html=True)
-            else:
-                st.info(f"Nenhum registro para {mes}/{ano_selecionado}.")
-
+        somente_leitura = ano_selecionado in anos_arquivados()
+        if somente_leitura:
+            st.caption(f"{ano_selecionado} está arquivado: os registros são somente leitura.")
+        registros_do_ano = agrupar_registros_por_ano_mes(carregar_registros_do_ano(ano_selecionado)).get(
+            ano_selecionado, {})
+        meses_com_registros = [m for m in MESES if m in registros_do_ano]
+        # Registros antigos ou importados podem ter o mês ausente ou escrito de outra forma
+        fora_dos_meses = sum(len(lista) for m, lista in registros_do_ano.items() if m not in MESES)
+        if fora_dos_meses:
+            st.warning(f"{fora_dos_meses} registro(s) de {ano_selecionado} sem um mês válido não aparecem aqui.")
+        col_mes, col_tamanho = st.columns([3, 1])
+        with col_mes:
+            mes = st.selectbox("Mês", MESES, key=f"editor_mes_{ano_selecionado}",
+                               index=MESES.index(meses_com_registros[-1]) if meses_com_registros else 0,
+                               format_func=lambda m: f"{m} ({len(registros_do_ano.get(m, []))})")
+        with col_tamanho:
+            tamanho_pagina = st.selectbox("Registros por página", TAMANHOS_PAGINA_EDITOR, key="editor_tamanho_pagina")
+
+        registros_do_mes = registros_do_ano.get(mes, [])
+        if not registros_do_mes:
+            st.info(f"Nenhum registro para {mes}/{ano_selecionado}.")
+            return
+
+        total_paginas = (len(registros_do_mes) - 1) // tamanho_pagina + 1
+        pagina = 1
+        if total_paginas > 1:
+            pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1,
+                                     key=f"editor_pagina_{ano_selecionado}_{mes}_{tamanho_pagina}")
+        inicio = (pagina - 1) * tamanho_pagina
+        st.caption(f"Exibindo {inicio + 1}–{min(inicio + tamanho_pagina, len(registros_do_mes))} "
+                   f"de {len(registros_do_mes)} registros (página {pagina} de {total_paginas}).")
+
+        # Uma única folha de estilo para todos os registros da página
+        st.markdown(ESTILO_REGISTRO_EDITOR, unsafe_allow_html=True)
+        for registro in registros_do_mes[inicio:inicio + tamanho_pagina]:
+            _exibir_registro_editor(registro, somente_leitura)
+
+@st.fragment(run_every=INTERVALO_PROGRESSO)
+def _acompanhar_tarefa(chave):
+    """Barra de progresso de uma tarefa em segundo plano: só este fragmento é refeito a cada intervalo, e a
+    página inteira uma vez, quando a tarefa termina."""
+    situacao = situacao_tarefa(chave)
+    if situacao is None or situacao["estado"] in TERMINADAS:
+        st.rerun()
+    st.progress(situacao["progresso"], text=f"{situacao['nome']}: {situacao['mensagem'] or situacao['estado']}...")
+
+def _resultado_ou_progresso(chave):
+    """Resultado da tarefa, se concluída; senão mostra o progresso (ou o erro, com a opção de repetir) e devolve
+    None. Interagir com a página enquanto isso não perde o trabalho: a tarefa continua no pool."""
+    resultado = resultado_tarefa(chave)
+    if resultado is not None:
+        return resultado
+    situacao = situacao_tarefa(chave)
+    if situacao is not None and situacao["estado"] == FALHOU:
+        st.error(f"Erro em {situacao['nome']}: {situacao['erro']}")
+        if st.button("Tentar novamente", key=f"repetir_{situacao['nome']}"):
+            descartar_tarefa(chave)
+            st.rerun()
+        return None
+    _acompanhar_tarefa(chave)
+    return None
+
+def _gerar_excel(progresso=None):
+    """Tarefa do Excel de exportação, com todos os registros da versão atual dos dados."""
+    return gerar_excel_operacoes(carregar_registros(), progresso=progresso)
+
+@instrumentar
 def exibir_pagina_exportar_excel():
     """Exibe a página de exportação para Excel."""
     st.header("Exportar Operações para Excel")
+    versao = versao_dados()
     registros = carregar_registros()
 
     if not registros:
         st.info("Nenhum registro para exportação")
         return
 
-    # Converter registros para DataFrame
-    dados_para_df = []
-    for registro in registros:
-        if registro.get('tipo_operacao') == "Operação Terrestre":
-            dados_para_df.append({
-                'Mês': registro.get('mes', 'N/A'),
-                'Ano': registro.get('ano', 'N/A'),
-                'Tipo de Operação': registro.get('tipo_operacao', 'N/A'),
-                'Fazenda': registro.get('nome_fazenda', 'N/A'),
-                'Talhão': registro.get('talhao_aplicado', 'N/A'),
-                'Hectares': registro.get('hectares_totais', 'N/A'),
-                'Cultura': registro.get('cultura', 'N/A'),
-                'Trator': registro.get('trator', 'N/A'),
-                'Implemento': registro.get('implemento', 'N/A'),
-                'Produto': registro.get('nome_produto', 'N/A'),
-                'Dose': registro.get('dose', 'N/A'),
-                'Observação': registro.get('observacao', 'N/A'),
-                'Responsável': registro.get('responsavel', 'N/A'),
-                'Status': registro.get('status', 'N/A')
-            })
-        elif registro.get('tipo_operacao') == 'Operação Aérea':
-            produtos_str = ""
-            for produto in registro.get('produtos', []):
-                produtos_str += f"{produto.get('nome', 'N/A')}: {produto.get('dose_por_hectare', 'N/A')} (Dose total: {produto.get('dose_total', 'N/A'):.2f}); "
-
-            dados_para_df.append({
-                'Mês': registro.get('mes', 'N/A'),
-                'Ano': registro.get('ano', 'N/A'),
-                'Tipo de Operação': registro.get('tipo_operacao', 'N/A'),
-                'Fazenda': registro.get('nome_fazenda', 'N/A'),
-                'Talhão': registro.get('talhao_aplicado', 'N/A'),
-                'Hectares': registro.get('hectares_totais', 'N/A'),
-                'Cultura': registro.get('cultura', 'N/A'),
-                'Velocidade': registro.get('velocidade', 'N/A'),
-                'Altura': registro.get('altura', 'N/A'),
-                'Produtos': produtos_str,
-                'Aeronave': registro.get('aeronave', 'N/A'),
-                'Responsável': registro.get('responsavel', 'N/A'),
-                'Status': registro.get('status', 'N/A')
-            })
-
-    df = pd.DataFrame(dados_para_df)
-
-    # Exibir o DataFrame na interface
-    st.dataframe(df)
-
-    # Botão para exportar para Excel
-    if st.button("Exportar para Excel"):
-        excel_file = "operacoes_exportadas.xlsx"
-        df.to_excel(excel_file, index=False)
-
-        with open(excel_file, "rb") as arquivo:
-            st.download_button(
-                label="Baixar arquivo Excel",
-                data=arquivo,
-                file_name=excel_file,
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-
-        os.remove(excel_file)
+    # O Excel é gerado em segundo plano enquanto as prévias são exibidas
+    chave = enviar_tarefa(TAREFA_EXCEL, _gerar_excel, versao=versao)
+
+    # Exibir uma prévia de cada aba na interface, lida da cópia colunar
+    abas = st.tabs([titulo_aba for titulo_aba, _ in ABAS_EXPORTACAO.values()])
+    for aba, tipo_operacao in zip(abas, ABAS_EXPORTACAO):
+        with aba:
+            st.dataframe(tabela_exportacao_colunar(tipo_operacao))
+
+    arquivo = _resultado_ou_progresso(chave)
+    if arquivo is not None:
+        st.download_button(
+            label="Baixar arquivo Excel",
+            data=arquivo,
+            file_name="operacoes_exportadas.xlsx",
+            mime=MIME_EXCEL
+        )
 
+    # Arquivos gerados antes das últimas alterações continuam disponíveis enquanto estiverem guardados
+    anteriores = [(chave_anterior, fim) for chave_anterior, fim in artefatos(TAREFA_EXCEL) if chave_anterior != chave]
+    if anteriores:
+        with st.expander("Arquivos gerados antes das últimas alterações"):
+            for chave_anterior, fim in anteriores:
+                gerado = datetime.datetime.fromtimestamp(fim)
+                arquivo_anterior = resultado_tarefa(chave_anterior)
+                if arquivo_anterior is not None:
+                    st.download_button(f"Baixar o Excel gerado em {gerado:%d/%m/%Y %H:%M:%S}", data=arquivo_anterior,
+                                       file_name=f"operacoes_exportadas_{gerado:%Y%m%d_%H%M%S}.xlsx",
+                                       mime=MIME_EXCEL, key=f"excel_{fim}")
+
+@instrumentar
+def exibir_pagina_importar():
+    """Exibe a página de importação em lote de operações e gastos."""
+    st.header("Importar Operações e Gastos")
+    st.write("Envie planilhas CSV ou Excel no formato da exportação: as colunas das abas Aérea e Terrestre "
+             "(uma linha por produto) ou as colunas Data, Descrição, Categoria e Valor dos gastos.")
+    arquivos = st.file_uploader("Arquivos", type=["csv", "xlsx"], accept_multiple_files=True)
+    apenas_validar = st.checkbox("Apenas validar, sem gravar")
+
+    if arquivos and st.button("Validar" if apenas_validar else "Importar"):
+        try:
+            resultado = importar_arquivos([(arquivo.name, arquivo) for arquivo in arquivos], gravar=not apenas_validar)
+        except Exception as e:
+            st.error(f"Erro ao importar: {e}")
+            return
+        mensagem = (f"{resultado['operacoes']} operações e {resultado['gastos']} gastos "
+                    f"{'importados' if resultado['gravado'] else 'válidos'}.")
+        st.success(mensagem)
+        if resultado["erros"]:
+            import pandas as pd
+
+            st.warning(f"{resultado['linhas_com_erro']} linhas com erro; "
+                       f"{resultado['operacoes_rejeitadas']} operações rejeitadas.")
+            st.dataframe(pd.DataFrame(resultado["erros"], columns=["arquivo", "aba", "linha", "campo", "mensagem"]))
+
+@instrumentar
 def exibir_pagina_financeiro():
     """Exibe a página financeira."""
     st.header("Financeiro")
@@ -475,115 +661,276 @@ def exibir_pagina_financeiro():
         with st.form("form_registrar_gasto"):
             descricao = st.text_input("Descrição do Gasto")
             valor = st.number_input("Valor do Gasto", min_value=0.0, format="%.2f")
-            categoria = st.selectbox("Categoria", ["Produtos", "Combustível", "Manutenção", "Outros"])
+            categoria = st.selectbox("Categoria", CATEGORIAS_GASTO)
             data = st.date_input("Data do Gasto")
+            fazenda = st.text_input("Fazenda (opcional)", help=AJUDA_FAZENDA_GASTO)
             if st.form_submit_button("Registrar Gasto"):
-                gastos = carregar_gastos()
                 novo_gasto = {
                     "descricao": descricao,
                     "valor": valor,
                     "categoria": categoria,
                     "data": data.strftime("%Y-%m-%d")
                 }
-                gastos.append(novo_gasto)
-                salvar_gastos(gastos)
-                st.success("Gasto registrado com sucesso!")
+                if salvar_gasto(_com_fazenda(novo_gasto, fazenda)):
+                    st.success("Gasto registrado com sucesso!")
 
     elif submenu_ativo == SUBMENU_EDITAR_REGISTRO:
         st.subheader("Editar Registro de Gastos")
-        gastos = carregar_gastos()
-        if not gastos:
+        anos = anos_com_gastos()
+        if not anos:
             st.info("Nenhum gasto registrado.")
         else:
-            # Organizar gastos por ano e mês
-            gastos_por_ano_mes = {}
-            for gasto in gastos:
-                data = datetime.datetime.strptime(gasto["data"], "%Y-%m-%d")
-                ano = data.year
-                mes = MESES[data.month - 1]  # Ajuste para índice base 0
-                if ano not in gastos_por_ano_mes:
-                    gastos_por_ano_mes[ano] = {}
-                if mes not in gastos_por_ano_mes[ano]:
-                    gastos_por_ano_mes[ano][mes] = []
-                gastos_por_ano_mes[ano][mes].append(gasto)
-
-            # Selecionar ano e mês
-            anos = sorted(gastos_por_ano_mes.keys(), reverse=True)
+            # Só os gastos do ano selecionado são carregados; o mês sai das colunas já convertidas
             ano_selecionado = st.selectbox("Selecione o Ano", anos)
             if ano_selecionado:
-                meses = sorted(gastos_por_ano_mes[ano_selecionado].keys(), key=lambda x: MESES.index(x))
+                somente_leitura = ano_selecionado in anos_arquivados()
+                if somente_leitura:
+                    st.caption(f"{ano_selecionado} está arquivado: os gastos são somente leitura.")
+                gastos_do_ano = carregar_gastos_tabela(ano_selecionado)
+                gastos_por_id = indexar_por_id(carregar_gastos_do_ano(ano_selecionado))
+                meses = [MESES[numero - 1] for numero in sorted(gastos_do_ano["mes_numero"].unique().tolist())]
                 mes_selecionado = st.selectbox("Selecione o Mês", meses)
                 if mes_selecionado:
-                    gastos_mes = gastos_por_ano_mes[ano_selecionado][mes_selecionado]
-                    for i, gasto in enumerate(gastos_mes):
+                    gastos_mes = gastos_do_ano[gastos_do_ano["mes_numero"] == MESES.index(mes_selecionado) + 1]
+                    for i, linha in enumerate(gastos_mes.itertuples(index=False)):
+                        gasto = gastos_por_id[linha.id]
                         with st.expander(f"Gasto {i + 1}: {gasto['descricao']}"):
-                            with st.form(f"form_editar_gasto_{i}"):
+                            with st.form(f"form_editar_gasto_{gasto['id']}"):
                                 descricao = st.text_input("Descrição do Gasto", value=gasto["descricao"])
                                 valor = st.number_input("Valor do Gasto", min_value=0.0, value=gasto["valor"], format="%.2f")
-                                categoria = st.selectbox("Categoria", ["Produtos", "Combustível", "Manutenção", "Outros"], index=["Produtos", "Combustível", "Manutenção", "Outros"].index(gasto["categoria"]))
-                                data = st.date_input("Data do Gasto", value=datetime.datetime.strptime(gasto["data"], "%Y-%m-%d"))
-                                if st.form_submit_button("Salvar Alterações"):
-                                    gasto["descricao"] = descricao
-                                    gasto["valor"] = valor
-                                    gasto["categoria"] = categoria
-                                    gasto["data"] = data.strftime("%Y-%m-%d")
-                                    salvar_gastos(gastos)
-                                    st.success("Gasto atualizado com sucesso!")
-                                if st.form_submit_button("Excluir Gasto"):
-                                    gastos.remove(gasto)
-                                    salvar_gastos(gastos)
-                                    st.success("Gasto excluído com sucesso!")
-                                    st.rerun()
+                                categoria = st.selectbox("Categoria", CATEGORIAS_GASTO, index=CATEGORIAS_GASTO.index(gasto["categoria"]))
+                                data = st.date_input("Data do Gasto", value=linha.data.date())
+                                fazenda = st.text_input("Fazenda (opcional)", value=gasto.get("nome_fazenda", ""),
+                                                        help=AJUDA_FAZENDA_GASTO)
+                                if st.form_submit_button("Salvar Alterações", disabled=somente_leitura):
+                                    alterado = dict(gasto, descricao=descricao, valor=valor, categoria=categoria,
+                                                    data=data.strftime("%Y-%m-%d"))
+                                    if salvar_gasto(_com_fazenda(alterado, fazenda)):
+                                        st.success("Gasto atualizado com sucesso!")
+                                if st.form_submit_button("Excluir Gasto", disabled=somente_leitura):
+                                    if excluir_gasto(gasto["id"]):
+                                        st.success("Gasto excluído com sucesso!")
+                                        st.rerun()
 
+@instrumentar
+def _agregar_graficos(ano, ano_inicial, ano_final, progresso):
+    """Tarefa das agregações da página de gráficos: consumo de produtos do ano e custo por hectare do período."""
+    progresso(0.0, "Consumo de produtos")
+    consumo = consumo_produtos(ano, ano)
+    progresso(1 / 3, "Custo por hectare por fazenda")
+    por_fazenda = custo_por_hectare(ano_inicial, ano_final, por_fazenda=True)
+    progresso(2 / 3, "Custo por hectare")
+    return {"consumo": consumo, "por_fazenda": por_fazenda, "geral": custo_por_hectare(ano_inicial, ano_final)}
+
+@instrumentar
 def exibir_pagina_graficos():
     """Exibe a página de gráficos."""
+    import pandas as pd
+    import plotly.express as px  # Para criar gráficos interativos
+
     st.header("Gráficos")
 
-    # Carregar dados
-    registros = carregar_registros()
-    gastos = carregar_gastos()
+    # Carregar os resumos mensais já agregados
+    resumos = carregar_resumos_mensais()
 
     # Selecionar ano e mês
-    anos_disponiveis = sorted(list(set([registro["ano"] for registro in registros] + [datetime.datetime.strptime(gasto["data"], "%Y-%m-%d").year for gasto in gastos])), reverse=True)
+    anos_disponiveis = sorted({ano for ano, _ in resumos["operacoes"]} | {ano for ano, _ in resumos["gastos"]}, reverse=True)
     ano_selecionado = st.selectbox("Selecione o Ano", anos_disponiveis)
 
     meses_disponiveis = MESES
     mes_selecionado = st.selectbox("Selecione o Mês", meses_disponiveis)
 
-    # Filtrar dados pelo ano e mês selecionados
-    registros_filtrados = [registro for registro in registros if registro["ano"] == ano_selecionado and registro["mes"] == mes_selecionado]
-    gastos_filtrados = [gasto for gasto in gastos if datetime.datetime.strptime(gasto["data"], "%Y-%m-%d").year == ano_selecionado and MESES[datetime.datetime.strptime(gasto["data"], "%Y-%m-%d").month - 1] == mes_selecionado]
+    # Buscar os totais do ano e mês selecionados
+    gastos_do_mes = resumos["gastos"].get((ano_selecionado, mes_selecionado), {})
+    hectares_do_mes = resumos["operacoes"].get((ano_selecionado, mes_selecionado), {})
 
     # Gráfico 1: Gastos Mensais por Categoria
-    if gastos_filtrados:
-        df_gastos = pd.DataFrame(gastos_filtrados)
-        df_gastos_agrupados = df_gastos.groupby("categoria")["valor"].sum().reset_index()
+    if gastos_do_mes:
+        df_gastos_agrupados = pd.DataFrame({"categoria": list(gastos_do_mes), "valor": list(gastos_do_mes.values())})
         total_gastos = df_gastos_agrupados["valor"].sum()
-        fig_gastos = px.pie(df_gastos_agrupados, values="valor", names="categoria", title=f"Gastos Mensais em {mes_selecionado}/{ano_selecionado}",
-                            color_discrete_sequence=px.colors.sequential.Oranges)  # Cor laranja
-        fig_gastos.update_traces(hoverinfo='label+value', textinfo='none',  # Remove porcentagens e rótulos
-                                textposition='inside', textfont_size=15,
-                                insidetextorientation='radial')
-        fig_gastos.update_layout(annotations=[dict(text=f"R$ {total_gastos:.2f}", x=0.5, y=0.5, font_size=20, showarrow=False)])
+        with medir_trecho("figura_gastos"):
+            fig_gastos = px.pie(df_gastos_agrupados, values="valor", names="categoria", title=f"Gastos Mensais em {mes_selecionado}/{ano_selecionado}",
+                                color_discrete_sequence=px.colors.sequential.Oranges)  # Cor laranja
+            fig_gastos.update_traces(hoverinfo='label+value', textinfo='none',  # Remove porcentagens e rótulos
+                                    textposition='inside', textfont_size=15,
+                                    insidetextorientation='radial')
+            fig_gastos.update_layout(annotations=[dict(text=f"R$ {total_gastos:.2f}", x=0.5, y=0.5, font_size=20, showarrow=False)])
         st.plotly_chart(fig_gastos)
     else:
         st.info("Nenhum gasto registrado para o mês e ano selecionados.")
 
     # Gráfico 2: Hectares Realizados por Tipo de Operação
-    if registros_filtrados:
-        df_hectares = pd.DataFrame(registros_filtrados)
-        df_hectares_agrupados = df_hectares.groupby("tipo_operacao")["hectares_totais"].sum().reset_index()
+    if hectares_do_mes:
+        df_hectares_agrupados = pd.DataFrame({"tipo_operacao": list(hectares_do_mes),
+                                              "hectares_totais": list(hectares_do_mes.values())})
         total_hectares = df_hectares_agrupados["hectares_totais"].sum()
-        fig_hectares = px.pie(df_hectares_agrupados, values="hectares_totais", names="tipo_operacao", title=f"Hectares Realizados em {mes_selecionado}/{ano_selecionado}",
-                              color_discrete_sequence=px.colors.sequential.Greens)  # Cor verde
-        fig_hectares.update_traces(hoverinfo='label+value', textinfo='none',  # Remove porcentagens e rótulos
-                                  textposition='inside', textfont_size=15,
-                                  insidetextorientation='radial')
-        fig_hectares.update_layout(annotations=[dict(text=f"{total_hectares:.2f} ha", x=0.5, y=0.5, font_size=20, showarrow=False)])
+        with medir_trecho("figura_hectares"):
+            fig_hectares = px.pie(df_hectares_agrupados, values="hectares_totais", names="tipo_operacao", title=f"Hectares Realizados em {mes_selecionado}/{ano_selecionado}",
+                                  color_discrete_sequence=px.colors.sequential.Greens)  # Cor verde
+            fig_hectares.update_traces(hoverinfo='label+value', textinfo='none',  # Remove porcentagens e rótulos
+                                      textposition='inside', textfont_size=15,
+                                      insidetextorientation='radial')
+            fig_hectares.update_layout(annotations=[dict(text=f"{total_hectares:.2f} ha", x=0.5, y=0.5, font_size=20, showarrow=False)])
         st.plotly_chart(fig_hectares)
     else:
         st.info("Nenhum registro de operação para o mês e ano selecionados.")
 
+    # Gráficos 3 e 4 dependem das agregações mais pesadas, calculadas em segundo plano
+    agregados = None
+    if anos_disponiveis:
+        agregados = _resultado_ou_progresso(enviar_tarefa(TAREFA_GRAFICOS, _agregar_graficos, ano_selecionado,
+                                                          min(anos_disponiveis), max(anos_disponiveis),
+                                                          versao=versao_dados()))
+        if agregados is None:
+            return
+
+    # Gráfico 3: Consumo de Produtos no mês, com o detalhe por fazenda e talhão
+    consumo_do_ano = agregados["consumo"] if agregados is not None else None
+    if consumo_do_ano is not None and (consumo_do_ano["Mês"] == mes_selecionado).any():
+        consumo_do_mes = consumo_do_ano[consumo_do_ano["Mês"] == mes_selecionado]
+        por_produto = consumo_do_mes.groupby("Produto", as_index=False)["Consumo"].sum().sort_values("Consumo")
+        with medir_trecho("figura_produtos"):
+            fig_produtos = px.bar(por_produto, x="Consumo", y="Produto", orientation="h",
+                                  title=f"Consumo de Produtos em {mes_selecionado}/{ano_selecionado}",
+                                  color_discrete_sequence=px.colors.sequential.Blues[-3:])
+        st.plotly_chart(fig_produtos)
+        with st.expander("Consumo por fazenda e talhão"):
+            st.dataframe(consumo_do_mes.drop(columns=["Ano", "Mês", "Mês Número"]), hide_index=True)
+    else:
+        st.info("Nenhum produto aplicado no mês e ano selecionados.")
+
+    # Gráfico 4: Custo por Hectare (gastos com Produtos e Combustível / hectares) ao longo dos anos
+    st.subheader("Custo por Hectare")
+    if anos_disponiveis:
+        por_fazenda = agregados["por_fazenda"]
+        fazendas = sorted(set(por_fazenda["Fazenda"]) - {""})
+        fazenda_selecionada = st.selectbox("Fazenda", [TODAS_FAZENDAS] + fazendas)
+        if fazenda_selecionada == TODAS_FAZENDAS:
+            custos = agregados["geral"]
+        else:
+            custos = por_fazenda[por_fazenda["Fazenda"] == fazenda_selecionada]
+        custos = custos.dropna(subset=["R$/ha"])
+    if anos_disponiveis and not custos.empty:
+        with medir_trecho("figura_custo_hectare"):
+            fig_custos = px.line(custos.assign(Ano=custos["Ano"].astype(str)), x="Mês", y="R$/ha", color="Ano",
+                                 markers=True, category_orders={"Mês": MESES},
+                                 title=f"R$/ha por mês ({', '.join(CATEGORIAS_CUSTO_HECTARE)})")
+        st.plotly_chart(fig_custos)
+        with st.expander("Custo por hectare mês a mês"):
+            st.dataframe(custos.drop(columns=["Mês Número"]), hide_index=True)
+    else:
+        st.info("Sem gastos com produtos ou combustível e hectares no mesmo mês para calcular o custo por hectare.")
+
+@st.cache_data(max_entries=16)
+def _figura_tendencias(versao, data_inicial, data_final, granularidade):
+    """Monta a figura de tendências do período, mantida em cache até que os dados mudem (nova `versao`).
+
+    As séries chegam já somadas no servidor (series_tendencia), com poucos pontos mesmo em vários anos.
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    operacoes, granularidade_operacoes, gastos, granularidade_gastos = series_tendencia(
+        data_inicial, data_final, granularidade)
+    fig = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.08,
+                        subplot_titles=(f"Hectares ({granularidade_operacoes})",
+                                        f"Operações ({granularidade_operacoes})",
+                                        f"Gastos ({granularidade_gastos})"))
+    for coluna in operacoes.columns.drop("Operações"):
+        fig.add_trace(go.Bar(x=operacoes.index, y=operacoes[coluna], name=coluna), row=1, col=1)
+    fig.add_trace(go.Scatter(x=operacoes.index, y=operacoes["Operações"], name="Operações", mode="lines+markers"),
+                  row=2, col=1)
+    for coluna in gastos.columns:
+        fig.add_trace(go.Bar(x=gastos.index, y=gastos[coluna], name=coluna), row=3, col=1)
+    fig.update_layout(barmode="stack", height=850, legend=dict(orientation="h"))
+    return fig
+
+@instrumentar
+def exibir_pagina_tendencias():
+    """Exibe o painel de tendências de hectares, operações e gastos num período de vários anos."""
+    st.header("Tendências")
+
+    # O período padrão vai do primeiro ao último mês com movimento nos resumos mensais
+    resumos = carregar_resumos_mensais()
+    meses = sorted((ano, MESES.index(mes) + 1) for ano, mes in resumos["operacoes"].keys() | resumos["gastos"].keys())
+    if not meses:
+        st.info("Nenhum dado registrado.")
+        return
+    (primeiro_ano, primeiro_mes), (ultimo_ano, ultimo_mes) = meses[0], meses[-1]
+    inicio = datetime.date(primeiro_ano, primeiro_mes, 1)
+    fim = datetime.date(ultimo_ano, ultimo_mes, calendar.monthrange(ultimo_ano, ultimo_mes)[1])
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        periodo = st.date_input("Período", value=(inicio, fim))
+    with col2:
+        granularidade = st.selectbox("Agrupar por", list(GRANULARIDADES), index=1, format_func=str.capitalize)
+    if len(periodo) != 2:
+        st.info("Selecione a data final do período.")
+        return
+
+    with medir_trecho("figura_tendencias"):
+        figura = _figura_tendencias(versao_dados(), periodo[0], periodo[1], granularidade)
+    st.plotly_chart(figura, use_container_width=True)
+
+@st.cache_data(max_entries=8)
+def _mapa_em_cache(versao, nome_fazenda):
+    """Mantém o HTML do mapa em cache até que os dados mudem (nova `versao`).
+
+    As camadas de cada faixa de zoom já chegam simplificadas (talhoes.camadas_do_mapa).
+    """
+    return mapa_html(nome_fazenda)
+
+@instrumentar
+def exibir_pagina_mapa():
+    """Exibe o mapa dos talhões e a importação dos limites em KML."""
+    st.header("Mapa dos talhões")
+    fazendas = fazendas_com_talhoes()
+
+    with st.expander("Importar limites (KML)", expanded=not fazendas):
+        arquivo = st.file_uploader("Arquivo KML ou KMZ", type=["kml", "kmz"])
+        fazenda = st.text_input("Fazenda", help="Em branco, usa o nome da pasta do KML que contém cada talhão.")
+        if arquivo and st.button("Importar talhões"):
+            try:
+                quantidade, avisos = importar_kml(arquivo, fazenda.strip() or None)
+            except Exception as e:
+                st.error(f"Erro ao importar o KML: {e}")
+            else:
+                st.success(f"{quantidade} talhões importados.")
+                for aviso in avisos:
+                    st.warning(aviso)
+                fazendas = fazendas_com_talhoes()
+
+    if not fazendas:
+        st.info("Nenhum talhão importado.")
+        return
+    fazenda = st.selectbox("Fazenda", [TODAS_FAZENDAS] + fazendas)
+    with medir_trecho("mapa_talhoes"):
+        html = _mapa_em_cache(versao_dados(), None if fazenda == TODAS_FAZENDAS else fazenda)
+    components.html(html, height=ALTURA_MAPA)
+
+# Módulos pesados carregados só nas páginas que os usam (Exportar, Financeiro, Gráficos e Tendências)
+IMPORTACOES_PESADAS = ["pandas", "plotly.express", "openpyxl"]
+
+def _importar_modulos(nomes):
+    """Importa os módulos informados, ignorando falhas (a página que usar o módulo mostrará o erro)."""
+    for nome in nomes:
+        try:
+            importlib.import_module(nome)
+        except ImportError:
+            pass
+
+@st.cache_resource
+def _preaquecer_importacoes():
+    """Carrega, uma vez por processo e em segundo plano, os módulos pesados.
+
+    Chamado depois que a página atual foi desenhada, para não atrasar a primeira exibição.
+    """
+    tarefa = threading.Thread(target=_importar_modulos, args=(IMPORTACOES_PESADAS,),
+                              name="preaquecer-importacoes", daemon=True)
+    tarefa.start()
+    return tarefa
+
 def main():
     """Função principal."""
     st.set_page_config(layout="wide")
@@ -591,6 +938,10 @@ def main():
         st.session_state.pagina_selecionada = PAGINA_REGISTRO
     if "erros" not in st.session_state:
         st.session_state.erros = {}
+    diagnostico.iniciar_execucao(diagnostico.DIAGNOSTICO_POR_AMBIENTE or st.query_params.get("diagnostico") == "1")
+    if diagnostico.diagnostico_ativo():
+        painel_diagnostico = st.sidebar.empty()  # Preenchido ao final, com as medições completas
+        inicio = time.perf_counter()
 
     exibir_barra_lateral()
 
@@ -604,6 +955,19 @@ def main():
         exibir_pagina_financeiro()
     elif st.session_state.pagina_selecionada == PAGINA_GRAFICOS:  # Nova condição para a página de gráficos
         exibir_pagina_graficos()
+    elif st.session_state.pagina_selecionada == PAGINA_TENDENCIAS:
+        exibir_pagina_tendencias()
+    elif st.session_state.pagina_selecionada == PAGINA_IMPORTAR:
+        exibir_pagina_importar()
+    elif st.session_state.pagina_selecionada == PAGINA_MAPA:
+        exibir_pagina_mapa()
+
+    if diagnostico.diagnostico_ativo():
+        total_ms = (time.perf_counter() - inicio) * 1000
+        exibir_painel_diagnostico(painel_diagnostico, total_ms)
+        diagnostico.registrar_diagnostico(st.session_state.pagina_selecionada, total_ms, estatisticas_cache())
+
+    _preaquecer_importacoes()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,1492 @@
+"""Camada de dados do ControleDrone: banco SQLite, resumos mensais, índice de busca, talhões e cache de leitura.
+
+Não depende do Streamlit, para ser usada tanto pelas páginas do app quanto pela linha
+de comando (cli.py) e pelos benchmarks. As funções de gravação levantam a exceção em
+caso de falha; cabe a quem chama decidir como exibi-la.
+
+Anos encerrados podem ser arquivados (arquivar_ano): suas operações e gastos saem das
+tabelas do banco para arquivos JSON compactados somente leitura, ao lado do banco, e os
+resumos continuam no banco. As leituras de vários anos juntam os arquivos às linhas do banco.
+
+O esquema é versionado: as migrações (MIGRACOES) corrigem os dados gravados uma única vez, ao
+abrir o banco, para que as leituras não precisem ajustar registro por registro.
+"""
+import bisect
+import contextlib
+import datetime
+import functools
+import gzip
+import json
+import operator
+import os
+import stat
+import threading
+
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, String, Table, Text, create_engine, delete, event,
+                        func, insert, literal_column, select, update)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+from diagnostico import contar_bytes, instrumentar
+
+MESES = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+         "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
+TIPO_OPERACAO = ["Operação Aérea", "Operação Terrestre"]
+CATEGORIAS_GASTO = ["Produtos", "Combustível", "Manutenção", "Outros"]
+
+ARQUIVO_REGISTROS = "registros.json"
+ARQUIVO_GASTOS = "gastos.json"
+ARQUIVO_BANCO = "fazenda.db"
+TEMPO_ESPERA_TRAVA = 30  # Segundos que uma gravação espera pela trava de outra sessão
+
+metadados = MetaData()
+
+tabela_operacoes = Table(
+    "operacoes", metadados,
+    Column("id", Integer, primary_key=True),
+    Column("ano", Integer),
+    Column("mes", String),
+    Column("tipo_operacao", String),
+    Column("dados", Text, nullable=False),  # Registro completo serializado em JSON
+    Index("ix_operacoes_ano_mes", "ano", "mes"),
+    Index("ix_operacoes_tipo_operacao", "tipo_operacao"),
+    sqlite_autoincrement=True,  # Ids nunca reaproveitados: uma sessão com um registro já excluído não pega outro
+)
+
+tabela_gastos = Table(
+    "gastos", metadados,
+    Column("id", Integer, primary_key=True),
+    Column("data", String),
+    Column("categoria", String),
+    Column("valor", Float),
+    Column("dados", Text, nullable=False),
+    Index("ix_gastos_data", "data"),
+    sqlite_autoincrement=True,
+)
+
+# Resumos mensais materializados, mantidos incrementalmente a cada gravação
+tabela_resumo_operacoes = Table(
+    "resumo_operacoes", metadados,
+    Column("ano", Integer, primary_key=True),
+    Column("mes", String, primary_key=True),
+    Column("tipo_operacao", String, primary_key=True),
+    Column("hectares", Float, nullable=False),
+    Column("quantidade", Integer, nullable=False),
+)
+
+tabela_resumo_gastos = Table(
+    "resumo_gastos", metadados,
+    Column("ano", Integer, primary_key=True),
+    Column("mes", String, primary_key=True),
+    Column("categoria", String, primary_key=True),
+    Column("valor", Float, nullable=False),
+    Column("quantidade", Integer, nullable=False),
+)
+
+# Gastos por semana (iniciada na segunda-feira) e categoria, para as séries semanais do painel de tendências
+tabela_resumo_gastos_semanal = Table(
+    "resumo_gastos_semanal", metadados,
+    Column("inicio_semana", String, primary_key=True),  # Data da segunda-feira, AAAA-MM-DD
+    Column("categoria", String, primary_key=True),
+    Column("valor", Float, nullable=False),
+    Column("quantidade", Integer, nullable=False),
+)
+
+# Consumo de cada produto por mês, fazenda e talhão, mantido incrementalmente como os resumos mensais
+tabela_resumo_produtos = Table(
+    "resumo_produtos", metadados,
+    Column("ano", Integer, primary_key=True),
+    Column("mes", String, primary_key=True),
+    Column("nome_fazenda", String, primary_key=True),
+    Column("talhao_aplicado", String, primary_key=True),
+    Column("produto", String, primary_key=True),
+    Column("consumo", Float, nullable=False),  # Dose total aplicada: dose por hectare x hectares
+    Column("hectares", Float, nullable=False),
+    Column("quantidade", Integer, nullable=False),
+)
+
+# Versão dos dados de cada ano, incrementada a cada gravação; usada para refazer só os anos alterados
+tabela_versoes_ano = Table(
+    "versoes_ano", metadados,
+    Column("tabela", String, primary_key=True),
+    Column("ano", Integer, primary_key=True),
+    Column("versao", Integer, nullable=False),
+)
+
+# Anos congelados em arquivos compactados, com o maior id arquivado de cada tabela (para ids novos não o repetirem)
+tabela_anos_arquivados = Table(
+    "anos_arquivados", metadados,
+    Column("ano", Integer, primary_key=True),
+    Column("operacoes", Integer, nullable=False),
+    Column("gastos", Integer, nullable=False),
+    Column("maior_id_operacoes", Integer),
+    Column("maior_id_gastos", Integer),
+    Column("arquivado_em", String, nullable=False),
+)
+
+tabela_migracoes = Table(
+    "migracoes", metadados,
+    Column("nome", String, primary_key=True),
+    Column("aplicada_em", String, nullable=False),
+)
+
+# Índice de busca textual (FTS5) das operações, mantido a cada gravação. Por ser uma tabela virtual, fica fora
+# de `metadados` e é criado pela migração "busca"; o rowid é o id da operação.
+CAMPOS_BUSCA = ["tipo_operacao", "nome_fazenda", "talhao_aplicado", "cultura", "aeronave", "trator", "implemento",
+                "responsavel", "status", "produtos", "observacao"]
+FACETAS_BUSCA = ["ano", "tipo_operacao", "nome_fazenda", "cultura", "aeronave", "responsavel"]
+tabela_busca = Table(
+    "busca_operacoes", MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    Column("ano", Integer),  # UNINDEXED: só para filtrar e agrupar
+    *(Column(campo, Text) for campo in CAMPOS_BUSCA),
+)
+
+# Limites dos talhões importados de KML (talhoes.py), um por fazenda e talhão, com a área calculada do polígono
+tabela_talhoes = Table(
+    "talhoes", metadados,
+    Column("id", Integer, primary_key=True),
+    Column("nome_fazenda", String, nullable=False),
+    Column("talhao", String, nullable=False),
+    Column("hectares", Float, nullable=False),
+    Column("geometria", Text, nullable=False),  # GeoJSON (Polygon ou MultiPolygon), em graus WGS 84
+    Index("ix_talhoes_fazenda_talhao", "nome_fazenda", "talhao", unique=True),
+    sqlite_autoincrement=True,
+)
+
+# Índice espacial (R*Tree) com o retângulo envolvente de cada talhão; como o de busca, é uma tabela virtual criada
+# pela migração "indice_talhoes", e o id é o do talhão.
+tabela_indice_talhoes = Table(
+    "indice_talhoes", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+)
+
+
+def _linha_operacao(registro):
+    """Monta as colunas indexadas de um registro de operação."""
+    dados = {chave: valor for chave, valor in registro.items() if chave != "id"}
+    return {
+        "ano": dados.get("ano"),
+        "mes": dados.get("mes"),
+        "tipo_operacao": dados.get("tipo_operacao"),
+        "dados": json.dumps(dados, ensure_ascii=False),
+    }
+
+
+def _linha_gasto(gasto):
+    """Monta as colunas indexadas de um gasto."""
+    dados = {chave: valor for chave, valor in gasto.items() if chave != "id"}
+    return {
+        "data": dados.get("data"),
+        "categoria": dados.get("categoria"),
+        "valor": dados.get("valor"),
+        "dados": json.dumps(dados, ensure_ascii=False),
+    }
+
+
+def _linha_busca(registro):
+    """Monta a linha do índice de busca de um registro, com os nomes dos produtos numa única coluna."""
+    linha = {campo: None if registro.get(campo) is None else str(registro[campo]) for campo in CAMPOS_BUSCA}
+    linha["produtos"] = " ".join(nome for nome, _, _ in produtos_do_registro(registro) if nome) or None
+    return dict(linha, rowid=registro["id"], ano=ano_do_registro(registro))
+
+
+def converter_numero(valor):
+    """Converte para float, ou None se o valor não for numérico."""
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def produtos_do_registro(registro):
+    """Produtos de um registro normalizados em (nome, dose, dose_total), nos dois esquemas de produto.
+
+    Os Aéreos usam `nome`/`dose_por_hectare`/`dose_total` e os Terrestres `nome_produto`/`dose`.
+    """
+    normalizados = []
+    for produto in registro.get("produtos") or []:
+        nome = produto.get("nome", produto.get("nome_produto"))
+        dose = converter_numero(produto.get("dose_por_hectare", produto.get("dose")))
+        normalizados.append((None if nome is None else str(nome), dose, converter_numero(produto.get("dose_total"))))
+    return normalizados
+
+
+def _contribuicao_operacao(registro):
+    """Linhas (chave, valores) com que um registro entra no resumo mensal de operações."""
+    chave = {
+        "ano": ano_do_registro(registro),
+        "mes": registro.get("mes"),
+        "tipo_operacao": registro.get("tipo_operacao"),
+    }
+    if None in chave.values():
+        return []
+    return [(chave, {"hectares": float(registro.get("hectares_totais") or 0.0)})]
+
+
+def _contribuicao_produtos(registro):
+    """Linhas (chave, valores) com que cada produto de um registro entra no resumo de consumo de produtos.
+
+    O consumo é a dose total gravada (Aérea) ou, na falta dela, a dose por hectare vezes os hectares.
+    Produtos sem nome ficam de fora.
+    """
+    if registro.get("mes") is None:
+        return []
+    hectares = converter_numero(registro.get("hectares_totais")) or 0.0
+    linhas = []
+    for nome, dose, dose_total in produtos_do_registro(registro):
+        if not nome or not nome.strip():
+            continue
+        chave = {
+            "ano": ano_do_registro(registro),
+            "mes": registro["mes"],
+            "nome_fazenda": str(registro.get("nome_fazenda") or ""),
+            "talhao_aplicado": str(registro.get("talhao_aplicado") or ""),
+            "produto": nome.strip(),
+        }
+        consumo = dose_total if dose_total is not None else (dose or 0.0) * hectares
+        linhas.append((chave, {"consumo": consumo, "hectares": hectares}))
+    return linhas
+
+
+def _data_do_gasto(gasto):
+    """Data de um gasto que entra nos resumos, ou None se a data for inválida ou faltar a categoria."""
+    if gasto.get("categoria") is None:
+        return None
+    try:
+        return datetime.datetime.strptime(gasto["data"], "%Y-%m-%d").date()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _contribuicao_gasto(gasto):
+    """Linhas (chave, valores) com que um gasto entra no resumo mensal de gastos."""
+    data = _data_do_gasto(gasto)
+    if data is None:
+        return []
+    chave = {"ano": data.year, "mes": MESES[data.month - 1], "categoria": gasto["categoria"]}
+    return [(chave, {"valor": float(gasto.get("valor") or 0.0)})]
+
+
+def _contribuicao_gasto_semanal(gasto):
+    """Linhas (chave, valores) com que um gasto entra no resumo semanal de gastos."""
+    data = _data_do_gasto(gasto)
+    if data is None:
+        return []
+    inicio_semana = data - datetime.timedelta(days=data.weekday())
+    return [({"inicio_semana": inicio_semana.isoformat(), "categoria": gasto["categoria"]},
+             {"valor": float(gasto.get("valor") or 0.0)})]
+
+
+def ano_do_registro(registro):
+    """Ano a que um registro pertence; todo registro gravado tem ano (ver _migrar_anos_dos_registros)."""
+    return registro.get("ano")
+
+
+def ano_do_gasto(gasto):
+    """Ano da data de um gasto, ou None se a data for inválida."""
+    try:
+        return int(str(gasto["data"])[:4])
+    except (KeyError, ValueError):
+        return None
+
+
+ANO_DO_ITEM = {"operacoes": ano_do_registro, "gastos": ano_do_gasto}
+
+# Tabelas de resumo alimentadas por cada tabela de dados, com a função que dá as linhas de cada item
+RESUMOS = {
+    tabela_operacoes: [(tabela_resumo_operacoes, _contribuicao_operacao),
+                       (tabela_resumo_produtos, _contribuicao_produtos)],
+    tabela_gastos: [(tabela_resumo_gastos, _contribuicao_gasto),
+                    (tabela_resumo_gastos_semanal, _contribuicao_gasto_semanal)],
+}
+
+def _ler_json_legado(caminho):
+    """Lê um dos arquivos JSON usados antes do banco.
+
+    Um arquivo corrompido interrompe a migração em vez de ser tratado como vazio,
+    para que a importação não seja marcada como concluída sem os dados.
+    """
+    try:
+        with open(caminho, "r") as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return []
+    except json.JSONDecodeError as e:
+        raise RuntimeError(f"{caminho} está corrompido ({e}); corrija ou remova o arquivo para concluir a migração.")
+
+
+def migrar_json_para_banco(conexao):
+    """Importa registros.json e gastos.json (da pasta do banco) para o banco."""
+    pasta = os.path.dirname(conexao.engine.url.database)
+    registros = _ler_json_legado(os.path.join(pasta, ARQUIVO_REGISTROS))
+    if registros:
+        conexao.execute(insert(tabela_operacoes), [_linha_operacao(registro) for registro in registros])
+    gastos = _ler_json_legado(os.path.join(pasta, ARQUIVO_GASTOS))
+    if gastos:
+        conexao.execute(insert(tabela_gastos), [_linha_gasto(gasto) for gasto in gastos])
+
+
+def _totais_resumo(contribuicao, itens):
+    """Soma em memória as contribuições dos itens, devolvendo uma linha de resumo por chave."""
+    totais = {}
+    for item in itens:
+        for chave, valores in contribuicao(item):
+            acumulado = totais.setdefault(tuple(chave.items()), dict.fromkeys(valores, 0.0) | {"quantidade": 0})
+            for coluna, valor in valores.items():
+                acumulado[coluna] += valor
+            acumulado["quantidade"] += 1
+    return [dict(chave, **valores) for chave, valores in totais.items()]
+
+
+def reconstruir_resumos(conexao, tabelas_resumo=None):
+    """Recalcula do zero as tabelas de resumo (todas, ou só `tabelas_resumo`) a partir dos dados gravados."""
+    for tabela, resumos in RESUMOS.items():
+        resumos = [(tabela_resumo, contribuicao) for tabela_resumo, contribuicao in resumos
+                   if tabelas_resumo is None or tabela_resumo in tabelas_resumo]
+        if not resumos:
+            continue
+        itens = [json.loads(dados) for (dados,) in conexao.execute(select(tabela.c.dados))]
+        # Os anos arquivados saíram da tabela, mas continuam nos resumos
+        itens += _itens_arquivados(tabela, _anos_arquivados(conexao), conexao.engine.url.database)
+        for tabela_resumo, contribuicao in resumos:
+            linhas = _totais_resumo(contribuicao, itens)
+            conexao.execute(delete(tabela_resumo))
+            if linhas:
+                conexao.execute(insert(tabela_resumo), linhas)
+
+
+def reconstruir_busca(conexao):
+    """Refaz do zero o índice de busca a partir das operações gravadas e das dos anos arquivados."""
+    linhas = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.dados)).all()
+    registros = [dict(json.loads(dados), id=id_registro) for id_registro, dados in linhas]
+    registros += _itens_arquivados(tabela_operacoes, _anos_arquivados(conexao), conexao.engine.url.database)
+    conexao.execute(delete(tabela_busca))
+    if registros:
+        conexao.execute(insert(tabela_busca), [_linha_busca(registro) for registro in registros])
+
+
+def _criar_busca(conexao):
+    """Cria e preenche o índice de busca (remove_diacritics: "talhao" encontra "Talhão")."""
+    colunas = ", ".join(["ano UNINDEXED"] + CAMPOS_BUSCA)
+    conexao.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {tabela_busca.name} "
+                            f"USING fts5({colunas}, tokenize='unicode61 remove_diacritics 2')")
+    reconstruir_busca(conexao)
+
+
+def _retangulo_da_geometria(geometria):
+    """Retângulo envolvente de um Polygon ou MultiPolygon GeoJSON, nas colunas do índice espacial."""
+    poligonos = geometria["coordinates"] if geometria["type"] == "MultiPolygon" else [geometria["coordinates"]]
+    pontos = [ponto for poligono in poligonos for ponto in poligono[0]]  # O anel externo envolve os buracos
+    longitudes = [ponto[0] for ponto in pontos]
+    latitudes = [ponto[1] for ponto in pontos]
+    return {"min_lon": min(longitudes), "max_lon": max(longitudes), "min_lat": min(latitudes),
+            "max_lat": max(latitudes)}
+
+
+def reconstruir_indice_talhoes(conexao):
+    """Refaz do zero o índice espacial a partir dos talhões gravados."""
+    linhas = conexao.execute(select(tabela_talhoes.c.id, tabela_talhoes.c.geometria)).all()
+    conexao.execute(delete(tabela_indice_talhoes))
+    if linhas:
+        conexao.execute(insert(tabela_indice_talhoes),
+                        [dict(_retangulo_da_geometria(json.loads(geometria)), id=id_talhao)
+                         for id_talhao, geometria in linhas])
+
+
+def _criar_indice_talhoes(conexao):
+    """Cria e preenche o índice espacial dos talhões (módulo R*Tree do SQLite)."""
+    colunas = ", ".join(coluna.name for coluna in tabela_indice_talhoes.columns)
+    conexao.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {tabela_indice_talhoes.name} USING rtree({colunas})")
+    reconstruir_indice_talhoes(conexao)
+
+
+# --- Migrações ---
+
+def _mover_produto_legado(registro):
+    """Passa para a lista `produtos` o produto único de um registro terrestre antigo; devolve se o registro mudou.
+
+    Os registros terrestres antigos guardavam `nome_produto`/`dose` no próprio registro.
+    """
+    if (registro.get("tipo_operacao") != "Operação Terrestre" or registro.get("produtos")
+            or "nome_produto" not in registro):
+        return False
+    registro["produtos"] = [{"nome_produto": registro.pop("nome_produto"), "dose": registro.pop("dose", None)}]
+    return True
+
+
+def _normalizar_registro(registro):
+    """Põe no esquema atual, no próprio dicionário, um registro a gravar.
+
+    O registro fica com ano (o atual, se faltar) e com os produtos na lista `produtos`.
+    """
+    if registro.get("ano") is None:
+        registro["ano"] = datetime.datetime.now().year
+    _mover_produto_legado(registro)
+    return registro
+
+
+def _numero_do_mes(mes):
+    """Número (1 a 12) do nome de um mês, ou None se não for um mês válido."""
+    return MESES.index(mes) + 1 if mes in MESES else None
+
+
+def _inferir_ano(mes, referencia, antes_da_referencia):
+    """Ano de um registro do `mes` gravado antes (ou depois) de um registro de referência (ano, número do mês).
+
+    Antes dela, é a última vez que o mês ocorreu até a referência; depois, a primeira a partir dela.
+    """
+    ano, mes_referencia = referencia
+    numero = _numero_do_mes(mes)
+    if numero is None or mes_referencia is None:
+        return ano
+    if antes_da_referencia:
+        return ano - 1 if numero > mes_referencia else ano
+    return ano + 1 if numero < mes_referencia else ano
+
+
+def _refazer_derivados(conexao, registros):
+    """Refaz os resumos e o índice de busca já montados, depois de uma migração que alterou `registros`.
+
+    Os que ainda faltam são montados depois, pelas próprias migrações, já com os dados corrigidos.
+    """
+    aplicadas = set(conexao.execute(select(tabela_migracoes.c.nome)).scalars())
+    for nome, migrar in MIGRACOES:
+        if nome in MIGRACOES_DERIVADAS and nome in aplicadas:
+            migrar(conexao)
+    _marcar_anos_alterados(conexao, tabela_operacoes, registros)
+
+
+def _migrar_anos_dos_registros(conexao):
+    """Grava o ano nos registros anteriores ao campo, que até aqui contavam como do ano corrente a cada leitura.
+
+    Os registros não têm data, só o mês: o ano vem do registro com ano mais próximo na ordem de gravação (o
+    seguinte, ou o anterior se não houver seguinte; sem nenhum, a data de hoje), ver _inferir_ano.
+    """
+    sem_ano = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.dados)
+                              .where(tabela_operacoes.c.ano.is_(None)).order_by(tabela_operacoes.c.id)).all()
+    if not sem_ano:
+        return
+    com_ano = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.ano, tabela_operacoes.c.mes)
+                              .where(tabela_operacoes.c.ano.is_not(None)).order_by(tabela_operacoes.c.id)).all()
+    ids_com_ano = [id_registro for id_registro, _, _ in com_ano]
+    hoje = datetime.date.today()
+    registros = []
+    for id_registro, dados in sem_ano:
+        registro = json.loads(dados)
+        seguinte = bisect.bisect(ids_com_ano, id_registro)
+        if seguinte < len(com_ano):
+            _, ano, mes = com_ano[seguinte]
+            registro["ano"] = _inferir_ano(registro.get("mes"), (ano, _numero_do_mes(mes)), True)
+        elif com_ano:
+            _, ano, mes = com_ano[-1]
+            registro["ano"] = _inferir_ano(registro.get("mes"), (ano, _numero_do_mes(mes)), False)
+        else:
+            registro["ano"] = _inferir_ano(registro.get("mes"), (hoje.year, hoje.month), True)
+        conexao.execute(update(tabela_operacoes).where(tabela_operacoes.c.id == id_registro)
+                        .values(**_linha_operacao(registro)))
+        registros.append(registro)
+    # Também o ano corrente, onde esses registros eram contados até aqui
+    _refazer_derivados(conexao, registros + [{"ano": hoje.year}])
+
+
+def _migrar_produtos_terrestres(conexao):
+    """Passa para a lista `produtos` o produto dos registros terrestres antigos, no banco e nos anos arquivados."""
+    linhas = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.dados)
+                             .where(tabela_operacoes.c.tipo_operacao == "Operação Terrestre")).all()
+    registros = []
+    for id_registro, dados in linhas:
+        registro = json.loads(dados)
+        if _mover_produto_legado(registro):
+            conexao.execute(update(tabela_operacoes).where(tabela_operacoes.c.id == id_registro)
+                            .values(**_linha_operacao(registro)))
+            registros.append(registro)
+    for ano in _anos_arquivados(conexao):
+        caminho = _caminho_arquivo(tabela_operacoes, ano, conexao.engine.url.database)
+        arquivados = _ler_arquivo_compactado(caminho, _assinatura_arquivo(caminho))
+        alterados = [registro for registro in arquivados if _mover_produto_legado(registro)]
+        if alterados:
+            _gravar_arquivo_compactado(caminho, arquivados)
+            registros += alterados
+    if registros:
+        _refazer_derivados(conexao, registros)
+
+
+def _recriar_com_autoincremento(conexao):
+    """Recria com AUTOINCREMENT as tabelas de bancos antigos, para o SQLite não reaproveitar ids excluídos.
+
+    O SQLite não altera a chave de uma tabela existente: ela é renomeada, recriada e copiada. A sequência das
+    operações e dos gastos começa acima também dos ids que saíram para anos arquivados.
+    """
+    for tabela in (tabela_operacoes, tabela_gastos, tabela_talhoes):
+        criacao = conexao.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                          (tabela.name,)).scalar()
+        if "AUTOINCREMENT" in criacao.upper():
+            continue
+        for indice in tabela.indexes:
+            conexao.exec_driver_sql(f"DROP INDEX IF EXISTS {indice.name}")
+        conexao.exec_driver_sql(f"ALTER TABLE {tabela.name} RENAME TO {tabela.name}_antiga")
+        tabela.create(conexao)
+        colunas = ", ".join(coluna.name for coluna in tabela.columns)
+        conexao.exec_driver_sql(f"INSERT INTO {tabela.name} ({colunas}) SELECT {colunas} FROM {tabela.name}_antiga")
+        conexao.exec_driver_sql(f"DROP TABLE {tabela.name}_antiga")
+    for tabela in (tabela_operacoes, tabela_gastos):
+        maior_id = _maior_id_usado(conexao, tabela)
+        if maior_id:
+            conexao.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (tabela.name,))
+            conexao.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (tabela.name, maior_id))
+
+
+# Migrações do banco, em ordem; cada uma é aplicada uma única vez e registrada na tabela `migracoes`.
+# A versão do esquema (PRAGMA user_version) é o número delas: um banco em dia é aberto sem outras consultas.
+# As que corrigem dados vêm antes das que montam resumos e busca, para um banco novo montá-los uma vez só.
+MIGRACOES = [
+    ("importacao_json", migrar_json_para_banco),
+    ("ano_dos_registros", _migrar_anos_dos_registros),
+    ("produtos_terrestres", _migrar_produtos_terrestres),
+    ("resumos_mensais", functools.partial(reconstruir_resumos,
+                                          tabelas_resumo=[tabela_resumo_operacoes, tabela_resumo_gastos])),
+    ("resumo_produtos", functools.partial(reconstruir_resumos, tabelas_resumo=[tabela_resumo_produtos])),
+    ("resumo_gastos_semanal", functools.partial(reconstruir_resumos, tabelas_resumo=[tabela_resumo_gastos_semanal])),
+    ("busca", _criar_busca),
+    ("indice_talhoes", _criar_indice_talhoes),
+    ("ids_sem_reuso", _recriar_com_autoincremento),
+]
+VERSAO_ESQUEMA = len(MIGRACOES)
+# Migrações que só montam dados derivados das tabelas, refeitas quando uma correção de dados os altera
+MIGRACOES_DERIVADAS = {"resumos_mensais", "resumo_produtos", "resumo_gastos_semanal", "busca"}
+
+
+def versao_esquema(conexao):
+    """Versão do esquema gravada no banco."""
+    return conexao.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def aplicar_migracoes(engine):
+    """Aplica as migrações que faltam, cada uma na sua transação, e grava a versão do esquema."""
+    with engine.connect() as conexao:
+        versao = versao_esquema(conexao)
+    if versao == VERSAO_ESQUEMA:
+        return
+    if versao > VERSAO_ESQUEMA:
+        raise RuntimeError(f"O banco está na versão {versao} do esquema, mais nova que a deste programa "
+                           f"({VERSAO_ESQUEMA}); atualize o ControleDrone.")
+    for nome, migrar in MIGRACOES:
+        # Conferida na transação de escrita, para duas sessões abrindo o banco não aplicarem a mesma migração
+        with _transacao_escrita(engine) as conexao:
+            if conexao.execute(select(tabela_migracoes.c.nome).where(tabela_migracoes.c.nome == nome)).first():
+                continue
+            migrar(conexao)
+            conexao.execute(insert(tabela_migracoes).values(nome=nome, aplicada_em=datetime.datetime.now().isoformat()))
+    with _transacao_escrita(engine) as conexao:
+        conexao.exec_driver_sql(f"PRAGMA user_version = {VERSAO_ESQUEMA}")
+
+
+def _configurar_conexao(conexao_dbapi, _):
+    """Desliga o BEGIN automático do sqlite3 para que as transações sejam abertas por _iniciar_transacao."""
+    conexao_dbapi.isolation_level = None
+
+
+def _iniciar_transacao(conexao):
+    """Abre a transação; as de escrita tomam a trava do banco já no BEGIN.
+
+    Com BEGIN IMMEDIATE a leitura da versão gravada, a gravação e o ajuste dos
+    resumos acontecem sob a mesma trava, sem atualizações perdidas entre sessões.
+    """
+    if conexao.get_execution_options().get("transacao_escrita"):
+        conexao.exec_driver_sql("BEGIN IMMEDIATE")
+    else:
+        conexao.exec_driver_sql("BEGIN")
+
+
+@contextlib.contextmanager
+def _transacao_escrita(engine):
+    """Transação de escrita exclusiva: confirmada ao final ou desfeita em caso de erro."""
+    with engine.connect().execution_options(transacao_escrita=True) as conexao, conexao.begin():
+        yield conexao
+
+
+def _banco_ocupado(erro):
+    """Indica se o erro é o banco travado por outra gravação em andamento."""
+    return isinstance(erro, OperationalError) and ("locked" in str(erro) or "busy" in str(erro))
+
+
+@retry(retry=retry_if_exception(_banco_ocupado), wait=wait_exponential(multiplier=0.05, max=2),
+       stop=stop_after_attempt(6), reraise=True)
+def _executar_escrita(operacao):
+    """Executa `operacao(conexao)` numa transação de escrita, com novas tentativas se o banco estiver ocupado."""
+    with _transacao_escrita(obter_engine()) as conexao:
+        return operacao(conexao)
+
+
+# Engines abertas neste processo, por caminho absoluto do banco
+_engines = {}
+_trava_engines = threading.Lock()
+
+
+def usar_banco(caminho):
+    """Define o arquivo de banco usado pelas funções deste módulo (padrão: fazenda.db na pasta atual)."""
+    global ARQUIVO_BANCO
+    ARQUIVO_BANCO = caminho
+
+
+def obter_engine():
+    """Cria (uma vez por processo e por arquivo) a conexão com o banco SQLite."""
+    caminho = os.path.abspath(ARQUIVO_BANCO)
+    with _trava_engines:
+        engine = _engines.get(caminho)
+        if engine is None:
+            # `timeout` é o tempo que o sqlite3 espera pela trava antes de desistir
+            engine = create_engine(f"sqlite:///{caminho}", connect_args={"timeout": TEMPO_ESPERA_TRAVA})
+            event.listen(engine, "connect", _configurar_conexao)
+            event.listen(engine, "begin", _iniciar_transacao)
+            metadados.create_all(engine)
+            aplicar_migracoes(engine)
+            _engines[caminho] = engine
+    return engine
+
+
+def fechar_banco():
+    """Fecha as conexões com o banco atual e descarta os dados dele em cache."""
+    with _trava_engines:
+        engine = _engines.pop(os.path.abspath(ARQUIVO_BANCO), None)
+    if engine is not None:
+        engine.dispose()
+    invalidar_cache_dados()
+
+
+def _atualizar_resumo(conexao, tabela, item, sinal):
+    """Soma (sinal=1) ou subtrai (sinal=-1) a contribuição de um item nas tabelas de resumo."""
+    for tabela_resumo, contribuicao in RESUMOS[tabela]:
+        for linha in _totais_resumo(contribuicao, [item]):
+            chave = {coluna.name: linha.pop(coluna.name) for coluna in tabela_resumo.primary_key}
+            valores = {coluna: sinal * valor for coluna, valor in linha.items()}
+            comando = sqlite_insert(tabela_resumo).values(**chave, **valores)
+            conexao.execute(comando.on_conflict_do_update(
+                index_elements=list(chave),
+                set_={coluna: tabela_resumo.c[coluna] + comando.excluded[coluna] for coluna in valores},
+            ))
+            if sinal < 0:
+                conexao.execute(delete(tabela_resumo).where(
+                    *(tabela_resumo.c[coluna] == valor for coluna, valor in chave.items()),
+                    tabela_resumo.c.quantidade <= 0,
+                ))
+
+
+def _somar_resumos(conexao, tabela, itens):
+    """Soma às tabelas de resumo, com um upsert por chave, a contribuição de vários itens novos."""
+    for tabela_resumo, contribuicao in RESUMOS[tabela]:
+        linhas = _totais_resumo(contribuicao, itens)
+        if not linhas:
+            continue
+        comando = sqlite_insert(tabela_resumo)
+        colunas_valor = [coluna for coluna in linhas[0] if not tabela_resumo.c[coluna].primary_key]
+        conexao.execute(comando.on_conflict_do_update(
+            index_elements=[coluna.name for coluna in tabela_resumo.primary_key],
+            set_={coluna: tabela_resumo.c[coluna] + comando.excluded[coluna] for coluna in colunas_valor},
+        ), linhas)
+
+
+def _atualizar_busca(conexao, tabela, removidos=(), gravados=()):
+    """Tira do índice de busca os ids `removidos` e indexa os itens `gravados` (com id); só para as operações."""
+    if tabela is not tabela_operacoes:
+        return
+    if removidos:
+        conexao.execute(delete(tabela_busca).where(tabela_busca.c.rowid.in_(removidos)))
+    if gravados:
+        conexao.execute(insert(tabela_busca), [_linha_busca(item) for item in gravados])
+
+
+def _marcar_anos_alterados(conexao, tabela, itens):
+    """Incrementa a versão dos anos dos itens gravados ou removidos."""
+    anos = {ANO_DO_ITEM[tabela.name](item) for item in itens} - {None}
+    if not anos:
+        return
+    comando = sqlite_insert(tabela_versoes_ano)
+    conexao.execute(comando.on_conflict_do_update(
+        index_elements=["tabela", "ano"], set_={"versao": tabela_versoes_ano.c.versao + 1},
+    ), [{"tabela": tabela.name, "ano": ano, "versao": 1} for ano in sorted(anos)])
+
+
+def ler_versoes_anos(tabela):
+    """Versão atual de cada ano com dados em `tabela`; anos nunca alterados depois da migração ficam com versão 0.
+
+    Anos cujos dados foram todos removidos continuam na lista, para que quem guarda cópias deles as descarte.
+    """
+    if tabela is tabela_operacoes:
+        consulta_anos = select(tabela.c.ano).distinct()
+    else:
+        consulta_anos = select(func.substr(tabela.c.data, 1, 4)).distinct()
+    with obter_engine().connect() as conexao:
+        anos = conexao.execute(consulta_anos).scalars().all()
+        versoes = dict(conexao.execute(select(tabela_versoes_ano.c.ano, tabela_versoes_ano.c.versao)
+                                       .where(tabela_versoes_ano.c.tabela == tabela.name)).all())
+        arquivados = _anos_arquivados(conexao)
+    for ano in arquivados:
+        versoes.setdefault(ano, 0)
+    for ano in anos:
+        if tabela is tabela_gastos:
+            ano = ano_do_gasto({"data": ano})
+        if ano is not None:
+            versoes.setdefault(ano, 0)
+    return versoes
+
+
+# --- Anos arquivados ---
+
+def pasta_arquivo(caminho_banco=None):
+    """Pasta dos arquivos dos anos arquivados, ao lado do banco (padrão: o banco atual)."""
+    return os.path.splitext(os.path.abspath(caminho_banco or ARQUIVO_BANCO))[0] + "_arquivo"
+
+
+def _caminho_arquivo(tabela, ano, caminho_banco=None):
+    """Arquivo compactado de uma tabela num ano arquivado."""
+    return os.path.join(pasta_arquivo(caminho_banco), f"{tabela.name}_{ano}.json.gz")
+
+
+def _anos_arquivados(conexao):
+    """Conjunto dos anos arquivados, lido na conexão informada."""
+    return set(conexao.execute(select(tabela_anos_arquivados.c.ano)).scalars())
+
+
+@functools.lru_cache(maxsize=64)
+def _ler_arquivo_compactado(caminho, assinatura):
+    """Itens de um arquivo de ano arquivado, mantidos em memória; `assinatura` renova a cópia se o arquivo mudar.
+
+    Como os arquivos não mudam, as gravações no banco não obrigam a lê-los de novo.
+    """
+    with gzip.open(caminho, "rt", encoding="utf-8") as arquivo:
+        return json.load(arquivo)
+
+
+def _itens_arquivados(tabela, anos, caminho_banco=None):
+    """Itens de `tabela` guardados nos arquivos dos `anos` informados (já arquivados)."""
+    itens = []
+    for ano in sorted(anos):
+        caminho = _caminho_arquivo(tabela, ano, caminho_banco)
+        itens += _ler_arquivo_compactado(caminho, _assinatura_arquivo(caminho))
+    return itens
+
+
+def _com_arquivados(conexao, tabela, itens, ano_inicial=None, ano_final=None):
+    """Junta às linhas lidas do banco os itens dos anos arquivados do intervalo (todos, sem intervalo), por id."""
+    anos = [ano for ano in _anos_arquivados(conexao)
+            if (ano_inicial is None or ano >= ano_inicial) and (ano_final is None or ano <= ano_final)]
+    if not anos:
+        return itens
+    return sorted(itens + _itens_arquivados(tabela, anos), key=operator.itemgetter("id"))
+
+
+def _remover_arquivo(caminho):
+    """Remove um arquivo, se existir, mesmo somente leitura (no Windows, os.remove recusa esses arquivos)."""
+    with contextlib.suppress(FileNotFoundError):
+        os.chmod(caminho, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(caminho)
+
+
+def _preparar_arquivo_compactado(caminho, itens):
+    """Grava os itens num arquivo JSON compactado temporário e somente leitura, ao lado de `caminho`.
+
+    Devolve o nome do temporário, a ser posto no lugar com _instalar_arquivo.
+    """
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    _remover_arquivo(temporario)  # Sobra de uma tentativa anterior, já somente leitura
+    try:
+        with gzip.open(temporario, "wt", encoding="utf-8") as arquivo:
+            json.dump(itens, arquivo, ensure_ascii=False)
+        os.chmod(temporario, 0o444)
+    except BaseException:
+        _remover_arquivo(temporario)
+        raise
+    return temporario
+
+
+def _instalar_arquivo(temporario, caminho):
+    """Troca `caminho` pelo temporário de uma vez.
+
+    O destino perde antes o bit de somente leitura: no Windows, os.replace não sobrescreve um arquivo
+    somente leitura (por exemplo, o de um ano desarquivado e arquivado de novo).
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.chmod(caminho, stat.S_IREAD | stat.S_IWRITE)
+    os.replace(temporario, caminho)
+
+
+def _gravar_arquivo_compactado(caminho, itens):
+    """Grava os itens num arquivo JSON compactado, trocado de uma vez e deixado somente leitura."""
+    temporario = _preparar_arquivo_compactado(caminho, itens)
+    try:
+        _instalar_arquivo(temporario, caminho)
+    finally:
+        _remover_arquivo(temporario)
+
+
+def _verificar_anos_abertos(conexao, tabela, itens):
+    """Impede gravar itens de anos arquivados, que são somente leitura."""
+    anos = {ANO_DO_ITEM[tabela.name](item) for item in itens} & _anos_arquivados(conexao)
+    if anos:
+        raise ValueError(f"Ano arquivado (somente leitura): {', '.join(map(str, sorted(anos)))}. "
+                         "Desarquive o ano para alterá-lo.")
+
+
+def _maior_id_usado(conexao, tabela):
+    """Maior id que a tabela já usou: o da sequência do AUTOINCREMENT, o das linhas e o dos anos arquivados."""
+    sequencia = conexao.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = ?", (tabela.name,)).scalar()
+    return max(sequencia or 0, conexao.execute(select(func.max(tabela.c.id))).scalar() or 0,
+               conexao.execute(select(func.max(tabela_anos_arquivados.c[f"maior_id_{tabela.name}"]))).scalar() or 0)
+
+
+def _numerar_linhas_novas(conexao, tabela, linhas):
+    """Numera linhas novas acima do maior id já usado, inclusive os excluídos e os que foram para anos arquivados.
+
+    Sem isso o SQLite reaproveitaria os ids arquivados, que voltariam repetidos ao juntar os arquivos.
+    """
+    for numero, linha in enumerate(linhas, _maior_id_usado(conexao, tabela) + 1):
+        linha["id"] = numero
+
+
+def _descartar_temporarios(temporarios):
+    """Remove os arquivos temporários de um arquivamento que não foi confirmado."""
+    for temporario in temporarios.values():
+        _remover_arquivo(temporario)
+    temporarios.clear()
+
+
+@instrumentar
+def arquivar_ano(ano):
+    """Congela um ano encerrado em arquivos compactados somente leitura e tira suas linhas do banco.
+
+    As operações e os gastos do ano vão para <banco>_arquivo/operacoes_<ano>.json.gz e gastos_<ano>.json.gz;
+    os resumos não mudam. Devolve quantas operações e gastos foram arquivados.
+    """
+    if ano >= datetime.datetime.now().year:
+        raise ValueError("Só anos encerrados (anteriores ao atual) podem ser arquivados.")
+    filtros = {tabela_operacoes: tabela_operacoes.c.ano == ano,
+               tabela_gastos: tabela_gastos.c.data.between(f"{ano:04d}-01-01", f"{ano:04d}-12-31")}
+
+    # Os arquivos são gravados em temporários e só tomam o lugar definitivo depois da transação confirmada:
+    # se ela falhar, nenhum arquivo fica apontando para linhas que continuam no banco
+    temporarios = {}
+
+    def arquivar(conexao):
+        _descartar_temporarios(temporarios)  # De uma tentativa anterior, com o banco ocupado
+        if ano in _anos_arquivados(conexao):
+            raise ValueError(f"O ano {ano} já está arquivado.")
+        os.makedirs(pasta_arquivo(), exist_ok=True)
+        arquivado = {"ano": ano, "arquivado_em": datetime.datetime.now().isoformat()}
+        for tabela, filtro in filtros.items():
+            linhas = conexao.execute(select(tabela.c.id, tabela.c.dados).where(filtro).order_by(tabela.c.id)).all()
+            itens = [dict(json.loads(dados), id=id_item) for id_item, dados in linhas]
+            caminho = _caminho_arquivo(tabela, ano)
+            temporarios[caminho] = _preparar_arquivo_compactado(caminho, itens)
+            conexao.execute(delete(tabela).where(filtro))
+            _marcar_anos_alterados(conexao, tabela, itens)
+            arquivado[tabela.name] = len(itens)
+            arquivado[f"maior_id_{tabela.name}"] = itens[-1]["id"] if itens else None
+        conexao.execute(insert(tabela_anos_arquivados).values(**arquivado))
+        return {"operacoes": arquivado["operacoes"], "gastos": arquivado["gastos"]}
+
+    try:
+        try:
+            resultado = _executar_escrita(arquivar)
+        except BaseException:
+            _descartar_temporarios(temporarios)
+            raise
+        for caminho, temporario in temporarios.items():
+            _instalar_arquivo(temporario, caminho)
+        return resultado
+    finally:
+        invalidar_cache_dados()
+
+
+@instrumentar
+def desarquivar_ano(ano):
+    """Devolve ao banco as operações e os gastos de um ano arquivado, para correções, e remove seus arquivos."""
+    def desarquivar(conexao):
+        if ano not in _anos_arquivados(conexao):
+            raise ValueError(f"O ano {ano} não está arquivado.")
+        for tabela, montar_linha in ((tabela_operacoes, _linha_operacao), (tabela_gastos, _linha_gasto)):
+            itens = _itens_arquivados(tabela, [ano])
+            if itens:
+                conexao.execute(insert(tabela), [dict(montar_linha(item), id=item["id"]) for item in itens])
+            _marcar_anos_alterados(conexao, tabela, itens)
+        conexao.execute(delete(tabela_anos_arquivados).where(tabela_anos_arquivados.c.ano == ano))
+
+    try:
+        _executar_escrita(desarquivar)
+    finally:
+        invalidar_cache_dados()
+    for tabela in (tabela_operacoes, tabela_gastos):
+        _remover_arquivo(_caminho_arquivo(tabela, ano))
+
+
+def anos_arquivados():
+    """Anos arquivados (somente leitura), em ordem (via cache)."""
+    def ler():
+        with obter_engine().connect() as conexao:
+            return sorted(_anos_arquivados(conexao))
+    return _carregar_com_cache("anos_arquivados", ler)
+
+
+def _item_gravado(conexao, tabela, id_item):
+    """Lê a versão gravada de um item, ou None se ele não existir."""
+    dados = conexao.execute(select(tabela.c.dados).where(tabela.c.id == id_item)).scalar()
+    return json.loads(dados) if dados is not None else None
+
+
+def _gravar_linha(conexao, tabela, item, montar_linha):
+    """Insere ou atualiza uma única linha, preenchendo o id de itens novos."""
+    _verificar_anos_abertos(conexao, tabela, [item])
+    linha = montar_linha(item)
+    contar_bytes("gravados", len(linha["dados"]))
+    if item.get("id") is not None:
+        anterior = _item_gravado(conexao, tabela, item["id"])
+        if anterior is not None:
+            _atualizar_resumo(conexao, tabela, anterior, -1)
+            conexao.execute(update(tabela).where(tabela.c.id == item["id"]).values(**linha))
+            _atualizar_resumo(conexao, tabela, item, 1)
+            _atualizar_busca(conexao, tabela, removidos=[item["id"]], gravados=[item])
+            _marcar_anos_alterados(conexao, tabela, [anterior, item])
+            return item["id"]
+        linha["id"] = item["id"]  # Linha removida por outra sessão: recria com o mesmo id
+    else:
+        _numerar_linhas_novas(conexao, tabela, [linha])
+    item["id"] = conexao.execute(insert(tabela).values(**linha)).inserted_primary_key[0]
+    _atualizar_resumo(conexao, tabela, item, 1)
+    _atualizar_busca(conexao, tabela, gravados=[item])
+    _marcar_anos_alterados(conexao, tabela, [item])
+    return item["id"]
+
+
+def _remover_linha(conexao, tabela, id_item):
+    """Remove uma única linha, descontando-a do resumo mensal."""
+    anterior = _item_gravado(conexao, tabela, id_item)
+    if anterior is not None:
+        _atualizar_resumo(conexao, tabela, anterior, -1)
+        conexao.execute(delete(tabela).where(tabela.c.id == id_item))
+        _atualizar_busca(conexao, tabela, removidos=[id_item])
+        _marcar_anos_alterados(conexao, tabela, [anterior])
+
+
+# --- Cache de leitura ---
+# Compartilhado entre as sessões do app (o módulo é importado uma vez por processo).
+_cache_dados = {"entradas": {}, "acertos": 0, "falhas": 0, "trava": threading.Lock()}
+
+
+def _assinatura_arquivo(caminho):
+    """Identifica a versão de um arquivo pelo par (mtime, tamanho)."""
+    try:
+        estado = os.stat(caminho)
+    except FileNotFoundError:
+        return None
+    return (estado.st_mtime_ns, estado.st_size)
+
+
+def _carregar_com_cache(nome, carregar):
+    """Devolve os dados em cache se o banco não mudou; senão, recarrega com `carregar`.
+
+    Os objetos devolvidos são compartilhados entre reruns e sessões e não devem ser
+    alterados no lugar: quem for modificar um item deve copiá-lo antes de salvar.
+    """
+    obter_engine()  # Garante que o banco exista antes de ler a assinatura
+    cache = _cache_dados
+    chave = (os.path.abspath(ARQUIVO_BANCO), nome)
+    # A assinatura é lida antes da carga: se o banco mudar no meio, a próxima chamada recarrega
+    assinatura = _assinatura_arquivo(ARQUIVO_BANCO)
+    with cache["trava"]:
+        entrada = cache["entradas"].get(chave)
+        if entrada is not None and entrada[0] == assinatura:
+            cache["acertos"] += 1
+            return entrada[1]
+        cache["falhas"] += 1
+    dados = carregar()
+    with cache["trava"]:
+        cache["entradas"][chave] = (assinatura, dados)
+    return dados
+
+
+def versao_dados():
+    """Versão atual dos dados gravados, usada como chave de caches derivados."""
+    obter_engine()
+    return _assinatura_arquivo(ARQUIVO_BANCO)
+
+
+def invalidar_cache_dados():
+    """Descarta os dados em cache; chamada após toda gravação."""
+    with _cache_dados["trava"]:
+        _cache_dados["entradas"].clear()
+
+
+def estatisticas_cache():
+    """Retorna os contadores de acertos e falhas do cache de leitura."""
+    with _cache_dados["trava"]:
+        return {"acertos": _cache_dados["acertos"], "falhas": _cache_dados["falhas"],
+                "entradas": len(_cache_dados["entradas"])}
+
+
+# --- Leitura e gravação ---
+ERRO_HECTARES = "Hectares totais deve ser maior que 0"
+ERRO_DOSE = "Dose deve ser maior que 0"
+
+
+def validar_campos(dados):
+    """Valida os campos do formulário; um campo presente mas vazio (None) conta como 0, como na importação."""
+    erros = {}
+    if "hectares_totais" in dados and (dados["hectares_totais"] or 0) <= 0:
+        erros["hectares_totais"] = ERRO_HECTARES
+    if "produtos" in dados:
+        for i, produto in enumerate(dados["produtos"]):
+            if "dose_por_hectare" in produto and (produto["dose_por_hectare"] or 0) <= 0:
+                erros[f"produto_{i}_dose"] = ERRO_DOSE
+    return erros
+
+
+def indexar_por_id(itens):
+    """Monta o mapa id -> item usado para localizar registros e gastos em O(1)."""
+    return {item["id"]: item for item in itens}
+
+
+def agrupar_registros_por_ano_mes(registros):
+    """Agrupa os registros em {ano: {mes: [registros]}}."""
+    registros_por_ano = {}
+    for registro in registros:
+        ano = registro['ano']
+        mes = registro.get('mes')
+        if ano not in registros_por_ano:
+            registros_por_ano[ano] = {}
+        if mes not in registros_por_ano[ano]:
+            registros_por_ano[ano][mes] = []
+        registros_por_ano[ano][mes].append(registro)
+    return registros_por_ano
+
+
+@instrumentar
+def carregar_registros():
+    """Carrega os registros de todos os anos, inclusive os arquivados (via cache)."""
+    return _carregar_com_cache("operacoes", _ler_registros_do_banco)
+
+
+@instrumentar
+def carregar_registros_do_ano(ano):
+    """Carrega (via cache) só os registros de um ano, do banco ou do arquivo do ano, se ele estiver arquivado."""
+    return _carregar_com_cache(f"operacoes:{ano}", lambda: ler_registros_por_anos(ano, ano))
+
+
+def anos_com_registros():
+    """Anos com registros de operação, do mais recente ao mais antigo (via cache)."""
+    def ler():
+        with obter_engine().connect() as conexao:
+            anos = set(conexao.execute(select(tabela_operacoes.c.ano).distinct()).scalars())
+            anos |= {ano for ano, quantidade in conexao.execute(
+                select(tabela_anos_arquivados.c.ano, tabela_anos_arquivados.c.operacoes)) if quantidade}
+        return sorted(anos, reverse=True)
+    return _carregar_com_cache("anos_com_registros", ler)
+
+
+def ler_registro(id_registro):
+    """Lê um único registro do banco, ou None se ele não existir (ou estiver num ano arquivado)."""
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.dados)
+                                 .where(tabela_operacoes.c.id == id_registro)).all()
+    registros = _registros_das_linhas(linhas)
+    return registros[0] if registros else None
+
+
+def _consulta_busca(texto):
+    """Converte o texto digitado numa consulta FTS5: cada palavra vira um prefixo entre aspas, e todas são exigidas."""
+    return " ".join('"{}"*'.format(palavra.replace('"', '""')) for palavra in texto.split())
+
+
+def _ler_facetas_busca():
+    """Lê do índice de busca as facetas de todas as operações, das mais recentes às mais antigas, em arrays numpy.
+
+    Cada faceta vira um array de códigos inteiros e um mapa valor -> código, para filtrar e contar com numpy.
+    """
+    import numpy as np
+
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_busca.c.rowid, *(tabela_busca.c[faceta] for faceta in FACETAS_BUSCA))
+                                 .order_by(tabela_busca.c.ano.desc(), tabela_busca.c.rowid.desc())).all()
+    ids = np.fromiter((linha[0] for linha in linhas), dtype=np.int64, count=len(linhas))
+    codigos, mapas = {}, {}
+    for indice, faceta in enumerate(FACETAS_BUSCA, 1):
+        mapa = mapas[faceta] = {}
+        codigos[faceta] = np.fromiter((mapa.setdefault(linha[indice], len(mapa)) for linha in linhas),
+                                      dtype=np.int32, count=len(linhas))
+    return {"ids": ids, "codigos": codigos, "mapas": mapas}
+
+
+def _registros_por_ids(conexao, ids):
+    """Lê os registros dos `ids`, na mesma ordem, do banco ou dos arquivos dos anos arquivados."""
+    linhas = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.dados)
+                             .where(tabela_operacoes.c.id.in_(ids))).all()
+    por_id = indexar_por_id(_registros_das_linhas(linhas))
+    if len(por_id) < len(ids):
+        faltantes = set(ids) - set(por_id)
+        por_id.update((item["id"], item) for item in _itens_arquivados(tabela_operacoes, _anos_arquivados(conexao))
+                      if item["id"] in faltantes)
+    return [por_id[id_registro] for id_registro in ids if id_registro in por_id]
+
+
+@instrumentar
+def buscar_operacoes(texto="", filtros=None, limite=50):
+    """Busca operações, inclusive as arquivadas, pelo texto e pelos valores exatos das facetas em `filtros`.
+
+    O texto é procurado no índice FTS5, nos campos de CAMPOS_BUSCA e nos nomes dos produtos, por prefixo de
+    palavra e sem distinguir acentos ou maiúsculas. `filtros` é {faceta: valor}, com facetas de FACETAS_BUSCA;
+    os filtros e as contagens usam as facetas em cache (ver _ler_facetas_busca). Devolve o total encontrado,
+    os `limite` registros mais recentes e, por faceta, os valores com suas contagens aplicando os demais filtros.
+    """
+    import numpy as np
+
+    filtros = filtros or {}
+    facetas_busca = _carregar_com_cache("facetas_busca", _ler_facetas_busca)
+    ids = facetas_busca["ids"]
+    encontrados = np.ones(len(ids), dtype=bool)
+    if texto.split():
+        with obter_engine().connect() as conexao:
+            ids_texto = conexao.execute(select(tabela_busca.c.rowid).where(
+                literal_column(tabela_busca.name).match(_consulta_busca(texto)))).scalars().all()
+        encontrados = np.isin(ids, np.array(ids_texto, dtype=np.int64))
+
+    mascaras = {faceta: facetas_busca["codigos"][faceta] == facetas_busca["mapas"][faceta].get(valor, -1)
+                for faceta, valor in filtros.items()}
+    facetas = {}
+    for faceta in FACETAS_BUSCA:
+        mascara = encontrados.copy()
+        for outra, filtro in mascaras.items():
+            if outra != faceta:
+                mascara &= filtro
+        mapa = facetas_busca["mapas"][faceta]
+        contagens = np.bincount(facetas_busca["codigos"][faceta][mascara], minlength=len(mapa))
+        facetas[faceta] = sorted(((valor, int(contagens[codigo])) for valor, codigo in mapa.items()
+                                  if valor is not None and contagens[codigo]),
+                                 key=lambda item: (-item[1], str(item[0])))
+
+    selecionados = encontrados
+    for filtro in mascaras.values():
+        selecionados = selecionados & filtro
+    with obter_engine().connect() as conexao:
+        registros = _registros_por_ids(conexao, ids[selecionados][:limite].tolist())
+    return {"total": int(selecionados.sum()), "registros": registros, "facetas": facetas}
+
+
+def _registros_das_linhas(linhas):
+    """Converte as linhas (id, dados) lidas do banco em registros."""
+    contar_bytes("lidos", sum(len(dados) for _, dados in linhas))
+    return [dict(json.loads(dados), id=id_registro) for id_registro, dados in linhas]
+
+
+@instrumentar
+def _ler_registros_do_banco():
+    """Lê todos os registros do banco e dos anos arquivados e adiciona o ano, se necessário."""
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(
+            select(tabela_operacoes.c.id, tabela_operacoes.c.dados).order_by(tabela_operacoes.c.id)).all()
+        return _com_arquivados(conexao, tabela_operacoes, _registros_das_linhas(linhas))
+
+
+@instrumentar
+def ler_registros_por_anos(ano_inicial, ano_final):
+    """Lê do banco (e dos anos arquivados), sem passar pelo cache, só os registros de `ano_inicial` a `ano_final`.
+
+    Usa o índice por ano.
+    """
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_operacoes.c.id, tabela_operacoes.c.dados)
+                                 .where(tabela_operacoes.c.ano.between(ano_inicial, ano_final))
+                                 .order_by(tabela_operacoes.c.id)).all()
+        return _com_arquivados(conexao, tabela_operacoes, _registros_das_linhas(linhas), ano_inicial, ano_final)
+
+
+@instrumentar
+def salvar_registro(registro):
+    """Insere ou atualiza um único registro no banco."""
+    _normalizar_registro(registro)
+    try:
+        return _executar_escrita(lambda conexao: _gravar_linha(conexao, tabela_operacoes, registro, _linha_operacao))
+    finally:
+        invalidar_cache_dados()
+
+
+@instrumentar
+def excluir_registro(id_registro):
+    """Remove um único registro do banco."""
+    try:
+        _executar_escrita(lambda conexao: _remover_linha(conexao, tabela_operacoes, id_registro))
+    finally:
+        invalidar_cache_dados()
+
+
+@instrumentar
+def importar_em_lote(registros, gastos):
+    """Grava operações e gastos novos de uma só vez, numa única transação, somando-os aos resumos."""
+    for registro in registros:
+        _normalizar_registro(registro)
+
+    def gravar(conexao):
+        for tabela, itens, montar_linha in ((tabela_operacoes, registros, _linha_operacao),
+                                            (tabela_gastos, gastos, _linha_gasto)):
+            if not itens:
+                continue
+            _verificar_anos_abertos(conexao, tabela, itens)
+            linhas = [montar_linha(item) for item in itens]
+            _numerar_linhas_novas(conexao, tabela, linhas)
+            contar_bytes("gravados", sum(len(linha["dados"]) for linha in linhas))
+            conexao.execute(insert(tabela), linhas)
+            _somar_resumos(conexao, tabela, itens)
+            _atualizar_busca(conexao, tabela,
+                             gravados=[dict(item, id=linha["id"]) for item, linha in zip(itens, linhas)])
+            _marcar_anos_alterados(conexao, tabela, itens)
+
+    try:
+        _executar_escrita(gravar)
+    finally:
+        invalidar_cache_dados()
+
+
+@instrumentar
+def carregar_gastos():
+    """Carrega os gastos de todos os anos, inclusive os arquivados (via cache)."""
+    return _carregar_com_cache("gastos", _ler_gastos_do_banco)
+
+
+@instrumentar
+def carregar_gastos_do_ano(ano):
+    """Carrega (via cache) só os gastos de um ano, do banco ou do arquivo do ano, se ele estiver arquivado."""
+    return _carregar_com_cache(f"gastos:{ano}", lambda: ler_gastos_por_anos(ano, ano))
+
+
+def anos_com_gastos():
+    """Anos com gastos, do mais recente ao mais antigo (via cache)."""
+    def ler():
+        with obter_engine().connect() as conexao:
+            anos = {ano_do_gasto({"data": inicio})
+                    for inicio in conexao.execute(select(func.substr(tabela_gastos.c.data, 1, 4)).distinct()).scalars()}
+            anos |= {ano for ano, quantidade in conexao.execute(
+                select(tabela_anos_arquivados.c.ano, tabela_anos_arquivados.c.gastos)) if quantidade}
+        return sorted(anos - {None}, reverse=True)
+    return _carregar_com_cache("anos_com_gastos", ler)
+
+
+def _gastos_das_linhas(linhas):
+    """Converte as linhas (id, dados) lidas do banco em gastos."""
+    contar_bytes("lidos", sum(len(dados) for _, dados in linhas))
+    gastos = []
+    for id_gasto, dados in linhas:
+        gasto = json.loads(dados)
+        gasto["id"] = id_gasto
+        gastos.append(gasto)
+    return gastos
+
+
+@instrumentar
+def _ler_gastos_do_banco():
+    """Lê todos os gastos do banco e dos anos arquivados."""
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_gastos.c.id, tabela_gastos.c.dados).order_by(tabela_gastos.c.id)).all()
+        return _com_arquivados(conexao, tabela_gastos, _gastos_das_linhas(linhas))
+
+
+@instrumentar
+def ler_gastos_por_anos(ano_inicial, ano_final):
+    """Lê do banco (e dos anos arquivados), sem passar pelo cache, só os gastos datados de `ano_inicial` a `ano_final`."""
+    filtro = tabela_gastos.c.data.between(f"{ano_inicial:04d}-01-01", f"{ano_final:04d}-12-31")
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_gastos.c.id, tabela_gastos.c.dados)
+                                 .where(filtro).order_by(tabela_gastos.c.id)).all()
+        return _com_arquivados(conexao, tabela_gastos, _gastos_das_linhas(linhas), ano_inicial, ano_final)
+
+
+@instrumentar
+def salvar_gasto(gasto):
+    """Insere ou atualiza um único gasto no banco."""
+    try:
+        return _executar_escrita(lambda conexao: _gravar_linha(conexao, tabela_gastos, gasto, _linha_gasto))
+    finally:
+        invalidar_cache_dados()
+
+
+@instrumentar
+def excluir_gasto(id_gasto):
+    """Remove um único gasto do banco."""
+    try:
+        _executar_escrita(lambda conexao: _remover_linha(conexao, tabela_gastos, id_gasto))
+    finally:
+        invalidar_cache_dados()
+
+
+@instrumentar
+def carregar_gastos_tabela(ano=None):
+    """Carrega (via cache) os gastos, de todos os anos ou só de `ano`, como DataFrame, com a data convertida uma única vez.
+
+    Além de `data` (datetime64), traz as colunas `ano` e `mes_numero` para filtros e
+    agrupamentos vetorizados.
+    """
+    if ano is None:
+        return _carregar_com_cache("gastos_tabela", lambda: _montar_tabela_gastos(carregar_gastos()))
+    return _carregar_com_cache(f"gastos_tabela:{ano}", lambda: _montar_tabela_gastos(carregar_gastos_do_ano(ano)))
+
+
+def _montar_tabela_gastos(gastos):
+    """Converte a lista de gastos em DataFrame tipado."""
+    import pandas as pd
+    df_gastos = pd.DataFrame(gastos, columns=["id", "descricao", "valor", "categoria", "data", "nome_fazenda"])
+    df_gastos["data"] = pd.to_datetime(df_gastos["data"], format="%Y-%m-%d")
+    df_gastos["ano"] = df_gastos["data"].dt.year
+    df_gastos["mes_numero"] = df_gastos["data"].dt.month
+    return df_gastos
+
+
+@instrumentar
+def carregar_resumos_mensais():
+    """Carrega (via cache) os resumos mensais de hectares e gastos, indexados por (ano, mes)."""
+    return _carregar_com_cache("resumos_mensais", _ler_resumos_do_banco)
+
+
+@instrumentar
+def _ler_resumos_do_banco():
+    """Lê as tabelas de resumo mensal do banco."""
+    resumos = {"operacoes": {}, "gastos": {}}
+    with obter_engine().connect() as conexao:
+        for ano, mes, tipo_operacao, hectares, _ in conexao.execute(select(tabela_resumo_operacoes)):
+            resumos["operacoes"].setdefault((ano, mes), {})[tipo_operacao] = hectares
+        for ano, mes, categoria, valor, _ in conexao.execute(select(tabela_resumo_gastos)):
+            resumos["gastos"].setdefault((ano, mes), {})[categoria] = valor
+    return resumos
+
+
+@instrumentar
+def carregar_resumo_produtos(ano_inicial, ano_final):
+    """Carrega (via cache) as linhas do resumo de consumo de produtos de `ano_inicial` a `ano_final`."""
+    return _carregar_com_cache(f"resumo_produtos:{ano_inicial}:{ano_final}",
+                               lambda: ler_resumo_produtos_por_anos(ano_inicial, ano_final))
+
+
+def ler_resumo_produtos_por_anos(ano_inicial, ano_final):
+    """Lê do banco as linhas do resumo de consumo de produtos de `ano_inicial` a `ano_final`, como dicionários."""
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_resumo_produtos).where(
+            tabela_resumo_produtos.c.ano.between(ano_inicial, ano_final))).mappings().all()
+    return [dict(linha) for linha in linhas]
+
+
+def ler_gastos_semanais(data_inicial, data_final):
+    """Lê do banco os gastos por semana e categoria das semanas iniciadas de `data_inicial` a `data_final` (AAAA-MM-DD)."""
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(select(tabela_resumo_gastos_semanal).where(
+            tabela_resumo_gastos_semanal.c.inicio_semana.between(data_inicial, data_final))).mappings().all()
+    return [dict(linha) for linha in linhas]
+
+
+def ler_resumos_por_anos(ano_inicial, ano_final):
+    """Lê do banco as linhas de resumo mensal de `ano_inicial` a `ano_final`.
+
+    Devolve duas listas de dicionários, com as colunas das tabelas de resumo de operações e de gastos.
+    """
+    with obter_engine().connect() as conexao:
+        operacoes = conexao.execute(select(tabela_resumo_operacoes).where(
+            tabela_resumo_operacoes.c.ano.between(ano_inicial, ano_final))).mappings().all()
+        gastos = conexao.execute(select(tabela_resumo_gastos).where(
+            tabela_resumo_gastos.c.ano.between(ano_inicial, ano_final))).mappings().all()
+    return [dict(linha) for linha in operacoes], [dict(linha) for linha in gastos]
+
+
+# --- Talhões ---
+
+def chave_talhao(nome_fazenda, talhao):
+    """Chave de busca de um talhão, sem diferenciar maiúsculas nem espaços nas pontas."""
+    return (str(nome_fazenda or "").strip().casefold(), str(talhao or "").strip().casefold())
+
+
+@instrumentar
+def salvar_talhoes(talhoes):
+    """Grava os talhões numa única transação, substituindo os de mesma fazenda e talhão; devolve quantos gravou.
+
+    Cada talhão é {"nome_fazenda", "talhao", "hectares", "geometria"}, com a geometria em GeoJSON; o índice
+    espacial é atualizado junto.
+    """
+    def gravar(conexao):
+        for talhao in talhoes:
+            linha = {"nome_fazenda": talhao["nome_fazenda"], "talhao": talhao["talhao"],
+                     "hectares": talhao["hectares"], "geometria": json.dumps(talhao["geometria"])}
+            id_talhao = conexao.execute(select(tabela_talhoes.c.id).where(
+                tabela_talhoes.c.nome_fazenda == linha["nome_fazenda"],
+                tabela_talhoes.c.talhao == linha["talhao"])).scalar()
+            if id_talhao is None:
+                id_talhao = conexao.execute(insert(tabela_talhoes).values(linha)).inserted_primary_key[0]
+            else:
+                conexao.execute(update(tabela_talhoes).where(tabela_talhoes.c.id == id_talhao).values(linha))
+                conexao.execute(delete(tabela_indice_talhoes).where(tabela_indice_talhoes.c.id == id_talhao))
+            conexao.execute(insert(tabela_indice_talhoes).values(
+                id=id_talhao, **_retangulo_da_geometria(talhao["geometria"])))
+            contar_bytes("gravados", len(linha["geometria"]))
+        return len(talhoes)
+
+    try:
+        return _executar_escrita(gravar)
+    finally:
+        invalidar_cache_dados()
+
+
+def areas_dos_talhoes():
+    """Área em hectares de cada talhão, por (fazenda, talhão) normalizados com chave_talhao (via cache)."""
+    def ler():
+        with obter_engine().connect() as conexao:
+            linhas = conexao.execute(select(tabela_talhoes.c.nome_fazenda, tabela_talhoes.c.talhao,
+                                            tabela_talhoes.c.hectares)).all()
+        return {chave_talhao(nome_fazenda, talhao): hectares for nome_fazenda, talhao, hectares in linhas}
+    return _carregar_com_cache("areas_talhoes", ler)
+
+
+def area_do_talhao(nome_fazenda, talhao):
+    """Área em hectares do talhão importado com esse nome de fazenda e talhão, ou None se não houver."""
+    return areas_dos_talhoes().get(chave_talhao(nome_fazenda, talhao))
+
+
+def fazendas_com_talhoes():
+    """Fazendas com talhões importados, em ordem alfabética (via cache)."""
+    def ler():
+        with obter_engine().connect() as conexao:
+            return sorted(conexao.execute(select(tabela_talhoes.c.nome_fazenda).distinct()).scalars())
+    return _carregar_com_cache("fazendas_talhoes", ler)
+
+
+def limites_dos_talhoes(nome_fazenda=None):
+    """Retângulo (min_lon, min_lat, max_lon, max_lat) que envolve os talhões de uma fazenda, ou de todas.
+
+    Devolve None se não houver talhões.
+    """
+    indice = tabela_indice_talhoes.c
+    consulta = select(func.min(indice.min_lon), func.min(indice.min_lat), func.max(indice.max_lon),
+                      func.max(indice.max_lat))
+    if nome_fazenda is not None:
+        consulta = consulta.join(tabela_talhoes, tabela_talhoes.c.id == indice.id).where(
+            tabela_talhoes.c.nome_fazenda == nome_fazenda)
+    with obter_engine().connect() as conexao:
+        limites = conexao.execute(consulta).one()
+    return None if limites[0] is None else tuple(limites)
+
+
+@instrumentar
+def talhoes_na_area(min_lon, min_lat, max_lon, max_lat):
+    """Talhões cujo retângulo envolvente cruza a área pedida, consultados pelo índice espacial.
+
+    Devolve dicionários com id, nome_fazenda, talhao, hectares e a geometria GeoJSON já convertida.
+    """
+    indice = tabela_indice_talhoes.c
+    with obter_engine().connect() as conexao:
+        linhas = conexao.execute(
+            select(tabela_talhoes.c.id, tabela_talhoes.c.nome_fazenda, tabela_talhoes.c.talhao,
+                   tabela_talhoes.c.hectares, tabela_talhoes.c.geometria)
+            .join(tabela_indice_talhoes, indice.id == tabela_talhoes.c.id)
+            .where(indice.max_lon >= min_lon, indice.min_lon <= max_lon, indice.max_lat >= min_lat,
+                   indice.min_lat <= max_lat)
+            .order_by(tabela_talhoes.c.nome_fazenda, tabela_talhoes.c.talhao)).mappings().all()
+    contar_bytes("lidos", sum(len(linha["geometria"]) for linha in linhas))
+    return [dict(linha, geometria=json.loads(linha["geometria"])) for linha in linhas]
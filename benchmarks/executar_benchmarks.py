@@ -0,0 +1,238 @@
+"""Benchmark sem interface gráfica do ControleDrone.
+
+Para cada tamanho, gera dados sintéticos num diretório temporário, popula o banco e
+mede as funções de carga/gravação, o agrupamento do editor, a montagem da exportação,
+a cópia colunar, a exportação (direta e em segundo plano), o resumo e a validação da importação da linha de
+comando, os resumos dos gráficos, a busca do editor, o arquivamento de um ano encerrado, a importação e o mapa
+dos talhões, o resumo dos logs de voo e, com o AppTest do Streamlit, a execução completa de cada página.
+O resultado é gravado em JSON para comparação entre versões:
+
+    python benchmarks/executar_benchmarks.py --tamanhos 1000 10000 100000 --saida resultado.json
+    python benchmarks/executar_benchmarks.py --comparar resultado_anterior.json --tolerancia 0.25
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import streamlit as st  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import armazenamento  # noqa: E402
+import colunar  # noqa: E402
+import ControleDrone as app  # noqa: E402
+import importacao  # noqa: E402
+import relatorios  # noqa: E402
+import talhoes  # noqa: E402
+import tarefas  # noqa: E402
+import telemetria  # noqa: E402
+from gerar_dados import gerar_gastos, gerar_kml_talhoes, gerar_registros, gravar_log_voo  # noqa: E402
+
+ARQUIVO_APP = os.path.join(RAIZ, "ControleDrone.py")
+PAGINAS = [app.PAGINA_REGISTRO, app.PAGINA_EDITOR, app.PAGINA_EXPORTAR_EXCEL, app.PAGINA_FINANCEIRO,
+           app.PAGINA_GRAFICOS, app.PAGINA_TENDENCIAS, app.PAGINA_IMPORTAR, app.PAGINA_MAPA]
+
+
+def medir(funcao, repeticoes, preparar=None):
+    """Executa `funcao` `repeticoes` vezes e devolve os tempos em segundos."""
+    tempos = []
+    for _ in range(repeticoes):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def popular_banco(registros, gastos):
+    """Grava os dados sintéticos em lote e monta os resumos e o índice de busca, como faz a migração inicial."""
+    with armazenamento._transacao_escrita(armazenamento.obter_engine()) as conexao:
+        conexao.execute(insert(armazenamento.tabela_operacoes),
+                        [armazenamento._linha_operacao(registro) for registro in registros])
+        conexao.execute(insert(armazenamento.tabela_gastos), [armazenamento._linha_gasto(gasto) for gasto in gastos])
+        armazenamento.reconstruir_resumos(conexao)
+        armazenamento.reconstruir_busca(conexao)
+    armazenamento.invalidar_cache_dados()
+
+
+def medir_paginas(repeticoes):
+    """Mede a primeira execução e as reexecuções de cada página com o AppTest."""
+    resultados = {}
+    for pagina in PAGINAS:
+        teste = AppTest.from_file(ARQUIVO_APP, default_timeout=600)
+        teste.session_state["pagina_selecionada"] = pagina
+        teste.session_state["submenu_financeiro"] = app.SUBMENU_EDITAR_REGISTRO
+        resultados[f"pagina:{pagina}:primeira"] = medir(teste.run, 1)
+        resultados[f"pagina:{pagina}:rerun"] = medir(teste.run, repeticoes)
+        if teste.exception:
+            raise RuntimeError(f"A página {pagina} falhou: {teste.exception[0].value}")
+    return resultados
+
+
+def executar_tamanho(tamanho, repeticoes, com_paginas):
+    """Executa todos os cenários para `tamanho` operações e `tamanho` gastos."""
+    registros = gerar_registros(tamanho)
+    gastos = gerar_gastos(tamanho)
+    resultados = {}
+    diretorio_original = os.getcwd()
+    with tempfile.TemporaryDirectory() as diretorio:
+        os.chdir(diretorio)
+        st.cache_data.clear()
+        try:
+            resultados["importacao_em_lote"] = medir(lambda: popular_banco(registros, gastos), 1)
+            resultados["carregar_registros:frio"] = medir(armazenamento.carregar_registros, repeticoes,
+                                                         preparar=armazenamento.invalidar_cache_dados)
+            resultados["carregar_registros:cache"] = medir(armazenamento.carregar_registros, repeticoes)
+            resultados["carregar_gastos:frio"] = medir(armazenamento.carregar_gastos, repeticoes,
+                                                      preparar=armazenamento.invalidar_cache_dados)
+            resultados["carregar_gastos_tabela:frio"] = medir(armazenamento.carregar_gastos_tabela, repeticoes,
+                                                             preparar=armazenamento.invalidar_cache_dados)
+
+            novos = gerar_registros(repeticoes, semente=7)
+            resultados["salvar_registro"] = medir(lambda: armazenamento.salvar_registro(novos.pop()), repeticoes)
+            novos_gastos = gerar_gastos(repeticoes, semente=7)
+            resultados["salvar_gasto"] = medir(lambda: armazenamento.salvar_gasto(novos_gastos.pop()), repeticoes)
+            ids = [registro["id"] for registro in armazenamento.carregar_registros()[:repeticoes]]
+            resultados["excluir_registro"] = medir(lambda: armazenamento.excluir_registro(ids.pop()), repeticoes)
+
+            carregados = armazenamento.carregar_registros()
+            resultados["editor:agrupar"] = medir(lambda: armazenamento.agrupar_registros_por_ano_mes(carregados), repeticoes)
+            resultados["exportar:dataframes"] = medir(
+                lambda: [relatorios.tabela_exportacao(carregados, tipo) for tipo in relatorios.ABAS_EXPORTACAO],
+                repeticoes)
+            resultados["exportar:excel"] = medir(lambda: relatorios.gerar_excel_operacoes(carregados), 1)
+
+            def excel_em_segundo_plano():
+                chave = tarefas.enviar_tarefa(app.TAREFA_EXCEL, app._gerar_excel, versao=armazenamento.versao_dados())
+                return tarefas.aguardar_tarefa(chave)
+            resultados["tarefas:excel:frio"] = medir(excel_em_segundo_plano, 1)
+            resultados["tarefas:excel:artefato"] = medir(excel_em_segundo_plano, repeticoes)
+            resultados["colunar:gerar"] = medir(colunar.atualizar_colunar, 1,
+                                                preparar=lambda: shutil.rmtree(colunar.pasta_colunar(), True))
+            resultados["colunar:atualizar_apos_salvar"] = medir(
+                colunar.atualizar_colunar, repeticoes,
+                preparar=lambda: armazenamento.salvar_registro(dict(carregados[0], cultura="Milho")))
+            resultados["exportar:dataframes_colunar"] = medir(
+                lambda: [relatorios.tabela_exportacao_colunar(tipo) for tipo in relatorios.ABAS_EXPORTACAO],
+                repeticoes)
+            anos = (min(registro["ano"] for registro in registros), max(registro["ano"] for registro in registros))
+            resultados["cli:exportar_parquet"] = medir(
+                lambda: relatorios.exportar_periodo(*anos, "parquet", os.path.join(diretorio, "exportacao")), 1)
+            resultados["cli:resumo_mensal"] = medir(lambda: relatorios.resumo_mensal(*anos), repeticoes)
+            resultados["tendencias:semanal"] = medir(
+                lambda: relatorios.series_tendencia(datetime.date(anos[0], 1, 1), datetime.date(anos[1], 12, 31),
+                                                    "semanal"), repeticoes)
+            resultados["busca:facetas:frio"] = medir(lambda: armazenamento.buscar_operacoes(filtros={"ano": anos[1]}),
+                                                     repeticoes, preparar=armazenamento.invalidar_cache_dados)
+            resultados["busca:texto_e_facetas"] = medir(
+                lambda: armazenamento.buscar_operacoes("soja", {"ano": anos[1], "tipo_operacao": "Operação Aérea"}),
+                repeticoes)
+            resultados["editor:carregar_ano:frio"] = medir(lambda: armazenamento.carregar_registros_do_ano(anos[1]),
+                                                          repeticoes, preparar=armazenamento.invalidar_cache_dados)
+            resultados["cli:custo_por_hectare"] = medir(lambda: relatorios.custo_por_hectare(*anos, por_fazenda=True),
+                                                        repeticoes)
+            resultados["cli:consumo_produtos"] = medir(lambda: relatorios.consumo_produtos(*anos), repeticoes,
+                                                       preparar=armazenamento.invalidar_cache_dados)
+            csvs = relatorios.exportar_periodo(*anos, "csv", os.path.join(diretorio, "exportacao"))
+            resultados["cli:importar_csv_validacao"] = medir(
+                lambda: importacao.importar_arquivos([(caminho, caminho) for caminho in csvs], gravar=False), 1)
+            resultados["graficos:resumos"] = medir(armazenamento._ler_resumos_do_banco, repeticoes)
+
+            def reconstruir():
+                with armazenamento._transacao_escrita(armazenamento.obter_engine()) as conexao:
+                    armazenamento.reconstruir_resumos(conexao)
+            resultados["graficos:reconstruir_resumos"] = medir(reconstruir, 1)
+
+            kml = os.path.join(diretorio, "talhoes.kml")
+            with open(kml, "w") as arquivo:
+                arquivo.write(gerar_kml_talhoes())
+            resultados["talhoes:importar_kml"] = medir(lambda: talhoes.importar_kml(kml), 1)
+            resultados["talhoes:camadas:frio"] = medir(talhoes.camadas_do_mapa, repeticoes,
+                                                       preparar=talhoes._camadas_em_cache.cache_clear)
+            resultados["talhoes:mapa_html"] = medir(talhoes.mapa_html, repeticoes)
+
+            log = os.path.join(diretorio, "voo.csv")
+            gravar_log_voo(log, tamanho * 100)
+            resultados["telemetria:resumir_log"] = medir(lambda: telemetria.resumir_logs([log], processos=1), repeticoes)
+            tamanho_parte = max(os.path.getsize(log) // 4, 1)
+            resultados["telemetria:resumir_log:paralelo"] = medir(
+                lambda: telemetria.resumir_logs([log], processos=4, tamanho_parte=tamanho_parte), repeticoes)
+
+            # Por último, pois tira o ano mais antigo do banco: as páginas passam a ler o arquivo dele
+            resultados["arquivo:arquivar_ano"] = medir(lambda: armazenamento.arquivar_ano(anos[0]), 1)
+            resultados["arquivo:carregar_registros:frio"] = medir(armazenamento.carregar_registros, repeticoes,
+                                                                 preparar=armazenamento.invalidar_cache_dados)
+
+            if com_paginas:
+                resultados.update(medir_paginas(repeticoes))
+        finally:
+            armazenamento.fechar_banco()
+            os.chdir(diretorio_original)
+    return resultados
+
+
+def comparar(relatorio, anterior, tolerancia):
+    """Lista os cenários cuja mediana piorou mais que `tolerancia` em relação ao relatório anterior."""
+    base = {(r["tamanho"], r["cenario"]): r["mediana_s"] for r in anterior["resultados"]}
+    regressoes = []
+    for resultado in relatorio["resultados"]:
+        referencia = base.get((resultado["tamanho"], resultado["cenario"]))
+        if referencia and resultado["mediana_s"] > referencia * (1 + tolerancia):
+            regressoes.append((resultado["tamanho"], resultado["cenario"], referencia, resultado["mediana_s"]))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1000, 10000],
+                        help="Quantidades de operações (e de gastos) a gerar, ex.: 1000 10000 500000")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--sem-paginas", action="store_true", help="Não executa as páginas pelo AppTest")
+    parser.add_argument("--saida", default="benchmark_resultados.json")
+    parser.add_argument("--comparar", help="Relatório anterior para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args()
+
+    relatorio = {
+        "gerado_em": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "repeticoes": args.repeticoes,
+        "resultados": [],
+    }
+    for tamanho in args.tamanhos:
+        for cenario, tempos in executar_tamanho(tamanho, args.repeticoes, not args.sem_paginas).items():
+            relatorio["resultados"].append({
+                "tamanho": tamanho,
+                "cenario": cenario,
+                "mediana_s": statistics.median(tempos),
+                "minimo_s": min(tempos),
+                "execucoes": len(tempos),
+            })
+            print(f"{tamanho:>8} {cenario:<45} {statistics.median(tempos) * 1000:10.1f} ms")
+
+    with open(args.saida, "w") as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+    if args.comparar:
+        with open(args.comparar) as arquivo:
+            regressoes = comparar(relatorio, json.load(arquivo), args.tolerancia)
+        for tamanho, cenario, antes, depois in regressoes:
+            print(f"REGRESSÃO {tamanho} {cenario}: {antes * 1000:.1f} ms -> {depois * 1000:.1f} ms")
+        if regressoes:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
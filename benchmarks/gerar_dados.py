@@ -0,0 +1,161 @@
+"""Gera operações e gastos sintéticos, no mesmo formato gravado pelo ControleDrone.
+
+Uso direto (grava os arquivos JSON legados, importados pelo app na primeira execução):
+
+    python benchmarks/gerar_dados.py --operacoes 10000 --gastos 10000 --destino /tmp/fazenda
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+
+MESES = ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho",
+         "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"]
+FAZENDAS = ["São Caetano", "Santa Helena", "Boa Vista", "Três Irmãos", "Santo Antônio", "Primavera"]
+CULTURAS = ["Soja", "Milho", "Algodão", "Feijão", "Trigo", "Sorgo"]
+PRODUTOS = ["Glifosato", "Atrazina", "Mancozebe", "Azoxistrobina", "Clorpirifós", "Tebuconazol",
+            "Imidacloprido", "Lambda-cialotrina", "Óleo mineral", "Fertilizante foliar"]
+AERONAVES = ["DJI Agras T40", "DJI Agras T30", "XAG P100"]
+TRATORES = ["John Deere 6125J", "Massey Ferguson 4292", "New Holland T7"]
+IMPLEMENTOS = ["Pulverizador 3000L", "Pulverizador 2000L", "Distribuidor"]
+RESPONSAVEIS = ["Carlos", "Ana", "João", "Marcos", "Luiza"]
+CATEGORIAS = ["Produtos", "Combustível", "Manutenção", "Outros"]
+
+
+def gerar_registros(quantidade, anos=(2022, 2023, 2024, 2025), semente=42):
+    """Gera `quantidade` operações, metade aéreas e metade terrestres (em média)."""
+    aleatorio = random.Random(semente)
+    registros = []
+    for _ in range(quantidade):
+        hectares = round(aleatorio.uniform(2.0, 150.0), 2)
+        comum = {
+            "mes": aleatorio.choice(MESES),
+            "ano": aleatorio.choice(anos),
+            "nome_fazenda": aleatorio.choice(FAZENDAS),
+            "talhao_aplicado": f"T{aleatorio.randint(1, 40):02d}",
+            "hectares_totais": hectares,
+            "cultura": aleatorio.choice(CULTURAS),
+            "responsavel": aleatorio.choice(RESPONSAVEIS),
+        }
+        nomes = aleatorio.sample(PRODUTOS, aleatorio.randint(1, 4))
+        if aleatorio.random() < 0.5:
+            produtos = []
+            for nome in nomes:
+                dose = round(aleatorio.uniform(0.1, 3.0), 2)
+                produtos.append({"nome": nome, "dose_por_hectare": dose, "dose_total": hectares * dose})
+            registros.append(dict(
+                comum,
+                tipo_operacao="Operação Aérea",
+                velocidade=round(aleatorio.uniform(3.0, 8.0), 1),
+                altura=round(aleatorio.uniform(2.0, 5.0), 1),
+                status=aleatorio.choice(["Em aberto", "Finalizado"]),
+                produtos=produtos,
+                aeronave=aleatorio.choice(AERONAVES),
+            ))
+        else:
+            produtos = [{"nome_produto": nome, "dose": round(aleatorio.uniform(0.1, 3.0), 2)} for nome in nomes]
+            registros.append(dict(
+                comum,
+                tipo_operacao="Operação Terrestre",
+                trator=aleatorio.choice(TRATORES),
+                implemento=aleatorio.choice(IMPLEMENTOS),
+                produtos=produtos,
+                observacao="",
+                status="Em aberto",
+                num_produtos_terrestre=len(produtos),
+            ))
+    return registros
+
+
+def gerar_gastos(quantidade, anos=(2022, 2023, 2024, 2025), semente=42):
+    """Gera `quantidade` gastos distribuídos pelos anos informados."""
+    aleatorio = random.Random(semente + 1)
+    # Sequência separada para a fazenda, que não altera os demais campos gerados
+    aleatorio_fazenda = random.Random(semente + 2)
+    inicio = datetime.date(min(anos), 1, 1)
+    dias = (datetime.date(max(anos), 12, 31) - inicio).days
+    gastos = []
+    for _ in range(quantidade):
+        categoria = aleatorio.choice(CATEGORIAS)
+        gasto = {
+            "descricao": f"{categoria} {aleatorio.randint(1, 9999)}",
+            "valor": round(aleatorio.uniform(50.0, 25000.0), 2),
+            "categoria": categoria,
+            "data": (inicio + datetime.timedelta(days=aleatorio.randint(0, dias))).strftime("%Y-%m-%d"),
+        }
+        if aleatorio_fazenda.random() < 0.7:
+            gasto["nome_fazenda"] = aleatorio_fazenda.choice(FAZENDAS)
+        gastos.append(gasto)
+    return gastos
+
+
+def gerar_kml_talhoes(talhoes_por_fazenda=40, pontos_por_talhao=200, semente=42):
+    """Gera um KML com uma pasta por fazenda e os talhões T01, T02... (os nomes das operações geradas).
+
+    Cada talhão é um polígono irregular de algumas dezenas de hectares, com `pontos_por_talhao` vértices.
+    """
+    aleatorio = random.Random(semente + 3)
+    pastas = []
+    for indice_fazenda, fazenda in enumerate(FAZENDAS):
+        placemarks = []
+        for numero in range(1, talhoes_por_fazenda + 1):
+            centro_lon = -47.0 + indice_fazenda * 0.2 + (numero % 8) * 0.012
+            centro_lat = -15.0 + (numero // 8) * 0.012
+            raio = aleatorio.uniform(250.0, 450.0)  # Metros
+            pontos = []
+            for i in range(pontos_por_talhao):
+                angulo = 2 * math.pi * i / pontos_por_talhao
+                distancia = raio * aleatorio.uniform(0.95, 1.05)
+                pontos.append(f"{centro_lon + distancia * math.cos(angulo) / 107550:.7f},"
+                              f"{centro_lat + distancia * math.sin(angulo) / 111320:.7f}")
+            pontos.append(pontos[0])
+            placemarks.append(f"<Placemark><name>T{numero:02d}</name><Polygon><outerBoundaryIs><LinearRing>"
+                              f"<coordinates>{' '.join(pontos)}</coordinates></LinearRing></outerBoundaryIs>"
+                              f"</Polygon></Placemark>")
+        pastas.append(f"<Folder><name>{fazenda}</name>{''.join(placemarks)}</Folder>")
+    return ('<?xml version="1.0" encoding="UTF-8"?><kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+            f"{''.join(pastas)}</Document></kml>")
+
+
+def gravar_log_voo(caminho, pontos, centro=(-46.988, -15.0), largura_faixa=9.0, semente=42):
+    """Grava um log de voo sintético em CSV, com `pontos` pontos a cada 0,5 s.
+
+    O drone faz passadas de ida e volta de 300 m a 6 m/s, a `largura_faixa` metros uma da outra, em volta de
+    `centro` (o talhão T01 da primeira fazenda do KML gerado), e não pulveriza nas manobras entre elas.
+    """
+    aleatorio = random.Random(semente + 4)
+    pontos_passada, pontos_manobra = 100, 6
+    inicio = datetime.datetime(2025, 3, 10, 8, 0).timestamp()
+    metros_lon = 111320 * math.cos(math.radians(centro[1]))
+    with open(caminho, "w") as arquivo:
+        arquivo.write("timestamp,latitude,longitude,altura,velocidade,vazao,pulverizando\n")
+        for i in range(pontos):
+            passada, posicao = divmod(i, pontos_passada + pontos_manobra)
+            pulverizando = posicao < pontos_passada
+            avanco = min(posicao, pontos_passada) * 3.0  # Metros na passada
+            y = (avanco if passada % 2 == 0 else 300 - avanco) - 150
+            x = (passada % 20) * largura_faixa - 90 + (0 if pulverizando else largura_faixa / 2)
+            arquivo.write(f"{inicio + i * 0.5:.1f},{centro[1] + y / 111320:.7f},{centro[0] + x / metros_lon:.7f},"
+                          f"{3 + aleatorio.uniform(-0.3, 0.3):.2f},{6 + aleatorio.uniform(-0.5, 0.5):.2f},"
+                          f"{8.0 if pulverizando else 0.0},{int(pulverizando)}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operacoes", type=int, default=1000)
+    parser.add_argument("--gastos", type=int, default=1000)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--destino", default=".", help="Pasta onde gravar registros.json e gastos.json")
+    args = parser.parse_args()
+
+    os.makedirs(args.destino, exist_ok=True)
+    with open(os.path.join(args.destino, "registros.json"), "w") as arquivo:
+        json.dump(gerar_registros(args.operacoes, semente=args.semente), arquivo, ensure_ascii=False)
+    with open(os.path.join(args.destino, "gastos.json"), "w") as arquivo:
+        json.dump(gerar_gastos(args.gastos, semente=args.semente), arquivo, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Mede o custo de inicialização do ControleDrone em interpretadores novos.
+
+Cada medição roda num subprocesso separado, para que nenhum módulo já esteja em cache:
+
+- importacao: tempo de `import ControleDrone`;
+- primeira_pagina: importação mais a primeira execução da página padrão (Registro) pelo AppTest;
+- modulos_pesados: quanto custaria importar pandas, plotly.express e openpyxl logo na partida.
+
+    python benchmarks/tempo_inicializacao.py --repeticoes 5 --saida inicializacao.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CENARIOS = {
+    "importacao": """
+import time
+inicio = time.perf_counter()
+import ControleDrone
+print(time.perf_counter() - inicio)
+""",
+    "primeira_pagina": """
+import time
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+teste = AppTest.from_file({arquivo_app!r}, default_timeout=120)
+teste.run()
+assert not teste.exception, teste.exception
+print(time.perf_counter() - inicio)
+""",
+    "modulos_pesados": """
+import time
+inicio = time.perf_counter()
+import pandas, plotly.express, openpyxl
+print(time.perf_counter() - inicio)
+""",
+}
+
+
+def medir_cenario(codigo, diretorio):
+    """Executa o código num interpretador novo e devolve o tempo (em segundos) que ele imprimiu."""
+    ambiente = dict(os.environ, PYTHONPATH=RAIZ, STREAMLIT_LOGGER_LEVEL="error")
+    saida = subprocess.run([sys.executable, "-c", codigo], cwd=diretorio, env=ambiente, check=True,
+                           capture_output=True, text=True).stdout
+    return float(saida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--saida", default="inicializacao_resultados.json")
+    args = parser.parse_args()
+
+    arquivo_app = os.path.join(RAIZ, "ControleDrone.py")
+    relatorio = {
+        "gerado_em": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "resultados": [],
+    }
+    with tempfile.TemporaryDirectory() as diretorio:
+        for cenario, codigo in CENARIOS.items():
+            tempos = [medir_cenario(codigo.format(arquivo_app=arquivo_app), diretorio)
+                      for _ in range(args.repeticoes)]
+            relatorio["resultados"].append({
+                "cenario": cenario,
+                "mediana_s": statistics.median(tempos),
+                "minimo_s": min(tempos),
+                "execucoes": len(tempos),
+            })
+            print(f"{cenario:<20} {statistics.median(tempos) * 1000:10.1f} ms")
+
+    with open(args.saida, "w") as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
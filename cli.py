@@ -0,0 +1,221 @@
+"""Linha de comando do ControleDrone, para exportações, resumos, importações em lote, arquivo de anos, talhões e
+logs de voo sem abrir o app.
+
+    python cli.py --banco fazenda.db exportar --formato excel --ano-inicial 2023 --ano-final 2024 --saida relatorios/operacoes
+    python cli.py resumo --ano-inicial 2020 --ano-final 2025
+    python cli.py resumo --ano-inicial 2024 --formato csv --saida relatorios/resumo_2024.csv
+    python cli.py produtos --ano-inicial 2024 --nivel fazenda
+    python cli.py custos --ano-inicial 2022 --ano-final 2025 --por-fazenda
+    python cli.py importar safra_2024.xlsx gastos_2024.csv --validar
+    python cli.py arquivar 2022
+    python cli.py desarquivar 2022
+    python cli.py talhoes limites.kml --fazenda "Fazenda São Caetano"
+    python cli.py telemetria logs/2025/*.csv.gz --processos 8
+"""
+import argparse
+import datetime
+import sys
+
+import armazenamento
+import importacao
+import relatorios
+import talhoes
+import telemetria
+
+FORMATOS_RESUMO = ["tabela", "csv", "json", "parquet", "xlsx"]  # Também usados pelo consumo de produtos
+
+
+def _periodo(args):
+    """Ano inicial e final pedidos; sem ano final, vai até o ano inicial (ou o atual, se nenhum for dado)."""
+    ano_atual = datetime.datetime.now().year
+    ano_inicial = args.ano_inicial or args.ano_final or ano_atual
+    ano_final = args.ano_final or (args.ano_inicial or ano_atual)
+    if ano_inicial > ano_final:
+        raise SystemExit(f"Ano inicial ({ano_inicial}) maior que o ano final ({ano_final}).")
+    return ano_inicial, ano_final
+
+
+def comando_exportar(args):
+    """Exporta operações e gastos do período nos formatos Excel, CSV ou Parquet."""
+    ano_inicial, ano_final = _periodo(args)
+    base = args.saida or f"operacoes_{ano_inicial}_{ano_final}"
+    for caminho in relatorios.exportar_periodo(ano_inicial, ano_final, args.formato, base):
+        print(caminho)
+
+
+def _escrever_tabela(tabela, args, nome_aba):
+    """Mostra ou grava um DataFrame no formato pedido em `args` (ver FORMATOS_RESUMO)."""
+    if args.formato == "tabela":
+        print(tabela.to_string(index=False) if not tabela.empty else "Nenhum movimento no período.")
+        return
+    destino = args.saida or sys.stdout
+    if args.formato == "csv":
+        tabela.to_csv(destino, index=False)
+    elif args.formato == "json":
+        tabela.to_json(destino, orient="records", force_ascii=False, indent=2)
+    elif args.saida is None:
+        raise SystemExit(f"O formato {args.formato} exige --saida.")
+    elif args.formato == "parquet":
+        tabela.to_parquet(args.saida, index=False)
+    else:
+        tabela.to_excel(args.saida, index=False, sheet_name=nome_aba)
+
+
+def comando_resumo(args):
+    """Mostra ou grava o resumo mensal de hectares e gastos do período."""
+    _escrever_tabela(relatorios.resumo_mensal(*_periodo(args)), args, "Resumo")
+
+
+def comando_produtos(args):
+    """Mostra ou grava o consumo mensal de cada produto no período, no nível de detalhe pedido."""
+    _escrever_tabela(relatorios.consumo_produtos(*_periodo(args), nivel=args.nivel), args, "Produtos")
+
+
+def comando_custos(args):
+    """Mostra ou grava o custo por hectare mensal do período, no total ou por fazenda."""
+    _escrever_tabela(relatorios.custo_por_hectare(*_periodo(args), por_fazenda=args.por_fazenda), args, "Custos")
+
+
+def comando_importar(args):
+    """Importa planilhas CSV ou Excel em lote; sai com código 1 se alguma linha tiver erro."""
+    try:
+        resultado = importacao.importar_arquivos([(arquivo, arquivo) for arquivo in args.arquivos],
+                                                 gravar=not args.validar, tamanho_bloco=args.tamanho_bloco,
+                                                 separador=args.separador)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for erro in resultado["erros"]:
+        aba = f"[{erro['aba']}]" if erro["aba"] else ""
+        print(f"{erro['arquivo']}{aba}:{erro['linha']}: {erro['campo']}: {erro['mensagem']}", file=sys.stderr)
+    situacao = "importados" if resultado["gravado"] else "válidos (nada gravado)"
+    print(f"{resultado['operacoes']} operações e {resultado['gastos']} gastos {situacao}; "
+          f"{resultado['linhas_com_erro']} linhas com erro, {resultado['operacoes_rejeitadas']} operações rejeitadas.")
+    if resultado["erros"]:
+        raise SystemExit(1)
+
+
+def comando_arquivar(args):
+    """Arquiva um ano encerrado em arquivos compactados somente leitura."""
+    try:
+        arquivado = armazenamento.arquivar_ano(args.ano)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"{args.ano}: {arquivado['operacoes']} operações e {arquivado['gastos']} gastos arquivados em "
+          f"{armazenamento.pasta_arquivo()}.")
+
+
+def comando_desarquivar(args):
+    """Devolve ao banco um ano arquivado, para correções."""
+    try:
+        armazenamento.desarquivar_ano(args.ano)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"{args.ano} desarquivado.")
+
+
+def comando_talhoes(args):
+    """Importa os limites dos talhões de arquivos KML ou KMZ, com a área de cada um."""
+    for arquivo in args.arquivos:
+        try:
+            quantidade, avisos = talhoes.importar_kml(arquivo, args.fazenda)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"{arquivo}: {e}")
+        for aviso in avisos:
+            print(f"{arquivo}: {aviso}", file=sys.stderr)
+        print(f"{arquivo}: {quantidade} talhões importados.")
+
+
+def comando_telemetria(args):
+    """Resume logs de voo e anexa cada um à sua operação aérea; sai com código 1 se algum ficar sem operação."""
+    try:
+        resultados = telemetria.ingerir_logs(args.arquivos, args.operacao, args.largura_faixa, args.processos,
+                                             gravar=not args.validar)
+    except (OSError, ValueError) as e:
+        raise SystemExit(str(e))
+    for resultado in resultados:
+        resumo = resultado["resumo"]
+        volume = "-" if resumo["volume_litros"] is None else f"{resumo['volume_litros']:.1f} L"
+        print(f"{resultado['arquivo']}: {resumo['hectares_cobertos']:.2f} ha cobertos, "
+              f"{resumo['hectares_aplicados']:.2f} ha aplicados, {volume}, {resumo['minutos']:.1f} min, "
+              f"velocidade {resumo['velocidade_media']}, altura {resumo['altura_media']}")
+        if resultado["operacao"] is None:
+            print(f"{resultado['arquivo']}: sem operação: {resultado['motivo']}", file=sys.stderr)
+        else:
+            situacao = "anexado à" if not args.validar else "seria anexado à"
+            print(f"{resultado['arquivo']}: {situacao} operação {resultado['operacao']}")
+    if any(resultado["operacao"] is None for resultado in resultados):
+        raise SystemExit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--banco", default=armazenamento.ARQUIVO_BANCO, help="Arquivo do banco SQLite")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    exportar = subcomandos.add_parser("exportar", help="Exporta operações e gastos de um período")
+    exportar.add_argument("--formato", choices=relatorios.FORMATOS_EXPORTACAO, default="excel")
+    exportar.add_argument("--saida", help="Caminho dos arquivos, sem extensão")
+    exportar.set_defaults(executar=comando_exportar)
+
+    resumo = subcomandos.add_parser("resumo", help="Resumo mensal de hectares e gastos de um período")
+    resumo.add_argument("--formato", choices=FORMATOS_RESUMO, default="tabela")
+    resumo.add_argument("--saida", help="Arquivo de saída (padrão: saída padrão, para csv e json)")
+    resumo.set_defaults(executar=comando_resumo)
+
+    produtos = subcomandos.add_parser("produtos", help="Consumo mensal de cada produto num período")
+    produtos.add_argument("--nivel", choices=list(relatorios.NIVEIS_CONSUMO), default="talhao",
+                          help="Detalhe: por fazenda e talhão, só por fazenda ou só por produto")
+    produtos.add_argument("--formato", choices=FORMATOS_RESUMO, default="tabela")
+    produtos.add_argument("--saida", help="Arquivo de saída (padrão: saída padrão, para csv e json)")
+    produtos.set_defaults(executar=comando_produtos)
+
+    custos = subcomandos.add_parser("custos", help="Custo por hectare mensal (Produtos e Combustível) num período")
+    custos.add_argument("--por-fazenda", action="store_true", help="Um custo por fazenda em vez do total do mês")
+    custos.add_argument("--formato", choices=FORMATOS_RESUMO, default="tabela")
+    custos.add_argument("--saida", help="Arquivo de saída (padrão: saída padrão, para csv e json)")
+    custos.set_defaults(executar=comando_custos)
+
+    importar = subcomandos.add_parser("importar", help="Importa operações e gastos de planilhas CSV ou Excel")
+    importar.add_argument("arquivos", nargs="+", help="Arquivos .csv ou .xlsx no formato da exportação")
+    importar.add_argument("--validar", action="store_true", help="Só valida, sem gravar")
+    importar.add_argument("--tamanho-bloco", type=int, default=importacao.TAMANHO_BLOCO)
+    importar.add_argument("--separador", default=",", help="Separador dos arquivos CSV")
+    importar.set_defaults(executar=comando_importar)
+
+    arquivar = subcomandos.add_parser("arquivar", help="Arquiva um ano encerrado (somente leitura daí em diante)")
+    arquivar.add_argument("ano", type=int)
+    arquivar.set_defaults(executar=comando_arquivar)
+
+    desarquivar = subcomandos.add_parser("desarquivar", help="Devolve ao banco um ano arquivado, para correções")
+    desarquivar.add_argument("ano", type=int)
+    desarquivar.set_defaults(executar=comando_desarquivar)
+
+    importar_talhoes = subcomandos.add_parser("talhoes", help="Importa os limites dos talhões de arquivos KML")
+    importar_talhoes.add_argument("arquivos", nargs="+", help="Arquivos .kml ou .kmz, um Placemark por talhão")
+    importar_talhoes.add_argument("--fazenda", help="Fazenda dos talhões (padrão: o nome da pasta do KML)")
+    importar_talhoes.set_defaults(executar=comando_talhoes)
+
+    logs = subcomandos.add_parser("telemetria", help="Lê logs de voo e anexa área, velocidade, altura e volume "
+                                                     "às operações aéreas")
+    logs.add_argument("arquivos", nargs="+", help="Logs .csv ou .jsonl (opcionalmente .gz), um ponto por linha")
+    logs.add_argument("--operacao", type=int, help="Id da operação (padrão: a do mês do voo no talhão sobrevoado)")
+    logs.add_argument("--largura-faixa", type=float, default=telemetria.LARGURA_FAIXA,
+                      help="Largura da faixa de pulverização, em metros")
+    logs.add_argument("--processos", type=int, help="Processos em paralelo (padrão: um por CPU)")
+    logs.add_argument("--validar", action="store_true", help="Só resume e procura as operações, sem gravar")
+    logs.set_defaults(executar=comando_telemetria)
+
+    for subparser in (exportar, resumo, produtos, custos):
+        subparser.add_argument("--ano-inicial", type=int)
+        subparser.add_argument("--ano-final", type=int)
+
+    args = parser.parse_args(argv)
+    armazenamento.usar_banco(args.banco)
+    try:
+        args.executar(args)
+    finally:
+        armazenamento.fechar_banco()
+
+
+if __name__ == "__main__":
+    main()
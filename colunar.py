@@ -0,0 +1,194 @@
+"""Cópia colunar (Parquet) das operações, para as páginas e relatórios analíticos.
+
+Guarda, por ano, duas tabelas planas ao lado do banco (em fazenda_colunar/):
+
+- operacoes_<ano>.parquet: uma linha por operação, com os campos do registro em colunas;
+- produtos_<ano>.parquet: uma linha por produto, com o nome e a dose normalizados entre os
+  esquemas Aéreo (`nome`/`dose_por_hectare`) e Terrestre (`nome_produto`/`dose`).
+
+Cada arquivo guarda nos metadados a versão do ano (tabela versoes_ano) a partir da qual foi
+gerado; a cada leitura só os anos alterados desde então são refeitos. Os arquivos são
+gravados num temporário e trocados com os.replace, e lidos com memory map e só as colunas pedidas.
+"""
+import functools
+import os
+import threading
+
+import armazenamento
+from armazenamento import (MESES, ano_do_registro, converter_numero, ler_registros_por_anos, ler_versoes_anos,
+                           produtos_do_registro, tabela_operacoes, versao_dados)
+from diagnostico import instrumentar
+
+CHAVE_VERSAO = b"versao_ano"
+
+# Campos de texto e numéricos do registro copiados para a tabela de operações
+CAMPOS_TEXTO = ["mes", "tipo_operacao", "nome_fazenda", "talhao_aplicado", "cultura", "aeronave", "trator",
+                "implemento", "observacao", "responsavel", "status"]
+CAMPOS_NUMERICOS = ["hectares_totais", "velocidade", "altura"]
+
+# Última versão dos dados para a qual a cópia foi conferida, por banco
+_conferido = {}
+_trava = threading.Lock()
+
+
+@functools.cache
+def esquemas():
+    """Esquemas das tabelas de operações e de produtos (criados na primeira chamada, para importar o pyarrow só aqui)."""
+    import pyarrow as pa
+
+    comuns = [("id", pa.int64()), ("ano", pa.int32()), ("mes_numero", pa.int8())]
+    operacoes = pa.schema(comuns + [(campo, pa.string()) for campo in CAMPOS_TEXTO]
+                          + [(campo, pa.float64()) for campo in CAMPOS_NUMERICOS] + [("num_produtos", pa.int32())])
+    produtos = pa.schema(comuns + [
+        ("ordem", pa.int32()),
+        ("tipo_operacao", pa.string()),
+        ("nome_fazenda", pa.string()),
+        ("talhao_aplicado", pa.string()),
+        ("hectares_totais", pa.float64()),
+        ("produto", pa.string()),
+        ("dose", pa.float64()),
+        ("dose_total", pa.float64()),
+    ])
+    return {"operacoes": operacoes, "produtos": produtos}
+
+
+def pasta_colunar():
+    """Pasta dos arquivos Parquet, ao lado do banco atual."""
+    return os.path.splitext(os.path.abspath(armazenamento.ARQUIVO_BANCO))[0] + "_colunar"
+
+
+def _caminho(tabela, ano):
+    """Arquivo Parquet de uma tabela num ano."""
+    return os.path.join(pasta_colunar(), f"{tabela}_{ano}.parquet")
+
+
+def _texto(valor):
+    """Converte para texto, mantendo None."""
+    return None if valor is None else str(valor)
+
+
+def _colunas_do_ano(registros):
+    """Monta as colunas das tabelas de operações e de produtos para os registros de um ano."""
+    operacoes = {campo: [] for campo in esquemas()["operacoes"].names}
+    produtos = {campo: [] for campo in esquemas()["produtos"].names}
+    for registro in registros:
+        mes_numero = MESES.index(registro["mes"]) + 1 if registro.get("mes") in MESES else None
+        lista = produtos_do_registro(registro)
+        operacoes["id"].append(registro["id"])
+        operacoes["ano"].append(ano_do_registro(registro))
+        operacoes["mes_numero"].append(mes_numero)
+        for campo in CAMPOS_TEXTO:
+            operacoes[campo].append(_texto(registro.get(campo)))
+        for campo in CAMPOS_NUMERICOS:
+            operacoes[campo].append(converter_numero(registro.get(campo)))
+        operacoes["num_produtos"].append(len(lista))
+        for ordem, (nome, dose, dose_total) in enumerate(lista):
+            produtos["id"].append(registro["id"])
+            produtos["ano"].append(ano_do_registro(registro))
+            produtos["mes_numero"].append(mes_numero)
+            produtos["ordem"].append(ordem)
+            produtos["tipo_operacao"].append(_texto(registro.get("tipo_operacao")))
+            produtos["nome_fazenda"].append(_texto(registro.get("nome_fazenda")))
+            produtos["talhao_aplicado"].append(_texto(registro.get("talhao_aplicado")))
+            produtos["hectares_totais"].append(converter_numero(registro.get("hectares_totais")))
+            produtos["produto"].append(nome)
+            produtos["dose"].append(dose)
+            produtos["dose_total"].append(dose_total)
+    return {"operacoes": operacoes, "produtos": produtos}
+
+
+def _gravar_atomico(tabela, caminho):
+    """Grava o Parquet num arquivo temporário e o coloca no lugar de uma vez, sem leitores verem um arquivo parcial."""
+    import pyarrow.parquet as pq
+
+    temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        pq.write_table(tabela, temporario, compression="zstd")
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+@instrumentar
+def _refazer_ano(ano, versao):
+    """Gera de novo os arquivos de um ano a partir do banco."""
+    import pyarrow as pa
+
+    colunas = _colunas_do_ano(ler_registros_por_anos(ano, ano))
+    metadados = {CHAVE_VERSAO: str(versao).encode()}
+    for nome, esquema in esquemas().items():
+        tabela = pa.Table.from_pydict(colunas[nome], schema=esquema.with_metadata(metadados))
+        _gravar_atomico(tabela, _caminho(nome, ano))
+
+
+def _versao_gravada(ano):
+    """Versão a partir da qual os arquivos do ano foram gerados, ou None se faltar algum."""
+    import pyarrow.parquet as pq
+
+    versoes = set()
+    for nome in esquemas():
+        try:
+            metadados = pq.read_schema(_caminho(nome, ano), memory_map=True).metadata or {}
+        except FileNotFoundError:
+            return None
+        versoes.add(metadados.get(CHAVE_VERSAO))
+    return int(versoes.pop()) if len(versoes) == 1 and None not in versoes else None
+
+
+@instrumentar
+def atualizar_colunar():
+    """Refaz os arquivos dos anos alterados desde a última atualização e devolve esses anos.
+
+    A conferência é pulada enquanto o banco não mudar (mesma versao_dados).
+    """
+    assinatura = (pasta_colunar(), versao_dados())
+    with _trava:
+        if _conferido.get(assinatura[0]) == assinatura[1]:
+            return []
+        # As versões são lidas antes dos dados: se o banco mudar no meio, o ano fica para a próxima conferência
+        versoes = ler_versoes_anos(tabela_operacoes)
+        os.makedirs(pasta_colunar(), exist_ok=True)
+        refeitos = [ano for ano, versao in sorted(versoes.items()) if _versao_gravada(ano) != versao]
+        for ano in refeitos:
+            _refazer_ano(ano, versoes[ano])
+        _conferido[assinatura[0]] = assinatura[1]
+    return refeitos
+
+
+def anos_disponiveis():
+    """Anos com arquivos colunares gerados."""
+    atualizar_colunar()
+    return sorted(int(nome[len("operacoes_"):-len(".parquet")]) for nome in os.listdir(pasta_colunar())
+                  if nome.startswith("operacoes_") and nome.endswith(".parquet"))
+
+
+def _ler(tabela, colunas, anos, filtros):
+    """Lê e concatena os arquivos de `tabela` dos anos pedidos, só com as colunas pedidas."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = esquemas()[tabela]
+    disponiveis = anos_disponiveis()
+    anos = disponiveis if anos is None else sorted(set(anos) & set(disponiveis))
+    partes = [pq.read_table(_caminho(tabela, ano), columns=colunas, memory_map=True, filters=filtros)
+              for ano in anos]
+    if not partes:
+        campos = [esquema.field(coluna) for coluna in (colunas or esquema.names)]
+        return pa.schema(campos).empty_table()
+    return pa.concat_tables(partes).replace_schema_metadata(None)
+
+
+@instrumentar
+def ler_operacoes(colunas=None, anos=None, filtros=None):
+    """Tabela pyarrow de operações (uma linha por operação), só com as `colunas` e `anos` pedidos.
+
+    `filtros` segue o formato de pyarrow.parquet.read_table, ex.: [("tipo_operacao", "=", "Operação Aérea")].
+    """
+    return _ler("operacoes", colunas, anos, filtros)
+
+
+@instrumentar
+def ler_produtos(colunas=None, anos=None, filtros=None):
+    """Tabela pyarrow de produtos aplicados (uma linha por produto), só com as `colunas` e `anos` pedidos."""
+    return _ler("produtos", colunas, anos, filtros)
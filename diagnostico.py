@@ -0,0 +1,117 @@
+"""Instrumentação opcional das execuções do ControleDrone.
+
+Ligada com FAZENDA_DIAGNOSTICO=1 ou, no app, com ?diagnostico=1 na URL. As medições
+valem por execução do script: cada sessão do Streamlit roda em sua própria thread,
+então o estado fica em `threading.local` e é reiniciado por iniciar_execucao().
+"""
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+ARQUIVO_LOG_DIAGNOSTICO = "diagnostico.log"
+DIAGNOSTICO_POR_AMBIENTE = os.environ.get("FAZENDA_DIAGNOSTICO") == "1"
+
+_estado = threading.local()
+_trava_log = threading.Lock()
+
+
+def _execucao():
+    """Estado de diagnóstico da execução corrente (criado na primeira consulta da thread)."""
+    if not hasattr(_estado, "ativo"):
+        iniciar_execucao(DIAGNOSTICO_POR_AMBIENTE)
+    return _estado
+
+
+def iniciar_execucao(ativo):
+    """Começa uma nova execução, descartando as medições da anterior."""
+    _estado.ativo = ativo
+    _estado.medicoes = []
+    _estado.nivel = 0
+    _estado.bytes_lidos = 0
+    _estado.bytes_gravados = 0
+
+
+def diagnostico_ativo():
+    """Indica se a execução corrente está sendo medida."""
+    return _execucao().ativo
+
+
+@contextlib.contextmanager
+def medir_trecho(nome):
+    """Mede a duração de um trecho de código quando o diagnóstico está ativo."""
+    estado = _execucao()
+    if not estado.ativo:
+        yield
+        return
+    nivel = estado.nivel
+    estado.nivel += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        estado.nivel = nivel
+        estado.medicoes.append(
+            {"trecho": nome, "nivel": nivel, "inicio": inicio, "ms": (time.perf_counter() - inicio) * 1000})
+
+
+def instrumentar(funcao):
+    """Decorador que mede cada chamada de `funcao` com medir_trecho."""
+    @functools.wraps(funcao)
+    def envoltorio(*args, **kwargs):
+        if not _execucao().ativo:
+            return funcao(*args, **kwargs)
+        with medir_trecho(funcao.__name__):
+            return funcao(*args, **kwargs)
+    return envoltorio
+
+
+def contar_bytes(sentido, quantidade):
+    """Acumula os bytes lidos ou gravados no banco ('lidos' ou 'gravados')."""
+    estado = _execucao()
+    if estado.ativo:
+        setattr(estado, f"bytes_{sentido}", getattr(estado, f"bytes_{sentido}") + quantidade)
+
+
+def bytes_da_execucao():
+    """Bytes lidos e gravados no banco durante a execução corrente."""
+    estado = _execucao()
+    return {"lidos": estado.bytes_lidos, "gravados": estado.bytes_gravados}
+
+
+def medicoes_ordenadas():
+    """Medições da execução na ordem em que os trechos começaram."""
+    return sorted(_execucao().medicoes, key=lambda medicao: medicao["inicio"])
+
+
+def _obter_log_diagnostico():
+    """Logger com rotação de arquivo, configurado uma vez por processo."""
+    logger = logging.getLogger("fazenda.diagnostico")
+    with _trava_log:
+        if not logger.handlers:
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            manipulador = RotatingFileHandler(ARQUIVO_LOG_DIAGNOSTICO, maxBytes=5 * 1024 * 1024, backupCount=5,
+                                              encoding="utf-8")
+            manipulador.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(manipulador)
+    return logger
+
+
+def registrar_diagnostico(pagina, total_ms, cache):
+    """Grava no log estruturado (uma linha JSON) as medições desta execução."""
+    _obter_log_diagnostico().info(json.dumps({
+        "momento": datetime.datetime.now().isoformat(),
+        "pagina": pagina,
+        "total_ms": round(total_ms, 2),
+        "bytes_lidos": _execucao().bytes_lidos,
+        "bytes_gravados": _execucao().bytes_gravados,
+        "cache": cache,
+        "medicoes": [{"trecho": m["trecho"], "nivel": m["nivel"], "ms": round(m["ms"], 2)}
+                     for m in medicoes_ordenadas()],
+    }, ensure_ascii=False))
@@ -0,0 +1,338 @@
+"""Importação em lote de operações e gastos a partir de planilhas CSV ou Excel.
+
+As planilhas seguem o formato da exportação (relatorios.py): as colunas das abas Aérea e
+Terrestre, com uma linha por produto, ou as colunas da aba Gastos. Linhas seguidas com os
+mesmos dados de operação formam uma única operação com vários produtos, até que um produto se
+repita: aí começa outra operação (aplicações repetidas, com os mesmos dados, em linhas seguidas).
+
+Os arquivos são lidos em blocos e cada bloco é validado de uma vez, com as mesmas regras
+de validar_campos. Uma operação com qualquer linha inválida é rejeitada inteira; as
+aceitas de todos os arquivos são gravadas juntas, numa única transação.
+"""
+import itertools
+
+from armazenamento import CATEGORIAS_GASTO, ERRO_DOSE, ERRO_HECTARES, MESES, importar_em_lote
+from diagnostico import instrumentar
+from relatorios import ABA_GASTOS, ABAS_EXPORTACAO, COLUNAS_NUMERICAS
+
+TAMANHO_BLOCO = 5000
+VALORES_VAZIOS = ["", "N/A", "nan", "NaN", "None"]
+
+# Campo do registro correspondente a cada coluna de operação da planilha
+CAMPOS_OPERACAO = {
+    'Mês': 'mes', 'Ano': 'ano', 'Fazenda': 'nome_fazenda', 'Talhão': 'talhao_aplicado',
+    'Hectares': 'hectares_totais', 'Cultura': 'cultura', 'Velocidade': 'velocidade', 'Altura': 'altura',
+    'Trator': 'trator', 'Implemento': 'implemento', 'Observação': 'observacao', 'Aeronave': 'aeronave',
+    'Responsável': 'responsavel', 'Status': 'status',
+}
+# Campo do produto correspondente a cada coluna de produto, por tipo de operação
+CAMPOS_PRODUTO = {
+    "Operação Aérea": {'Produto': 'nome', 'Dose por Hectare': 'dose_por_hectare', 'Dose Total': 'dose_total'},
+    "Operação Terrestre": {'Produto': 'nome_produto', 'Dose': 'dose'},
+}
+COLUNAS_OBRIGATORIAS = {"Operação Aérea": ['Mês', 'Ano'], "Operação Terrestre": ['Mês', 'Ano'],
+                        ABA_GASTOS[0]: ['Data', 'Categoria', 'Valor']}
+LAYOUTS = {tipo_operacao: colunas for tipo_operacao, (_, colunas) in ABAS_EXPORTACAO.items()}
+LAYOUTS[ABA_GASTOS[0]] = ABA_GASTOS[1]
+
+
+def _identificar_layout(colunas, nome_aba=None):
+    """Tipo de operação (ou "Gastos") de uma planilha, pelo título da aba ou pelas colunas exclusivas do layout."""
+    titulos = {titulo_aba: tipo_operacao for tipo_operacao, (titulo_aba, _) in ABAS_EXPORTACAO.items()}
+    titulos[ABA_GASTOS[0]] = ABA_GASTOS[0]
+    if nome_aba in titulos:
+        return titulos[nome_aba]
+    pontuacao = {}
+    for layout, colunas_layout in LAYOUTS.items():
+        outras = set().union(*(set(c) for nome, c in LAYOUTS.items() if nome != layout))
+        pontuacao[layout] = len((set(colunas_layout) - outras) & set(colunas))
+    melhor = max(pontuacao, key=pontuacao.get)
+    return melhor if pontuacao[melhor] else None
+
+
+def _valor_celula(valor):
+    """Converte uma célula do Excel em texto, como as lidas do CSV."""
+    if valor is None:
+        return ""
+    if hasattr(valor, "strftime"):
+        return valor.strftime("%Y-%m-%d")
+    return str(valor)
+
+
+def _blocos_excel(fonte, tamanho_bloco):
+    """Gera (aba, primeira linha, DataFrame) com até `tamanho_bloco` linhas de cada aba de um .xlsx."""
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    pasta = load_workbook(fonte, read_only=True, data_only=True)
+    try:
+        for aba in pasta.worksheets:
+            linhas = aba.iter_rows(values_only=True)
+            cabecalho = next(linhas, None)
+            if cabecalho is None:
+                continue
+            colunas = [_valor_celula(valor).strip() for valor in cabecalho]
+            bloco, inicio = [], 2
+            for linha in linhas:
+                celulas = [_valor_celula(valor) for valor in linha[:len(colunas)]]
+                bloco.append(celulas + [""] * (len(colunas) - len(celulas)))
+                if len(bloco) == tamanho_bloco:
+                    yield aba.title, inicio, pd.DataFrame(bloco, columns=colunas)
+                    inicio += len(bloco)
+                    bloco = []
+            if bloco:
+                yield aba.title, inicio, pd.DataFrame(bloco, columns=colunas)
+    finally:
+        pasta.close()
+
+
+def _blocos_csv(fonte, tamanho_bloco, separador):
+    """Gera (None, primeira linha, DataFrame) com até `tamanho_bloco` linhas de um CSV."""
+    import pandas as pd
+
+    leitor = pd.read_csv(fonte, sep=separador, dtype=str, keep_default_na=False, skip_blank_lines=False,
+                         encoding="utf-8-sig", chunksize=tamanho_bloco)
+    inicio = 2
+    for bloco in leitor:
+        bloco.columns = [str(coluna).strip() for coluna in bloco.columns]
+        yield None, inicio, bloco
+        inicio += len(bloco)
+
+
+def _ler_blocos(nome, fonte, tamanho_bloco, separador):
+    """Lê o arquivo em blocos, pelo formato indicado na extensão de `nome`."""
+    if nome.lower().endswith(".xlsx"):
+        return _blocos_excel(fonte, tamanho_bloco)
+    return _blocos_csv(fonte, tamanho_bloco, separador)
+
+
+def _normalizar_bloco(bloco, inicio, colunas):
+    """Converte as colunas do layout de uma vez: textos sem espaços, números convertidos e 'N/A' como nulo.
+
+    Devolve a tabela convertida (com a coluna `_linha`, o número da linha no arquivo) e os erros de conversão.
+    """
+    import pandas as pd
+
+    linhas = pd.Series(range(inicio, inicio + len(bloco)), index=bloco.index)
+    valores = {"_linha": linhas}
+    erros = []
+    em_branco = pd.Series(True, index=bloco.index)
+    for coluna in colunas:
+        if coluna in bloco:
+            texto = bloco[coluna].fillna("").astype(str).str.strip()
+            em_branco &= texto.eq("")
+        else:
+            texto = pd.Series("N/A", index=bloco.index)
+        vazio = texto.isin(VALORES_VAZIOS)
+        if coluna in COLUNAS_NUMERICAS:
+            numero = pd.to_numeric(texto.mask(vazio), errors="coerce")
+            erros += _erros_da_mascara(linhas, ~vazio & numero.isna(), coluna, f"{coluna} deve ser um número")
+            # to_numeric pode errar o último dígito; a conversão de float é exata e evita diferenças na ida e volta
+            validos = numero.notna()
+            numero[validos] = texto[validos].astype(float)
+            valores[coluna] = numero
+        else:
+            # Texto vazio é mantido (a exportação grava assim uma observação em branco); 'N/A' vira nulo
+            valores[coluna] = texto.mask(vazio & texto.ne(""))
+    tabela = pd.DataFrame(valores)
+    # Linhas totalmente em branco são ignoradas, sem mudar a numeração das demais
+    return tabela[~em_branco], erros
+
+
+def _erros_da_mascara(linhas, mascara, campo, mensagem):
+    """Um erro por linha marcada em `mascara`."""
+    return [{"linha": int(linha), "campo": campo, "mensagem": mensagem} for linha in linhas[mascara]]
+
+
+def _validar_operacoes(tabela, tipo_operacao):
+    """Aplica ao bloco inteiro as regras de validar_campos e as de tipo dos campos do formulário."""
+    linhas = tabela["_linha"]
+    erros = _erros_da_mascara(linhas, ~tabela['Mês'].isin(MESES), 'Mês', "Mês inválido")
+    ano = tabela['Ano']
+    erros += _erros_da_mascara(linhas, ano.isna() | (ano % 1 != 0) | ~ano.between(2000, 2100), 'Ano',
+                               "Ano deve ser um inteiro entre 2000 e 2100")
+    hectares = tabela['Hectares']
+    erros += _erros_da_mascara(linhas, hectares.isna() | (hectares <= 0), 'Hectares', ERRO_HECTARES)
+    if tipo_operacao == "Operação Aérea":
+        dose = tabela['Dose por Hectare']
+        # Uma linha com qualquer campo de produto (até só a Dose Total) precisa da dose por hectare
+        com_produto = tabela['Produto'].fillna("").ne("") | dose.notna() | tabela['Dose Total'].notna()
+        erros += _erros_da_mascara(linhas, com_produto & (dose.isna() | (dose <= 0)), 'Dose por Hectare', ERRO_DOSE)
+    return erros
+
+
+def _validar_gastos(tabela):
+    """Valida o bloco inteiro de gastos com as mesmas restrições do formulário de gastos."""
+    import pandas as pd
+
+    linhas = tabela["_linha"]
+    data = pd.to_datetime(tabela['Data'], format="%Y-%m-%d", errors="coerce")
+    erros = _erros_da_mascara(linhas, data.isna(), 'Data', "Data inválida (use AAAA-MM-DD)")
+    erros += _erros_da_mascara(linhas, ~tabela['Categoria'].isin(CATEGORIAS_GASTO), 'Categoria',
+                               f"Categoria deve ser uma de: {', '.join(CATEGORIAS_GASTO)}")
+    valor = tabela['Valor']
+    erros += _erros_da_mascara(linhas, valor.isna() | (valor < 0), 'Valor', "Valor deve ser maior ou igual a 0")
+    tabela = tabela.assign(Data=data.dt.strftime("%Y-%m-%d"))
+    return tabela, erros
+
+
+def _sem_nulos(tabela):
+    """Linhas da tabela como dicionários, com None no lugar de NaN."""
+    return tabela.astype(object).where(tabela.notna(), None).to_dict("records")
+
+
+def _grupos_de_operacao(tabela, tipo_operacao):
+    """Numera as operações: uma nova começa a cada mudança nos dados de operação (fora os de produto) ou
+    quando um produto já apareceu na operação corrente."""
+    import pandas as pd
+
+    colunas_operacao = [coluna for coluna in LAYOUTS[tipo_operacao] if coluna not in CAMPOS_PRODUTO[tipo_operacao]]
+    chave = tabela[colunas_operacao].astype(str)
+    mudou = chave.ne(chave.shift()).any(axis=1)
+    grupos, grupo, produtos_do_grupo = [], 0, set()
+    for nova_operacao, produto in zip(mudou, tabela['Produto'].fillna("").astype(str)):
+        if nova_operacao or produto in produtos_do_grupo:
+            grupo += 1
+            produtos_do_grupo = set()
+        produtos_do_grupo.add(produto)
+        grupos.append(grupo)
+    return pd.Series(grupos, index=tabela.index)
+
+
+def _novo_registro(linha, tipo_operacao):
+    """Registro com os dados de operação da primeira linha de um grupo."""
+    registro = {"tipo_operacao": tipo_operacao, "produtos": []}
+    for coluna, campo in CAMPOS_OPERACAO.items():
+        if linha.get(coluna) is not None:
+            registro[campo] = linha[coluna]
+    registro["ano"] = int(registro["ano"])
+    registro["status"] = registro.get("status") or "Em aberto"
+    return registro
+
+
+def _completar_produtos(registro):
+    """Preenche os campos de produto que o formulário sempre grava."""
+    for produto in registro["produtos"]:
+        if registro["tipo_operacao"] == "Operação Aérea":
+            produto.setdefault("nome", "")
+            if "dose_total" not in produto:
+                produto["dose_total"] = registro["hectares_totais"] * produto["dose_por_hectare"]
+        else:
+            produto.setdefault("nome_produto", "")
+            produto.setdefault("dose", 0.0)
+    if registro["tipo_operacao"] == "Operação Terrestre":
+        registro["num_produtos_terrestre"] = len(registro["produtos"])
+    return registro
+
+
+def _montar_operacoes(tabela, tipo_operacao):
+    """Junta as linhas de cada grupo num registro, com um produto por linha.
+
+    Devolve os registros aceitos e o número de operações rejeitadas por terem alguma linha inválida.
+    """
+    campos_produto = CAMPOS_PRODUTO[tipo_operacao]
+    grupos = _grupos_de_operacao(tabela, tipo_operacao)
+    invalidos = set(grupos[tabela["_invalida"]])
+    registros, grupo_atual = [], None
+    for grupo, linha in zip(grupos, _sem_nulos(tabela)):
+        if grupo in invalidos:
+            continue
+        if grupo != grupo_atual:
+            registros.append(_novo_registro(linha, tipo_operacao))
+            grupo_atual = grupo
+        produto = {campo: linha[coluna] for coluna, campo in campos_produto.items() if linha[coluna] is not None}
+        if any(valor != "" for valor in produto.values()):
+            registros[-1]["produtos"].append(produto)
+    return [_completar_produtos(registro) for registro in registros], len(invalidos)
+
+
+def _montar_gastos(tabela):
+    """Converte as linhas válidas em gastos."""
+    gastos = []
+    for linha in _sem_nulos(tabela[~tabela["_invalida"]]):
+        gasto = {"descricao": linha['Descrição'] or "", "valor": float(linha['Valor']), "categoria": linha['Categoria'],
+                 "data": linha['Data']}
+        if linha['Fazenda']:
+            gasto["nome_fazenda"] = linha['Fazenda']
+        gastos.append(gasto)
+    return gastos
+
+
+def _importar_planilha(blocos, layout, resultado):
+    """Valida e converte, bloco a bloco, uma planilha, acumulando registros, gastos e erros em `resultado`.
+
+    Nas operações, as linhas do último grupo de cada bloco passam para o bloco seguinte,
+    já que uma operação com vários produtos pode ter sido cortada na divisão dos blocos.
+    """
+    import pandas as pd
+
+    pendente = None
+    for inicio, bloco in blocos:
+        tabela, erros = _normalizar_bloco(bloco, inicio, LAYOUTS[layout])
+        if layout == ABA_GASTOS[0]:
+            tabela, erros_gastos = _validar_gastos(tabela)
+            erros += erros_gastos
+        else:
+            erros += _validar_operacoes(tabela, layout)
+        tabela["_invalida"] = tabela["_linha"].isin({erro["linha"] for erro in erros})
+        resultado["erros"] += sorted(erros, key=lambda erro: erro["linha"])
+
+        if layout == ABA_GASTOS[0]:
+            resultado["gastos"] += _montar_gastos(tabela)
+            continue
+        if pendente is not None:
+            tabela = pd.concat([pendente, tabela], ignore_index=True)
+        if tabela.empty:
+            continue
+        grupos = _grupos_de_operacao(tabela, layout)
+        ultimo = grupos == grupos.iloc[-1]
+        pendente = tabela[ultimo]
+        registros, rejeitadas = _montar_operacoes(tabela[~ultimo], layout)
+        resultado["operacoes"] += registros
+        resultado["operacoes_rejeitadas"] += rejeitadas
+    if pendente is not None:
+        registros, rejeitadas = _montar_operacoes(pendente, layout)
+        resultado["operacoes"] += registros
+        resultado["operacoes_rejeitadas"] += rejeitadas
+
+
+@instrumentar
+def importar_arquivos(arquivos, gravar=True, tamanho_bloco=TAMANHO_BLOCO, separador=","):
+    """Valida e importa planilhas CSV ou .xlsx, gravando as linhas aceitas numa única transação.
+
+    `arquivos` é uma lista de pares (nome, arquivo), onde arquivo é um caminho ou um objeto
+    de arquivo aberto; a extensão do nome indica o formato. Com `gravar=False` só valida.
+    Devolve as quantidades importadas e a lista de erros, um por linha e campo.
+    """
+    resultado = {"operacoes": [], "gastos": [], "operacoes_rejeitadas": 0, "erros": []}
+    for nome, fonte in arquivos:
+        # As abas são processadas à medida que os blocos são lidos, sem carregar o arquivo inteiro
+        for aba, blocos in itertools.groupby(_ler_blocos(nome, fonte, tamanho_bloco, separador),
+                                             key=lambda bloco: bloco[0]):
+            primeiro = next(blocos)
+            colunas = list(primeiro[2].columns)
+            layout = _identificar_layout(colunas, aba)
+            faltando = [coluna for coluna in COLUNAS_OBRIGATORIAS.get(layout, []) if coluna not in colunas]
+            origem = {"arquivo": nome, "aba": aba or ""}
+            if layout is None or faltando:
+                mensagem = (f"Colunas obrigatórias ausentes: {', '.join(faltando)}" if faltando else
+                            "Cabeçalho não reconhecido: use as colunas da exportação (Aérea, Terrestre ou Gastos)")
+                resultado["erros"].append(dict(origem, linha=1, campo="", mensagem=mensagem))
+                continue
+            inicio_erros = len(resultado["erros"])
+            blocos_da_aba = ((inicio, bloco) for _, inicio, bloco in itertools.chain([primeiro], blocos))
+            _importar_planilha(blocos_da_aba, layout, resultado)
+            resultado["erros"][inicio_erros:] = [dict(origem, **erro) for erro in resultado["erros"][inicio_erros:]]
+
+    registros, gastos = resultado["operacoes"], resultado["gastos"]
+    gravado = gravar and bool(registros or gastos)
+    if gravado:
+        importar_em_lote(registros, gastos)
+    return {
+        "operacoes": len(registros),
+        "gastos": len(gastos),
+        "operacoes_rejeitadas": resultado["operacoes_rejeitadas"],
+        "linhas_com_erro": len({(erro["arquivo"], erro["aba"], erro["linha"]) for erro in resultado["erros"]}),
+        "erros": resultado["erros"],
+        "gravado": gravado,
+    }
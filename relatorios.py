@@ -0,0 +1,398 @@
+"""Montagem das exportações e dos resumos mensais, sem depender do Streamlit.
+
+Usado pela página de exportação do app e pela linha de comando (cli.py).
+"""
+import functools
+import io
+import os
+
+import colunar
+import armazenamento
+from armazenamento import (CATEGORIAS_GASTO, MESES, TIPO_OPERACAO, carregar_gastos_tabela, carregar_resumo_produtos,
+                           ler_gastos_por_anos, ler_gastos_semanais, ler_registros_por_anos, ler_resumos_por_anos,
+                           versao_dados)
+from diagnostico import instrumentar
+
+ABAS_EXPORTACAO = {
+    "Operação Aérea": ("Aérea", ['Mês', 'Ano', 'Fazenda', 'Talhão', 'Hectares', 'Cultura', 'Velocidade', 'Altura',
+                                 'Produto', 'Dose por Hectare', 'Dose Total', 'Aeronave', 'Responsável', 'Status']),
+    "Operação Terrestre": ("Terrestre", ['Mês', 'Ano', 'Fazenda', 'Talhão', 'Hectares', 'Cultura', 'Trator',
+                                         'Implemento', 'Produto', 'Dose', 'Observação', 'Responsável', 'Status']),
+}
+ABA_GASTOS = ("Gastos", ['Data', 'Descrição', 'Categoria', 'Valor', 'Fazenda'])
+# Colunas convertidas para número nas exportações tipadas (Parquet); 'N/A' vira nulo
+COLUNAS_NUMERICAS = {'Ano', 'Hectares', 'Velocidade', 'Altura', 'Dose por Hectare', 'Dose Total', 'Dose', 'Valor'}
+FORMATOS_EXPORTACAO = ["excel", "csv", "parquet"]
+# Coluna da cópia colunar (colunar.py) de onde vem cada coluna das abas de operação
+ORIGEM_COLUNAR = {
+    'Mês': 'mes', 'Ano': 'ano', 'Fazenda': 'nome_fazenda', 'Talhão': 'talhao_aplicado', 'Hectares': 'hectares_totais',
+    'Cultura': 'cultura', 'Velocidade': 'velocidade', 'Altura': 'altura', 'Trator': 'trator',
+    'Implemento': 'implemento', 'Observação': 'observacao', 'Aeronave': 'aeronave', 'Responsável': 'responsavel',
+    'Status': 'status', 'Produto': 'produto', 'Dose por Hectare': 'dose', 'Dose': 'dose', 'Dose Total': 'dose_total',
+}
+COLUNAS_PRODUTO = {'Produto', 'Dose por Hectare', 'Dose', 'Dose Total'}
+# Níveis de detalhe do consumo de produtos e as colunas do resumo de produtos agrupadas em cada um
+NIVEIS_CONSUMO = {"talhao": ["nome_fazenda", "talhao_aplicado"], "fazenda": ["nome_fazenda"], "produto": []}
+NOMES_CONSUMO = {"ano": "Ano", "mes": "Mês", "mes_numero": "Mês Número", "nome_fazenda": "Fazenda",
+                 "talhao_aplicado": "Talhão", "produto": "Produto", "consumo": "Consumo", "hectares": "Hectares",
+                 "quantidade": "Aplicações", "dose_media": "Dose Média"}
+# Granularidades das séries de tendência, da mais fina à mais grossa, com a frequência do pandas de cada uma
+GRANULARIDADES = {"semanal": "W-MON", "mensal": "MS", "trimestral": "QS", "anual": "YS"}
+MAXIMO_PONTOS = 120  # Pontos por série enviados ao gráfico; acima disso a série é somada numa granularidade maior
+# Categorias de gasto ligadas à área aplicada, que entram no custo por hectare
+CATEGORIAS_CUSTO_HECTARE = ["Produtos", "Combustível"]
+
+
+def linhas_exportacao(registros, tipo_operacao):
+    """Gera uma linha por produto de cada registro do tipo de operação informado."""
+    for registro in registros:
+        if registro.get('tipo_operacao') != tipo_operacao:
+            continue
+        comum = [
+            registro.get('mes', 'N/A'),
+            registro.get('ano', 'N/A'),
+            registro.get('nome_fazenda', 'N/A'),
+            registro.get('talhao_aplicado', 'N/A'),
+            registro.get('hectares_totais', 'N/A'),
+            registro.get('cultura', 'N/A'),
+        ]
+        # Registros sem produtos ainda geram uma linha, com os campos de produto vazios
+        for produto in registro.get('produtos') or [{}]:
+            if tipo_operacao == "Operação Terrestre":
+                yield comum + [
+                    registro.get('trator', 'N/A'),
+                    registro.get('implemento', 'N/A'),
+                    produto.get('nome_produto', 'N/A'),
+                    produto.get('dose', 'N/A'),
+                    registro.get('observacao', 'N/A'),
+                    registro.get('responsavel', 'N/A'),
+                    registro.get('status', 'N/A'),
+                ]
+            else:
+                yield comum + [
+                    registro.get('velocidade', 'N/A'),
+                    registro.get('altura', 'N/A'),
+                    produto.get('nome', 'N/A'),
+                    produto.get('dose_por_hectare', 'N/A'),
+                    produto.get('dose_total', 'N/A'),
+                    registro.get('aeronave', 'N/A'),
+                    registro.get('responsavel', 'N/A'),
+                    registro.get('status', 'N/A'),
+                ]
+
+
+def linhas_gastos(gastos):
+    """Gera uma linha por gasto, na ordem das colunas da aba de gastos."""
+    for gasto in gastos:
+        # A fazenda é opcional nos gastos: em branco quando não informada
+        yield [gasto.get('data', 'N/A'), gasto.get('descricao', 'N/A'), gasto.get('categoria', 'N/A'),
+               gasto.get('valor', 'N/A'), gasto.get('nome_fazenda', '')]
+
+
+def _tabela(linhas, colunas, tipada):
+    """Monta o DataFrame de uma aba; se `tipada`, com as colunas numéricas convertidas."""
+    import pandas as pd
+    tabela = pd.DataFrame(list(linhas), columns=colunas)
+    if tipada:
+        for coluna in colunas:
+            if coluna in COLUNAS_NUMERICAS:
+                tabela[coluna] = pd.to_numeric(tabela[coluna], errors="coerce")
+            else:
+                tabela[coluna] = tabela[coluna].astype("string")
+    return tabela
+
+
+def tabela_exportacao(registros, tipo_operacao, tipada=False):
+    """DataFrame com as linhas de exportação de um tipo de operação."""
+    return _tabela(linhas_exportacao(registros, tipo_operacao), ABAS_EXPORTACAO[tipo_operacao][1], tipada)
+
+
+@instrumentar
+def tabela_exportacao_colunar(tipo_operacao, anos=None):
+    """DataFrame tipado com as linhas de exportação de um tipo de operação, lido da cópia colunar.
+
+    Só as colunas da aba são lidas; operações sem produtos geram uma linha com os campos de produto vazios.
+    """
+    colunas = ABAS_EXPORTACAO[tipo_operacao][1]
+    filtro = [("tipo_operacao", "=", tipo_operacao)]
+    operacoes = colunar.ler_operacoes(["id"] + [ORIGEM_COLUNAR[c] for c in colunas if c not in COLUNAS_PRODUTO],
+                                      anos, filtro)
+    produtos = colunar.ler_produtos(["id", "ordem"] + [ORIGEM_COLUNAR[c] for c in colunas if c in COLUNAS_PRODUTO],
+                                    anos, filtro)
+    linhas = operacoes.join(produtos, keys="id", join_type="left outer")
+    linhas = linhas.sort_by([("id", "ascending"), ("ordem", "ascending")]).to_pandas()
+    return linhas[[ORIGEM_COLUNAR[coluna] for coluna in colunas]].set_axis(colunas, axis=1)
+
+
+def tabela_gastos(gastos, tipada=False):
+    """DataFrame com as linhas de exportação dos gastos."""
+    return _tabela(linhas_gastos(gastos), ABA_GASTOS[1], tipada)
+
+
+@instrumentar
+def gerar_excel_operacoes(registros, gastos=None, progresso=None):
+    """Gera o arquivo Excel em memória, com uma aba por tipo de operação (e uma de gastos, se informados).
+
+    Usa o modo write-only do openpyxl, que grava as linhas à medida que são
+    geradas em vez de montar a planilha inteira em memória. `progresso(fracao, mensagem)`, se
+    informado, é chamado no início de cada aba e da gravação (ver tarefas.py).
+    """
+    from openpyxl import Workbook
+
+    pasta = Workbook(write_only=True)
+    abas = [(titulo_aba, colunas, linhas_exportacao(registros, tipo_operacao))
+            for tipo_operacao, (titulo_aba, colunas) in ABAS_EXPORTACAO.items()]
+    if gastos is not None:
+        abas.append((*ABA_GASTOS, linhas_gastos(gastos)))
+    for indice, (titulo_aba, colunas, linhas) in enumerate(abas):
+        if progresso:
+            progresso(indice / (len(abas) + 1), f"Aba {titulo_aba}")
+        aba = pasta.create_sheet(titulo_aba)
+        aba.append(colunas)
+        for linha in linhas:
+            aba.append(linha)
+    if progresso:
+        progresso(len(abas) / (len(abas) + 1), "Gravando o arquivo")
+    buffer = io.BytesIO()
+    pasta.save(buffer)
+    return buffer.getvalue()
+
+
+def _nome_arquivo(base, titulo_aba, extensao):
+    """Nome do arquivo de uma aba nas exportações em CSV e Parquet, ex.: relatorio_aerea.csv."""
+    sufixo = titulo_aba.lower().replace("é", "e")
+    return f"{base}_{sufixo}.{extensao}"
+
+
+@instrumentar
+def exportar_periodo(ano_inicial, ano_final, formato, base):
+    """Exporta operações e gastos de `ano_inicial` a `ano_final` e devolve os arquivos gravados.
+
+    No formato excel grava `base`.xlsx com uma aba por tabela; em csv e parquet, um
+    arquivo por tabela (`base`_aerea, `base`_terrestre e `base`_gastos).
+    """
+    gastos = ler_gastos_por_anos(ano_inicial, ano_final)
+    pasta = os.path.dirname(base)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    if formato == "excel":
+        caminho = f"{base}.xlsx"
+        with open(caminho, "wb") as arquivo:
+            arquivo.write(gerar_excel_operacoes(ler_registros_por_anos(ano_inicial, ano_final), gastos))
+        return [caminho]
+
+    if formato == "parquet":
+        # Já tipadas na cópia colunar, sem remontar as linhas a partir do JSON
+        anos = range(ano_inicial, ano_final + 1)
+        tabelas = [(titulo_aba, tabela_exportacao_colunar(tipo_operacao, anos))
+                   for tipo_operacao, (titulo_aba, _) in ABAS_EXPORTACAO.items()]
+        tabelas.append((ABA_GASTOS[0], tabela_gastos(gastos, tipada=True)))
+    else:
+        registros = ler_registros_por_anos(ano_inicial, ano_final)
+        tabelas = [(titulo_aba, tabela_exportacao(registros, tipo_operacao))
+                   for tipo_operacao, (titulo_aba, _) in ABAS_EXPORTACAO.items()]
+        tabelas.append((ABA_GASTOS[0], tabela_gastos(gastos)))
+    caminhos = []
+    for titulo_aba, tabela in tabelas:
+        if formato == "csv":
+            caminho = _nome_arquivo(base, titulo_aba, "csv")
+            tabela.to_csv(caminho, index=False)
+        else:
+            caminho = _nome_arquivo(base, titulo_aba, "parquet")
+            tabela.to_parquet(caminho, index=False)
+        caminhos.append(caminho)
+    return caminhos
+
+
+@instrumentar
+def resumo_mensal(ano_inicial, ano_final):
+    """Resumo mensal de hectares e gastos de `ano_inicial` a `ano_final`, lido das tabelas de resumo.
+
+    Uma linha por (ano, mês) com movimento, com os hectares por tipo de operação, o número
+    de operações, os gastos por categoria e os totais.
+    """
+    import pandas as pd
+
+    operacoes, gastos = ler_resumos_por_anos(ano_inicial, ano_final)
+    df_operacoes = pd.DataFrame(operacoes, columns=["ano", "mes", "tipo_operacao", "hectares", "quantidade"])
+    df_gastos = pd.DataFrame(gastos, columns=["ano", "mes", "categoria", "valor", "quantidade"])
+
+    hectares = df_operacoes.pivot_table(index=["ano", "mes"], columns="tipo_operacao", values="hectares",
+                                        aggfunc="sum").reindex(columns=TIPO_OPERACAO)
+    hectares.columns = [f"Hectares {tipo.removeprefix('Operação ')}" for tipo in TIPO_OPERACAO]
+    quantidade = df_operacoes.groupby(["ano", "mes"])["quantidade"].sum().rename("Operações")
+    valores = df_gastos.pivot_table(index=["ano", "mes"], columns="categoria", values="valor", aggfunc="sum")
+    categorias = CATEGORIAS_GASTO + sorted(set(valores.columns) - set(CATEGORIAS_GASTO))
+    valores = valores.reindex(columns=categorias)
+    valores.columns = [f"Gastos {categoria}" for categoria in categorias]
+
+    # Sem operações ou sem gastos no período, as colunas vazias chegam como object: convertidas antes do fillna
+    resumo = pd.concat([hectares, quantidade, valores], axis=1).astype(float).fillna(0.0)
+    resumo["Operações"] = resumo["Operações"].astype(int)
+    resumo["Total Hectares"] = resumo[hectares.columns].sum(axis=1)
+    resumo["Total Gastos"] = resumo[valores.columns].sum(axis=1)
+    resumo = resumo.reset_index().rename(columns={"ano": "Ano", "mes": "Mês"})
+    resumo.insert(2, "Mês Número", resumo["Mês"].map(lambda mes: MESES.index(mes) + 1))
+    return resumo.sort_values(["Ano", "Mês Número"], ignore_index=True)
+
+
+@instrumentar
+def consumo_produtos(ano_inicial, ano_final, nivel="talhao"):
+    """Consumo de cada produto por mês de `ano_inicial` a `ano_final`, lido do resumo de produtos.
+
+    `nivel` define o detalhe (ver NIVEIS_CONSUMO): por fazenda e talhão, só por fazenda ou só por
+    produto. Traz ainda os hectares tratados, o número de aplicações e a dose média por hectare.
+    """
+    import numpy as np
+    import pandas as pd
+
+    grupos = NIVEIS_CONSUMO[nivel]
+    linhas = pd.DataFrame(carregar_resumo_produtos(ano_inicial, ano_final),
+                          columns=["ano", "mes", "nome_fazenda", "talhao_aplicado", "produto", "consumo", "hectares",
+                                   "quantidade"])
+    consumo = linhas.groupby(["ano", "mes", *grupos, "produto"], as_index=False, sort=False)[
+        ["consumo", "hectares", "quantidade"]].sum()
+    consumo.insert(2, "mes_numero", consumo["mes"].map({mes: numero for numero, mes in enumerate(MESES, 1)}))
+    hectares = consumo["hectares"].to_numpy(dtype=float)
+    consumo["dose_media"] = np.divide(consumo["consumo"].to_numpy(dtype=float), hectares,
+                                      out=np.full(len(consumo), np.nan), where=hectares > 0)
+    consumo = consumo.sort_values(["ano", "mes_numero", *grupos, "produto"], ignore_index=True)
+    return consumo.rename(columns=NOMES_CONSUMO)
+
+
+@functools.lru_cache(maxsize=2)
+def _base_custos(caminho_banco, versao):
+    """Hectares e gastos diretos por (ano, mês, fazenda), indexados e ordenados por essa chave.
+
+    Refeita só quando o banco muda: `caminho_banco` e `versao` (versao_dados) são a chave do cache.
+    Gastos sem fazenda ficam com a fazenda em branco.
+    """
+    import pandas as pd
+
+    chave = ["ano", "mes_numero", "nome_fazenda"]
+    operacoes = colunar.ler_operacoes(["ano", "mes_numero", "nome_fazenda", "hectares_totais"]).to_pandas()
+    operacoes["nome_fazenda"] = operacoes["nome_fazenda"].fillna("")
+    hectares = operacoes.groupby(chave)["hectares_totais"].sum().rename("hectares")
+
+    gastos = carregar_gastos_tabela()
+    gastos = gastos[gastos["categoria"].isin(CATEGORIAS_CUSTO_HECTARE)].assign(
+        nome_fazenda=lambda tabela: tabela["nome_fazenda"].fillna(""))
+    valores = gastos.pivot_table(index=chave, columns="categoria", values="valor", aggfunc="sum")
+    valores = valores.reindex(columns=CATEGORIAS_CUSTO_HECTARE)
+
+    base = pd.concat([hectares, valores], axis=1).fillna(0.0).sort_index()
+    base.index = base.index.set_names(chave)
+    return base
+
+
+def _dividir(numerador, denominador):
+    """Divisão elemento a elemento, com NaN onde o denominador for zero."""
+    import numpy as np
+
+    numerador, denominador = np.asarray(numerador, dtype=float), np.asarray(denominador, dtype=float)
+    return np.divide(numerador, denominador, out=np.full(len(numerador), np.nan), where=denominador > 0)
+
+
+@instrumentar
+def custo_por_hectare(ano_inicial, ano_final, por_fazenda=False):
+    """Custo por hectare (R$/ha) mensal de `ano_inicial` a `ano_final`, com os gastos de Produtos e Combustível.
+
+    Sem `por_fazenda`, todos os gastos diretos do mês são divididos por todos os hectares do mês.
+    Por fazenda, os gastos com a fazenda informada são divididos pelos hectares dela, e os gastos
+    sem fazenda aparecem numa linha com a fazenda em branco. O R$/ha acumulado no ano mostra a
+    tendência sem a oscilação de meses com pouca área aplicada.
+    """
+    base = _base_custos(os.path.abspath(armazenamento.ARQUIVO_BANCO), versao_dados())
+    periodo = base.loc[ano_inicial:ano_final]
+    grupos = ["ano", "mes_numero", "nome_fazenda"] if por_fazenda else ["ano", "mes_numero"]
+    custos = periodo.groupby(level=grupos).sum().reset_index()
+    custos["total"] = custos[CATEGORIAS_CUSTO_HECTARE].sum(axis=1)
+    custos["custo_hectare"] = _dividir(custos["total"], custos["hectares"])
+    for categoria in CATEGORIAS_CUSTO_HECTARE:
+        custos[f"custo_hectare_{categoria}"] = _dividir(custos[categoria], custos["hectares"])
+    acumulado = custos.groupby(grupos[:1] + grupos[2:])[["total", "hectares"]].cumsum()
+    custos["custo_hectare_acumulado"] = _dividir(acumulado["total"], acumulado["hectares"])
+
+    custos.insert(1, "mes", [MESES[numero - 1] for numero in custos["mes_numero"]])
+    nomes = {"ano": "Ano", "mes": "Mês", "mes_numero": "Mês Número", "nome_fazenda": "Fazenda", "hectares": "Hectares",
+             "total": "Gastos Diretos", "custo_hectare": "R$/ha", "custo_hectare_acumulado": "R$/ha Acumulado no Ano"}
+    nomes.update({categoria: f"Gastos {categoria}" for categoria in CATEGORIAS_CUSTO_HECTARE})
+    nomes.update({f"custo_hectare_{categoria}": f"R$/ha {categoria}" for categoria in CATEGORIAS_CUSTO_HECTARE})
+    return custos.rename(columns=nomes)
+
+
+def _serie(linhas, coluna_data, colunas_grupo, valor, inicio, fim):
+    """Pivota as linhas de um resumo numa série indexada por data, uma coluna por valor de `colunas_grupo`.
+
+    `inicio` e `fim` (inícios de período) entram no índice mesmo sem movimento, para o eixo cobrir o intervalo.
+    """
+    serie = linhas.pivot_table(index=coluna_data, columns=colunas_grupo, values=valor, aggfunc="sum")
+    serie = serie[(serie.index >= inicio) & (serie.index <= fim)]
+    return serie.reindex(serie.index.union([inicio, fim]))
+
+
+def _data_do_mes(linhas):
+    """Data do primeiro dia do mês de cada linha de resumo mensal (colunas ano e mes)."""
+    import pandas as pd
+
+    return pd.to_datetime({"year": linhas["ano"], "month": linhas["mes"].map(MESES.index) + 1, "day": 1})
+
+
+def _reamostrar(tabela, granularidade, maximo_pontos):
+    """Soma a tabela (índice de datas) na granularidade pedida ou, se passar de `maximo_pontos`, na primeira maior que caiba.
+
+    Períodos sem movimento entram com zero. Devolve a tabela somada e a granularidade usada.
+    """
+    ordem = list(GRANULARIDADES)
+    for candidata in ordem[ordem.index(granularidade):]:
+        reamostrada = tabela.resample(GRANULARIDADES[candidata], closed="left", label="left").sum()
+        if len(reamostrada) <= maximo_pontos:
+            break
+    return reamostrada, candidata
+
+
+@instrumentar
+def series_tendencia(data_inicial, data_final, granularidade="mensal", maximo_pontos=MAXIMO_PONTOS):
+    """Séries de hectares, operações e gastos de `data_inicial` a `data_final`, lidas das tabelas de resumo.
+
+    As operações só têm ano e mês, então a série delas é no mínimo mensal; os gastos podem ser semanais.
+    Cada série é somada no servidor para não passar de `maximo_pontos` pontos. Devolve
+    (operacoes, granularidade_operacoes, gastos, granularidade_gastos), com os DataFrames indexados pela
+    data de início de cada período.
+    """
+    import pandas as pd
+
+    inicio, fim = pd.Timestamp(data_inicial), pd.Timestamp(data_final)
+    inicio_mes, fim_mes = inicio.replace(day=1), fim.replace(day=1)
+    operacoes, gastos_mensais = ler_resumos_por_anos(inicio.year, fim.year)
+
+    df_operacoes = pd.DataFrame(operacoes, columns=["ano", "mes", "tipo_operacao", "hectares", "quantidade"])
+    df_operacoes["data"] = _data_do_mes(df_operacoes)
+    df_operacoes["total"] = "Operações"
+    hectares = _serie(df_operacoes, "data", "tipo_operacao", "hectares", inicio_mes, fim_mes).reindex(
+        columns=TIPO_OPERACAO)
+    hectares.columns = [f"Hectares {tipo.removeprefix('Operação ')}" for tipo in TIPO_OPERACAO]
+    quantidade = _serie(df_operacoes, "data", "total", "quantidade", inicio_mes, fim_mes).reindex(
+        columns=["Operações"])
+    serie_operacoes = pd.concat([hectares, quantidade], axis=1).fillna(0).astype({"Operações": int})
+
+    # Semanas que não cabem em `maximo_pontos` vêm do resumo mensal, que não mistura dias de meses vizinhos
+    inicio_semana, fim_semana = (data - pd.Timedelta(days=data.weekday()) for data in (inicio, fim))
+    if granularidade == "semanal" and (fim_semana - inicio_semana).days // 7 + 1 <= maximo_pontos:
+        gastos = pd.DataFrame(ler_gastos_semanais(inicio_semana.strftime("%Y-%m-%d"), fim_semana.strftime("%Y-%m-%d")),
+                              columns=["inicio_semana", "categoria", "valor", "quantidade"])
+        gastos["data"] = pd.to_datetime(gastos["inicio_semana"], format="%Y-%m-%d")
+        serie_gastos = _serie(gastos, "data", "categoria", "valor", inicio_semana, fim_semana)
+    else:
+        gastos = pd.DataFrame(gastos_mensais, columns=["ano", "mes", "categoria", "valor", "quantidade"])
+        gastos["data"] = _data_do_mes(gastos)
+        serie_gastos = _serie(gastos, "data", "categoria", "valor", inicio_mes, fim_mes)
+        granularidade = "mensal" if granularidade == "semanal" else granularidade
+    categorias = CATEGORIAS_GASTO + sorted(set(serie_gastos.columns) - set(CATEGORIAS_GASTO))
+    serie_gastos = serie_gastos.reindex(columns=categorias).fillna(0.0)
+    serie_gastos.columns = [f"Gastos {categoria}" for categoria in categorias]
+
+    granularidade_operacoes = "mensal" if granularidade == "semanal" else granularidade
+    serie_operacoes, granularidade_operacoes = _reamostrar(serie_operacoes, granularidade_operacoes, maximo_pontos)
+    serie_gastos, granularidade_gastos = _reamostrar(serie_gastos, granularidade, maximo_pontos)
+    return serie_operacoes, granularidade_operacoes, serie_gastos, granularidade_gastos
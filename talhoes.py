@@ -0,0 +1,354 @@
+"""Talhões importados de KML: leitura dos limites, área dos polígonos e mapa.
+
+Os limites vêm dos Placemarks de um arquivo KML (ou KMZ) e são gravados na tabela talhoes do
+banco, com um índice espacial R*Tree (armazenamento.talhoes_na_area). A área em hectares é
+calculada do polígono, descontando os buracos, e passa a preencher os hectares das operações
+registradas no talhão.
+
+O mapa desenha os talhões com o folium. Para abrir rápido com muitos talhões, cada faixa de
+zoom (FAIXAS_ZOOM) tem a sua camada, com as geometrias simplificadas por Douglas-Peucker na
+tolerância de um pixel no maior zoom da faixa; só a camada do zoom atual fica no mapa. As
+camadas simplificadas ficam em cache até os talhões mudarem.
+"""
+import functools
+import io
+import math
+import os
+import zipfile
+
+import armazenamento
+from armazenamento import limites_dos_talhoes, salvar_talhoes, talhoes_na_area, versao_dados
+from diagnostico import instrumentar
+
+RAIO_TERRA = 6378137.0  # Metros, raio equatorial do WGS 84
+METROS_POR_GRAU = 111320.0  # Comprimento de um grau de latitude
+METROS_POR_PIXEL_ZOOM_0 = 156543.03392  # No equador, nos tiles de 256 pixels
+CASAS_DECIMAIS = 7  # Cerca de 1 cm
+# Faixas de zoom (mínimo, máximo) com uma camada simplificada cada; a última vai até o zoom máximo do mapa
+FAIXAS_ZOOM = [(0, 12), (13, 14), (15, 16), (17, 18)]
+ESTILO_TALHAO = {"color": "#2E7D32", "weight": 2, "fillColor": "#4CAF50", "fillOpacity": 0.3}
+ESTILO_VIZINHO = {"color": "#616161", "weight": 1, "fillColor": "#9E9E9E", "fillOpacity": 0.15}
+# Mostra só a camada da faixa do zoom atual, a cada mudança de zoom
+MODELO_ALTERNAR_CAMADAS = """
+{% macro script(this, kwargs) %}
+(function() {
+    var mapa = {{ this._parent.get_name() }};
+    var camadas = [{% for nome, minimo, maximo in this.camadas %}[{{ nome }}, {{ minimo }}, {{ maximo }}], {% endfor %}];
+    function alternar() {
+        var zoom = mapa.getZoom();
+        camadas.forEach(function(camada) {
+            if (zoom >= camada[1] && zoom <= camada[2]) {
+                mapa.addLayer(camada[0]);
+            } else {
+                mapa.removeLayer(camada[0]);
+            }
+        });
+    }
+    mapa.on("zoomend", alternar);
+    alternar();
+})();
+{% endmacro %}
+"""
+
+
+# --- Leitura do KML ---
+
+def _conteudo_kml(arquivo):
+    """Bytes do KML de um caminho ou arquivo aberto; de um KMZ (zip), extrai o primeiro .kml."""
+    if hasattr(arquivo, "read"):
+        conteudo = arquivo.read()
+    else:
+        with open(arquivo, "rb") as entrada:
+            conteudo = entrada.read()
+    if not zipfile.is_zipfile(io.BytesIO(conteudo)):
+        return conteudo
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as kmz:
+        nome = next((nome for nome in kmz.namelist() if nome.lower().endswith(".kml")), None)
+        if nome is None:
+            raise ValueError("O arquivo KMZ não contém um KML.")
+        return kmz.read(nome)
+
+
+def _placemarks(elemento, nome_pasta):
+    """Percorre Documents e Folders e gera (placemark, nome da pasta mais próxima que o contém)."""
+    from fastkml.features import Placemark
+
+    for feature in getattr(elemento, "features", None) or []:
+        if isinstance(feature, Placemark):
+            yield feature, nome_pasta
+        else:
+            yield from _placemarks(feature, (feature.name or "").strip() or nome_pasta)
+
+
+def _anel(limite):
+    """Coordenadas [lon, lat] de um limite (outerBoundaryIs ou innerBoundaryIs) do KML, sem a altitude."""
+    import numpy as np
+
+    coordenadas = limite.kml_geometry.kml_coordinates.coords if limite.kml_geometry is not None else []
+    if len(coordenadas) < 4:
+        return None
+    return np.round(np.asarray([ponto[:2] for ponto in coordenadas], dtype=float), CASAS_DECIMAIS).tolist()
+
+
+def _poligonos(geometria):
+    """Polígonos (listas de anéis) de uma geometria do fastkml: Polygon ou MultiGeometry com polígonos.
+
+    As coordenadas são lidas direto dos elementos do KML: montar a geometria do pygeoif (`.geometry`)
+    é lento em anéis com muitos pontos.
+    """
+    from fastkml.geometry import MultiGeometry, Polygon
+
+    if isinstance(geometria, Polygon):
+        externo = _anel(geometria.outer_boundary) if geometria.outer_boundary is not None else None
+        if externo is None:
+            return []
+        buracos = [_anel(limite) for limite in geometria.inner_boundaries or []]
+        return [[externo] + [buraco for buraco in buracos if buraco is not None]]
+    if isinstance(geometria, MultiGeometry):
+        return [poligono for parte in geometria.kml_geometries or [] for poligono in _poligonos(parte)]
+    return []
+
+
+def ler_kml(arquivo, nome_fazenda=None):
+    """Lê os talhões de um arquivo KML ou KMZ (caminho ou arquivo aberto).
+
+    Cada Placemark com polígono vira um talhão com o nome do Placemark. A fazenda é `nome_fazenda` ou,
+    sem ele, o nome da pasta (Folder ou Document) que contém o Placemark. Devolve a lista de talhões,
+    no formato de armazenamento.salvar_talhoes, e a lista de avisos dos Placemarks ignorados.
+    """
+    from fastkml import kml
+
+    try:
+        documento = kml.KML.from_string(_conteudo_kml(arquivo))
+    except SyntaxError as e:  # ParseError do ElementTree e do lxml
+        raise ValueError(f"KML inválido: {e}") from e
+    talhoes, avisos = {}, []
+    for placemark, nome_pasta in _placemarks(documento, None):
+        talhao = (placemark.name or "").strip()
+        fazenda = (nome_fazenda or "").strip() or nome_pasta
+        poligonos = _poligonos(placemark.kml_geometry)
+        if not talhao or not fazenda:
+            avisos.append(f"Placemark {talhao or 'sem nome'}: falta o nome do talhão ou da fazenda.")
+        elif not poligonos:
+            avisos.append(f"Placemark {talhao}: não tem polígono.")
+        else:
+            geometria = ({"type": "Polygon", "coordinates": poligonos[0]} if len(poligonos) == 1
+                         else {"type": "MultiPolygon", "coordinates": poligonos})
+            hectares = area_hectares(geometria)
+            if hectares <= 0:
+                avisos.append(f"Placemark {talhao}: polígono sem área.")
+            else:
+                if (fazenda, talhao) in talhoes:
+                    avisos.append(f"Placemark {talhao}: repetido na fazenda {fazenda}; vale o último.")
+                talhoes[(fazenda, talhao)] = {"nome_fazenda": fazenda, "talhao": talhao,
+                                              "hectares": round(hectares, 4), "geometria": geometria}
+    return list(talhoes.values()), avisos
+
+
+@instrumentar
+def importar_kml(arquivo, nome_fazenda=None):
+    """Lê os talhões de um KML ou KMZ e os grava no banco; devolve quantos gravou e os avisos da leitura."""
+    talhoes, avisos = ler_kml(arquivo, nome_fazenda)
+    return (salvar_talhoes(talhoes) if talhoes else 0), avisos
+
+
+# --- Geometria ---
+
+def _area_anel(anel):
+    """Área em m² de um anel [lon, lat] sobre a esfera, pela fórmula de Chamberlain e Duquette."""
+    import numpy as np
+
+    pontos = np.radians(np.asarray(anel, dtype=float)[:, :2])
+    if len(pontos) > 1 and (pontos[0] == pontos[-1]).all():
+        pontos = pontos[:-1]
+    if len(pontos) < 3:
+        return 0.0
+    longitudes, latitudes = pontos[:, 0], pontos[:, 1]
+    soma = np.sum((np.roll(longitudes, -1) - np.roll(longitudes, 1)) * np.sin(latitudes))
+    return abs(float(soma)) * RAIO_TERRA ** 2 / 2
+
+
+def area_hectares(geometria):
+    """Área em hectares de um Polygon ou MultiPolygon GeoJSON, descontando os buracos."""
+    poligonos = geometria["coordinates"] if geometria["type"] == "MultiPolygon" else [geometria["coordinates"]]
+    metros = sum(_area_anel(poligono[0]) - sum(_area_anel(buraco) for buraco in poligono[1:])
+                 for poligono in poligonos)
+    return metros / 10000
+
+
+def _ponto_no_anel(anel, longitude, latitude):
+    """Indica se o ponto está dentro do anel [lon, lat] (cruzamentos de um raio horizontal, em numpy)."""
+    import numpy as np
+
+    pontos = np.asarray(anel, dtype=float)
+    x1, y1 = pontos[:-1, 0], pontos[:-1, 1]
+    x2, y2 = pontos[1:, 0], pontos[1:, 1]
+    cruza = (y1 > latitude) != (y2 > latitude)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cruzamento = x1 + (latitude - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(cruza & (longitude < x_cruzamento)) % 2)
+
+
+def contem_ponto(geometria, longitude, latitude):
+    """Indica se um Polygon ou MultiPolygon GeoJSON contém o ponto (fora dos buracos)."""
+    poligonos = geometria["coordinates"] if geometria["type"] == "MultiPolygon" else [geometria["coordinates"]]
+    return any(_ponto_no_anel(poligono[0], longitude, latitude)
+               and not any(_ponto_no_anel(buraco, longitude, latitude) for buraco in poligono[1:])
+               for poligono in poligonos)
+
+
+def talhoes_no_ponto(longitude, latitude):
+    """Talhões que contêm o ponto: candidatos pelo índice espacial, conferidos no polígono."""
+    return [talhao for talhao in talhoes_na_area(longitude, latitude, longitude, latitude)
+            if contem_ponto(talhao["geometria"], longitude, latitude)]
+
+
+def tolerancia_do_zoom(zoom, latitude):
+    """Tamanho de um pixel no `zoom`, em graus de latitude, na `latitude` dada (projeção de Mercator)."""
+    return METROS_POR_PIXEL_ZOOM_0 * math.cos(math.radians(latitude)) / 2 ** zoom / METROS_POR_GRAU
+
+
+def _manter_douglas_peucker(pontos, tolerancia, fixos):
+    """Máscara dos pontos mantidos pela simplificação de Douglas-Peucker de várias linhas de uma vez.
+
+    As linhas vêm concatenadas em `pontos` (array n x 2), e `fixos` marca as pontas de cada uma. Em vez de
+    dividir um trecho por vez, cada rodada divide com numpy todos os trechos ainda abertos entre pontos
+    mantidos, no ponto mais distante da reta do trecho; os trechos sem ponto além da tolerância saem das
+    rodadas seguintes.
+    """
+    import numpy as np
+
+    manter = fixos.copy()
+    abertos = np.flatnonzero(~fixos)  # Pontos de trechos ainda não resolvidos
+    while len(abertos):
+        mantidos = np.flatnonzero(manter)
+        trecho = np.searchsorted(mantidos, abertos) - 1
+        inicio, fim = pontos[mantidos[trecho]], pontos[mantidos[trecho + 1]]
+        direcao, relativos = fim - inicio, pontos[abertos] - inicio
+        comprimento = np.hypot(direcao[:, 0], direcao[:, 1])
+        cruzado = np.abs(direcao[:, 0] * relativos[:, 1] - direcao[:, 1] * relativos[:, 0])
+        # Trecho de comprimento zero (anel fechado): distância ao ponto inicial
+        distancias = np.where(comprimento > 0, cruzado / np.where(comprimento > 0, comprimento, 1),
+                              np.hypot(relativos[:, 0], relativos[:, 1]))
+        # Os pontos abertos vêm agrupados por trecho, em ordem: o máximo de cada grupo sai de um reduceat
+        primeiros = np.flatnonzero(np.diff(trecho, prepend=-1))
+        maiores = np.maximum.reduceat(distancias, primeiros)
+        maior_do_trecho = np.repeat(maiores, np.diff(primeiros, append=len(abertos)))
+        candidatos = np.flatnonzero((distancias > tolerancia) & (distancias == maior_do_trecho))
+        _, unicos = np.unique(trecho[candidatos], return_index=True)
+        manter[abertos[candidatos[unicos]]] = True
+        abertos = abertos[(maior_do_trecho > tolerancia) & ~manter[abertos]]
+    return manter
+
+
+def simplificar_aneis(aneis, tolerancia):
+    """Simplifica anéis [lon, lat] com tolerância em graus de latitude; anéis que ficariam abertos são mantidos.
+
+    As longitudes são escaladas pelo cosseno da latitude de cada anel, para a tolerância valer igual nas duas
+    direções. Antes do Douglas-Peucker, uma passada descarta os pontos seguidos na mesma célula de uma grade
+    do tamanho da tolerância, que é onde os anéis densos concentram os pontos.
+    """
+    import numpy as np
+
+    if not aneis:
+        return []
+    tamanhos = np.array([len(anel) for anel in aneis])
+    pontos = np.concatenate([np.asarray(anel, dtype=float) for anel in aneis])
+    finais = np.cumsum(tamanhos)
+    fixos = np.zeros(len(pontos), dtype=bool)
+    fixos[finais - tamanhos] = fixos[finais - 1] = True
+    latitudes = np.add.reduceat(pontos[:, 1], finais - tamanhos) / tamanhos
+    escalados = pontos * np.stack([np.repeat(np.cos(np.radians(latitudes)), tamanhos),
+                                   np.ones(len(pontos))], axis=1)
+
+    celulas = np.floor(escalados / tolerancia)
+    candidatos = fixos.copy()
+    candidatos[1:] |= (celulas[1:] != celulas[:-1]).any(axis=1)
+    indices = np.flatnonzero(candidatos)
+    indices = indices[_manter_douglas_peucker(escalados[indices], tolerancia, fixos[indices])]
+
+    simplificados = []
+    for anel, inicio, fim in zip(aneis, np.searchsorted(indices, finais - tamanhos), np.searchsorted(indices, finais)):
+        simplificados.append(pontos[indices[inicio:fim]].tolist() if fim - inicio >= 4 else anel)
+    return simplificados
+
+
+def simplificar_geometrias(geometrias, tolerancia):
+    """Simplifica de uma vez todos os anéis de uma lista de Polygons e MultiPolygons GeoJSON."""
+    poligonos = [geometria["coordinates"] if geometria["type"] == "MultiPolygon" else [geometria["coordinates"]]
+                 for geometria in geometrias]
+    aneis = iter(simplificar_aneis([anel for lista in poligonos for poligono in lista for anel in poligono],
+                                   tolerancia))
+    simplificadas = []
+    for geometria, lista in zip(geometrias, poligonos):
+        coordenadas = [[next(aneis) for _ in poligono] for poligono in lista]
+        simplificadas.append({"type": geometria["type"],
+                              "coordinates": coordenadas if geometria["type"] == "MultiPolygon" else coordenadas[0]})
+    return simplificadas
+
+
+# --- Mapa ---
+
+@functools.lru_cache(maxsize=16)
+def _camadas_em_cache(caminho_banco, versao, nome_fazenda):
+    """Camadas simplificadas do mapa de um banco numa versão dos dados (ver camadas_do_mapa)."""
+    limites = limites_dos_talhoes(nome_fazenda)
+    if limites is None:
+        return None, []
+    talhoes = talhoes_na_area(*limites)
+    latitude = (limites[1] + limites[3]) / 2
+    # Do zoom mais próximo ao mais distante, cada faixa simplifica a geometria já simplificada da anterior
+    geometrias = [talhao["geometria"] for talhao in talhoes]
+    camadas = []
+    for _, zoom_maximo in reversed(FAIXAS_ZOOM):
+        tolerancia = tolerancia_do_zoom(zoom_maximo, latitude)
+        geometrias = simplificar_geometrias(geometrias, tolerancia)
+        camadas.insert(0, {"type": "FeatureCollection", "features": [{
+            "type": "Feature",
+            "geometry": geometria,
+            "properties": {"talhao": talhao["talhao"], "nome_fazenda": talhao["nome_fazenda"],
+                           "hectares": round(talhao["hectares"], 2),
+                           "destaque": nome_fazenda is None or talhao["nome_fazenda"] == nome_fazenda},
+        } for talhao, geometria in zip(talhoes, geometrias)]})
+    return limites, camadas
+
+
+@instrumentar
+def camadas_do_mapa(nome_fazenda=None):
+    """Limites e camadas (FeatureCollections, uma por faixa de FAIXAS_ZOOM) do mapa de uma fazenda ou de todas.
+
+    Entram os talhões que o índice espacial encontra nos limites da fazenda, inclusive os vizinhos de
+    outras fazendas (com `destaque` falso). Mantidas em cache até os dados mudarem.
+    """
+    return _camadas_em_cache(os.path.abspath(armazenamento.ARQUIVO_BANCO), versao_dados(), nome_fazenda)
+
+
+def _estilo_talhao(feature):
+    """Estilo de um talhão no mapa: os da fazenda escolhida em destaque."""
+    return ESTILO_TALHAO if feature["properties"]["destaque"] else ESTILO_VIZINHO
+
+
+@instrumentar
+def mapa_html(nome_fazenda=None):
+    """HTML do mapa dos talhões de uma fazenda ou de todas, ou None se não houver talhões."""
+    import folium
+    from branca.element import MacroElement, Template
+
+    limites, camadas = camadas_do_mapa(nome_fazenda)
+    if limites is None:
+        return None
+    min_lon, min_lat, max_lon, max_lat = limites
+    mapa = folium.Map(tiles="OpenStreetMap", max_zoom=FAIXAS_ZOOM[-1][1], control_scale=True)
+    mapa.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
+    nomes_camadas = []
+    for (zoom_minimo, zoom_maximo), colecao in zip(FAIXAS_ZOOM, camadas):
+        grupo = folium.FeatureGroup(name=f"Zoom {zoom_minimo}-{zoom_maximo}", control=False, show=False)
+        folium.GeoJson(colecao, style_function=_estilo_talhao, tooltip=folium.GeoJsonTooltip(
+            fields=["talhao", "nome_fazenda", "hectares"], aliases=["Talhão", "Fazenda", "Hectares"])).add_to(grupo)
+        grupo.add_to(mapa)
+        nomes_camadas.append((grupo.get_name(), zoom_minimo, zoom_maximo))
+    alternar = MacroElement()
+    alternar._template = Template(MODELO_ALTERNAR_CAMADAS)
+    alternar.camadas = nomes_camadas
+    mapa.add_child(alternar)
+    return mapa.get_root().render()
@@ -0,0 +1,137 @@
+"""Execução em segundo plano das tarefas pesadas do app: exportações e agregações dos gráficos.
+
+As tarefas rodam num pool de threads do processo, compartilhado por todas as sessões do Streamlit, e
+não dependem do Streamlit. Uma tarefa é identificada por (nome, argumentos, versão dos dados): um pedido
+igual a uma tarefa na fila ou em execução reaproveita essa execução em vez de começar outra, e o
+resultado fica guardado para ser baixado depois sem refazer o trabalho. Só as MAXIMO_ARTEFATOS tarefas
+terminadas mais recentes são mantidas. Com o diagnóstico ligado (FAZENDA_DIAGNOSTICO=1), cada tarefa é uma
+execução à parte, gravada no log de diagnóstico ao terminar.
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import diagnostico
+
+MAXIMO_TRABALHADORES = 2
+MAXIMO_ARTEFATOS = 8
+NA_FILA = "Na fila"
+EXECUTANDO = "Em execução"
+CONCLUIDA = "Concluída"
+FALHOU = "Falhou"
+TERMINADAS = {CONCLUIDA, FALHOU}
+
+_trava = threading.Lock()
+_tarefas = collections.OrderedDict()  # chave -> tarefa, da usada há mais tempo à mais recente
+_executor = None
+_logger = logging.getLogger("fazenda.tarefas")
+
+
+def _obter_executor():
+    """Pool de threads das tarefas, criado no primeiro envio (chamar com a trava)."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAXIMO_TRABALHADORES, thread_name_prefix="tarefa")
+    return _executor
+
+
+def _descartar_excedentes():
+    """Remove as tarefas terminadas usadas há mais tempo além de MAXIMO_ARTEFATOS (chamar com a trava)."""
+    terminadas = [chave for chave, tarefa in _tarefas.items() if tarefa["estado"] in TERMINADAS]
+    for chave in terminadas[:max(len(terminadas) - MAXIMO_ARTEFATOS, 0)]:
+        del _tarefas[chave]
+
+
+def _executar(tarefa, funcao, argumentos):
+    """Roda a tarefa no pool, publicando o progresso e, ao final, o resultado ou o erro."""
+    def progresso(fracao, mensagem=""):
+        with _trava:
+            tarefa["progresso"] = min(max(float(fracao), 0.0), 1.0)
+            tarefa["mensagem"] = mensagem
+
+    with _trava:
+        tarefa["estado"] = EXECUTANDO
+        tarefa["inicio"] = time.time()
+    # As threads do pool são reaproveitadas: cada tarefa começa uma execução nova do diagnóstico
+    diagnostico.iniciar_execucao(diagnostico.DIAGNOSTICO_POR_AMBIENTE)
+    inicio = time.perf_counter()
+    try:
+        resultado = funcao(*argumentos, progresso=progresso)
+    except Exception as e:
+        _logger.exception("Falha na tarefa %s", tarefa["nome"])
+        with _trava:
+            tarefa.update(estado=FALHOU, erro=str(e) or type(e).__name__, fim=time.time())
+        return
+    finally:
+        if diagnostico.diagnostico_ativo():
+            diagnostico.registrar_diagnostico(f"tarefa:{tarefa['nome']}", (time.perf_counter() - inicio) * 1000, None)
+        diagnostico.iniciar_execucao(False)
+    with _trava:
+        tarefa.update(estado=CONCLUIDA, progresso=1.0, mensagem="", resultado=resultado, fim=time.time())
+
+
+def enviar_tarefa(nome, funcao, *argumentos, versao=None):
+    """Enfileira `funcao(*argumentos, progresso=...)` e devolve a chave da tarefa.
+
+    Se já existe uma tarefa com a mesma chave (na fila, em execução ou terminada), nada é enfileirado:
+    a chave dela é devolvida. `versao` (em geral versao_dados()) entra na chave, para que dados novos
+    gerem um novo resultado. `progresso(fracao, mensagem)` informa o andamento, de 0 a 1.
+    """
+    chave = (nome, argumentos, versao)
+    with _trava:
+        if chave in _tarefas:
+            _tarefas.move_to_end(chave)
+            return chave
+        tarefa = {"nome": nome, "estado": NA_FILA, "progresso": 0.0, "mensagem": "", "resultado": None,
+                  "erro": None, "enviada": time.time(), "inicio": None, "fim": None}
+        _tarefas[chave] = tarefa
+        _descartar_excedentes()
+        tarefa["futuro"] = _obter_executor().submit(_executar, tarefa, funcao, argumentos)
+    return chave
+
+
+def situacao_tarefa(chave):
+    """Cópia do estado da tarefa (sem o resultado), ou None se ela não existe ou já foi descartada."""
+    with _trava:
+        tarefa = _tarefas.get(chave)
+        if tarefa is None:
+            return None
+        return {campo: valor for campo, valor in tarefa.items() if campo not in ("resultado", "futuro")}
+
+
+def resultado_tarefa(chave):
+    """Resultado da tarefa concluída, ou None se ela ainda não terminou, falhou ou foi descartada."""
+    with _trava:
+        tarefa = _tarefas.get(chave)
+        if tarefa is None or tarefa["estado"] != CONCLUIDA:
+            return None
+        _tarefas.move_to_end(chave)
+        return tarefa["resultado"]
+
+
+def aguardar_tarefa(chave, tempo_limite=None):
+    """Espera a tarefa terminar (para scripts e benchmarks) e devolve o resultado dela, ou None se ela falhou."""
+    with _trava:
+        tarefa = _tarefas.get(chave)
+    if tarefa is None:
+        return None
+    tarefa["futuro"].result(tempo_limite)
+    return resultado_tarefa(chave)
+
+
+def descartar_tarefa(chave):
+    """Esquece uma tarefa terminada (por exemplo, para tentar de novo uma que falhou)."""
+    with _trava:
+        tarefa = _tarefas.get(chave)
+        if tarefa is not None and tarefa["estado"] in TERMINADAS:
+            del _tarefas[chave]
+
+
+def artefatos(nome):
+    """(chave, horário de conclusão) das tarefas `nome` concluídas ainda guardadas, da mais recente à mais antiga."""
+    with _trava:
+        concluidas = [(chave, tarefa["fim"]) for chave, tarefa in _tarefas.items()
+                      if tarefa["nome"] == nome and tarefa["estado"] == CONCLUIDA]
+    return sorted(concluidas, key=lambda item: item[1], reverse=True)
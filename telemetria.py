@@ -0,0 +1,410 @@
+"""Ingestão dos logs de voo dos drones: área, velocidade, altura e volume aplicados em cada operação aérea.
+
+Os logs são CSV com cabeçalho ou JSON lines (um ponto por linha), opcionalmente compactados em
+.gz. São lidos por geradores, linha a linha, e convertidos para arrays numpy em blocos de
+TAMANHO_BLOCO pontos, sem carregar o arquivo inteiro. As métricas são somas sobre os trechos
+entre dois pontos seguidos pulverizando, e por isso se juntam entre blocos, partes e voos:
+
+- hectares aplicados: distância percorrida x largura da faixa (as sobreposições contam de novo);
+- hectares cobertos: células distintas de uma grade do tamanho da largura da faixa por onde o
+  drone passou (sem as sobreposições);
+- velocidade (m/s) e altura médias, ponderadas pelo tempo;
+- volume aplicado: vazão (L/min) integrada no tempo.
+
+Logs grandes sem compressão são divididos em partes de TAMANHO_PARTE bytes, e arquivos e partes
+são resumidos em paralelo num ProcessPoolExecutor. O resumo de cada log é anexado à operação
+aérea do mês do voo cujo talhão (limites importados em talhoes.py) contém o centro da área
+pulverizada, ou à operação indicada.
+"""
+import csv
+import datetime
+import gzip
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import armazenamento
+from armazenamento import MESES, carregar_registros_do_ano, chave_talhao, converter_numero, ler_registro
+from diagnostico import instrumentar
+from talhoes import talhoes_no_ponto
+
+TAMANHO_BLOCO = 100_000  # Pontos convertidos para numpy de cada vez
+TAMANHO_PARTE = 256 * 1024 * 1024  # Bytes de cada parte de um log grande, resumidas em paralelo
+LARGURA_FAIXA = 9.0  # Metros; largura padrão da faixa de pulverização
+LACUNA_MAXIMA = 10.0  # Segundos; trechos mais longos (log interrompido, pouso) ficam de fora
+METROS_POR_GRAU = 111320.0
+# Colunas usadas do log e os nomes aceitos para cada uma no arquivo, sem diferenciar maiúsculas
+COLUNAS = {
+    "tempo": ["tempo", "timestamp", "time", "datetime", "data_hora"],
+    "latitude": ["latitude", "lat"],
+    "longitude": ["longitude", "lon", "lng"],
+    "altura": ["altura", "height", "altitude", "alt"],
+    "velocidade": ["velocidade", "speed", "velocity"],
+    "vazao": ["vazao", "vazão", "flow", "flow_rate"],
+    "pulverizando": ["pulverizando", "spraying", "spray"],
+}
+OBRIGATORIAS = ["tempo", "latitude", "longitude"]
+VALORES_VERDADEIROS = {"1", "true", "sim", "s", "yes", "y", "on"}
+APELIDOS = {apelido: coluna for coluna, apelidos in COLUNAS.items() for apelido in apelidos}
+
+
+# --- Leitura em blocos ---
+
+def _formato(caminho):
+    """Formato do log pela extensão, desconsiderando .gz: "csv" ou "jsonl"."""
+    nome = caminho.lower().removesuffix(".gz")
+    if nome.endswith(".csv"):
+        return "csv"
+    if nome.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise ValueError(f"{caminho}: formato de log desconhecido (use .csv ou .jsonl, opcionalmente .gz).")
+
+
+def _abrir(caminho):
+    """Abre o log em modo binário, descompactando os .gz."""
+    return gzip.open(caminho, "rb") if caminho.lower().endswith(".gz") else open(caminho, "rb")
+
+
+def _colunas_do_log(caminho, formato):
+    """Nomes das colunas no arquivo, pela primeira linha, e o nome padrão (COLUNAS) de cada uma reconhecida.
+
+    Levanta ValueError se faltar alguma coluna obrigatória.
+    """
+    with _abrir(caminho) as arquivo:
+        primeira = arquivo.readline().decode("utf-8-sig")
+    try:
+        nomes = next(csv.reader([primeira]), []) if formato == "csv" else list(json.loads(primeira))
+    except (ValueError, TypeError):
+        nomes = []
+    colunas = {nome: APELIDOS[nome.strip().lower()] for nome in nomes if nome.strip().lower() in APELIDOS}
+    faltando = [coluna for coluna in OBRIGATORIAS if coluna not in colunas.values()]
+    if faltando:
+        raise ValueError(f"{caminho}: faltam as colunas {', '.join(faltando)} na primeira linha do log.")
+    return nomes, colunas
+
+
+def _partes(caminho, tamanho_parte):
+    """Intervalos de bytes [inicio, fim) em que o log é dividido; fim None vai até o final do arquivo."""
+    tamanho = os.path.getsize(caminho)
+    if caminho.lower().endswith(".gz") or tamanho <= tamanho_parte:
+        return [(0, None)]
+    inicios = list(range(0, tamanho, tamanho_parte))
+    return list(zip(inicios, inicios[1:] + [None]))
+
+
+def _linhas(caminho, inicio=0, fim=None):
+    """Gera as linhas que começam entre os bytes `inicio` e `fim` e mais a primeira depois de `fim`.
+
+    Uma linha começada antes de `inicio` é da parte anterior. A linha a mais fecha o último trecho
+    da parte; a parte seguinte começa nela, e assim cada trecho entre dois pontos é somado uma vez.
+    """
+    with _abrir(caminho) as arquivo:
+        if inicio:
+            arquivo.seek(inicio - 1)
+            arquivo.readline()
+        posicao = arquivo.tell()
+        for linha in iter(arquivo.readline, b""):
+            yield linha.decode("utf-8-sig" if posicao == 0 else "utf-8")
+            if fim is not None and posicao >= fim:
+                return
+            posicao += len(linha)
+
+
+def _blocos(caminho, formato, nomes, colunas, inicio, fim, tamanho_bloco):
+    """Gera os pontos de uma parte do log em blocos de até `tamanho_bloco`: {coluna padrão: lista de valores}."""
+    linhas = _linhas(caminho, inicio, fim)
+    if formato == "csv" and inicio == 0:
+        next(linhas, None)  # Cabeçalho
+    if formato == "csv":
+        posicoes = {coluna: nomes.index(nome) for nome, coluna in colunas.items()}
+        registros = ({coluna: linha[posicao] if posicao < len(linha) else None
+                      for coluna, posicao in posicoes.items()} for linha in csv.reader(linhas) if linha)
+    else:
+        registros = ({colunas[nome]: valor for nome, valor in json.loads(linha).items() if nome in colunas}
+                     for linha in linhas if linha.strip())
+    bloco = {coluna: [] for coluna in colunas.values()}
+    quantidade = 0
+    for registro in registros:
+        for coluna, valores in bloco.items():
+            valores.append(registro.get(coluna))
+        quantidade += 1
+        if quantidade == tamanho_bloco:
+            yield bloco
+            bloco = {coluna: [] for coluna in colunas.values()}
+            quantidade = 0
+    if quantidade:
+        yield bloco
+
+
+# --- Conversão e métricas ---
+
+def _numeros(valores):
+    """Converte uma coluna em array float, com NaN nos valores vazios ou inválidos."""
+    import numpy as np
+
+    try:
+        return np.asarray(valores, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([converter_numero(valor) for valor in valores], dtype=float)
+
+
+def _segundos(valores):
+    """Converte a coluna de tempo em segundos desde 1970: números (segundos ou milissegundos) ou datas ISO."""
+    import numpy as np
+
+    numeros = _numeros(valores)
+    if not np.isnan(numeros).all():
+        return np.where(numeros > 1e11, numeros / 1000, numeros)
+    try:
+        datas = np.array([str(valor).strip().removesuffix("Z") for valor in valores], dtype="datetime64[ms]")
+    except ValueError as e:
+        raise ValueError(f"Tempo inválido no log: {e}") from e
+    return datas.astype("int64") / 1000
+
+
+def _booleanos(valores):
+    """Converte a coluna `pulverizando` (0/1, true/false, sim/não) em array booleano."""
+    import numpy as np
+
+    numeros = _numeros(valores)
+    textos = np.array([str(valor).strip().lower() in VALORES_VERDADEIROS for valor in valores], dtype=bool)
+    return np.where(np.isnan(numeros), textos, numeros != 0)
+
+
+def _converter(bloco):
+    """Converte as listas de valores de um bloco em arrays numpy."""
+    conversores = {"tempo": _segundos, "pulverizando": _booleanos}
+    return {coluna: conversores.get(coluna, _numeros)(valores) for coluna, valores in bloco.items()}
+
+
+def _extremo(funcao, *valores):
+    """Menor ou maior (`funcao`) dos valores que não são None, ou None."""
+    valores = [valor for valor in valores if valor is not None]
+    return funcao(valores) if valores else None
+
+
+def _resumo_vazio():
+    """Somas de um log ainda sem pontos (ver _somar_bloco)."""
+    import numpy as np
+
+    return {"segundos": 0.0, "metros": 0.0, "volume_litros": 0.0, "soma_velocidade": 0.0, "peso_velocidade": 0.0,
+            "soma_altura": 0.0, "peso_altura": 0.0, "soma_longitude": 0.0, "soma_latitude": 0.0,
+            "inicio": None, "fim": None, "tem_vazao": False, "celulas": np.empty(0, dtype=np.int64)}
+
+
+def _somar_bloco(resumo, pontos, largura_faixa):
+    """Soma ao resumo os trechos entre pontos seguidos de um bloco em que o drone estava pulverizando.
+
+    Cada trecho leva os valores do ponto inicial; ele conta se estava pulverizando (coluna `pulverizando`
+    ou, sem ela, vazão maior que zero) e se durou de 0 a LACUNA_MAXIMA segundos.
+    """
+    import numpy as np
+
+    tempo, latitude, longitude = pontos["tempo"], pontos["latitude"], pontos["longitude"]
+    tempos_validos = tempo[np.isfinite(tempo)]
+    if len(tempos_validos):
+        resumo["inicio"] = _extremo(min, resumo["inicio"], float(tempos_validos.min()))
+        resumo["fim"] = _extremo(max, resumo["fim"], float(tempos_validos.max()))
+    duracao = np.diff(tempo)
+    trechos = (duracao > 0) & (duracao <= LACUNA_MAXIMA) & np.isfinite(latitude[:-1] + longitude[:-1]
+                                                                         + latitude[1:] + longitude[1:])
+    if "pulverizando" in pontos:
+        trechos &= pontos["pulverizando"][:-1]
+    elif "vazao" in pontos:
+        trechos &= pontos["vazao"][:-1] > 0
+    duracao = np.where(trechos, duracao, 0.0)
+
+    escala = np.cos(np.radians(latitude)) * METROS_POR_GRAU  # Metros por grau de longitude em cada ponto
+    x, y = longitude * escala, latitude * METROS_POR_GRAU
+    distancias = np.hypot(np.diff(longitude) * escala[:-1], np.diff(y))
+    resumo["segundos"] += float(duracao.sum())
+    resumo["metros"] += float(distancias[trechos].sum())
+    resumo["soma_longitude"] += float((longitude[:-1] * duracao)[trechos].sum())
+    resumo["soma_latitude"] += float((latitude[:-1] * duracao)[trechos].sum())
+    for coluna in ("velocidade", "altura"):
+        if coluna in pontos:
+            valores = pontos[coluna][:-1]
+            medidos = trechos & np.isfinite(valores)
+            resumo[f"soma_{coluna}"] += float((valores * duracao)[medidos].sum())
+            resumo[f"peso_{coluna}"] += float(duracao[medidos].sum())
+    if "vazao" in pontos:
+        vazao = pontos["vazao"][:-1]
+        resumo["volume_litros"] += float((vazao * duracao / 60)[trechos & np.isfinite(vazao)].sum())
+        resumo["tem_vazao"] = True
+
+    colunas_grade = np.floor(x[:-1][trechos] / largura_faixa).astype(np.int64)
+    linhas_grade = np.floor(y[:-1][trechos] / largura_faixa).astype(np.int64)
+    resumo["celulas"] = np.union1d(resumo["celulas"], (colunas_grade << 32) + (linhas_grade + (1 << 31)))
+
+
+def _juntar(resumo, outro):
+    """Junta as somas de duas partes do mesmo log."""
+    import numpy as np
+
+    juntos = {chave: resumo[chave] + outro[chave] for chave in resumo
+              if chave not in ("inicio", "fim", "tem_vazao", "celulas")}
+    juntos["inicio"] = _extremo(min, resumo["inicio"], outro["inicio"])
+    juntos["fim"] = _extremo(max, resumo["fim"], outro["fim"])
+    juntos["tem_vazao"] = resumo["tem_vazao"] or outro["tem_vazao"]
+    juntos["celulas"] = np.union1d(resumo["celulas"], outro["celulas"])
+    return juntos
+
+
+def _resumir_parte(tarefa):
+    """Soma os trechos de uma parte do log (executada nos processos do pool)."""
+    caminho, formato, nomes, colunas, inicio, fim, largura_faixa, tamanho_bloco = tarefa
+    import numpy as np
+
+    resumo = _resumo_vazio()
+    ultimo = None
+    for bloco in _blocos(caminho, formato, nomes, colunas, inicio, fim, tamanho_bloco):
+        pontos = _converter(bloco)
+        if ultimo is not None:  # O último ponto do bloco anterior fecha o primeiro trecho deste
+            pontos = {coluna: np.concatenate([ultimo[coluna], valores]) for coluna, valores in pontos.items()}
+        _somar_bloco(resumo, pontos, largura_faixa)
+        ultimo = {coluna: valores[-1:] for coluna, valores in pontos.items()}
+    return resumo
+
+
+def _data_iso(segundos):
+    """Data e hora ISO de um instante em segundos desde 1970, ou None."""
+    if segundos is None:
+        return None
+    return datetime.datetime.fromtimestamp(segundos, datetime.timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def _finalizar(resumo, largura_faixa):
+    """Converte as somas de um log no resumo gravado na operação."""
+    segundos = resumo["segundos"]
+    media_velocidade = (resumo["soma_velocidade"] / resumo["peso_velocidade"] if resumo["peso_velocidade"]
+                        else resumo["metros"] / segundos if segundos else None)
+    media_altura = resumo["soma_altura"] / resumo["peso_altura"] if resumo["peso_altura"] else None
+    return {
+        "inicio": _data_iso(resumo["inicio"]),
+        "fim": _data_iso(resumo["fim"]),
+        "minutos": round(segundos / 60, 2),
+        "metros": round(resumo["metros"], 1),
+        "largura_faixa": largura_faixa,
+        "hectares_aplicados": round(resumo["metros"] * largura_faixa / 10000, 4),
+        "hectares_cobertos": round(len(resumo["celulas"]) * largura_faixa ** 2 / 10000, 4),
+        "velocidade_media": None if media_velocidade is None else round(media_velocidade, 2),
+        "altura_media": None if media_altura is None else round(media_altura, 2),
+        "volume_litros": round(resumo["volume_litros"], 3) if resumo["tem_vazao"] else None,
+        "centro": [round(resumo["soma_longitude"] / segundos, 7),
+                   round(resumo["soma_latitude"] / segundos, 7)] if segundos else None,
+    }
+
+
+@instrumentar
+def resumir_logs(caminhos, largura_faixa=LARGURA_FAIXA, processos=None, tamanho_parte=TAMANHO_PARTE,
+                 tamanho_bloco=TAMANHO_BLOCO):
+    """Resume os logs de voo; devolve {caminho: resumo}, com as chaves de _finalizar.
+
+    Os logs sem compressão maiores que `tamanho_parte` são divididos em partes. Arquivos e partes são
+    resumidos em paralelo em até `processos` processos (padrão: um por CPU); com uma tarefa só, ou
+    processos=1, tudo roda neste processo.
+    """
+    tarefas = []
+    for caminho in dict.fromkeys(caminhos):
+        formato = _formato(caminho)
+        nomes, colunas = _colunas_do_log(caminho, formato)
+        tarefas += [(caminho, formato, nomes, colunas, inicio, fim, largura_faixa, tamanho_bloco)
+                    for inicio, fim in _partes(caminho, tamanho_parte)]
+    if processos == 1 or len(tarefas) <= 1:
+        parciais = [_resumir_parte(tarefa) for tarefa in tarefas]
+    else:
+        with ProcessPoolExecutor(max_workers=processos) as executor:
+            parciais = list(executor.map(_resumir_parte, tarefas))
+    resumos = {}
+    for tarefa, parcial in zip(tarefas, parciais):
+        caminho = tarefa[0]
+        resumos[caminho] = _juntar(resumos[caminho], parcial) if caminho in resumos else parcial
+    return {caminho: _finalizar(resumo, largura_faixa) for caminho, resumo in resumos.items()}
+
+
+# --- Operações ---
+
+def operacao_do_voo(resumo):
+    """Operação aérea de um voo: a do mês do início do voo no talhão que contém o centro da área pulverizada.
+
+    Devolve (registro, None), ou (None, motivo) se nenhuma ou mais de uma operação combinar.
+    """
+    if resumo["centro"] is None:
+        return None, "o log não tem trechos pulverizando."
+    talhoes = talhoes_no_ponto(*resumo["centro"])
+    if not talhoes:
+        return None, "nenhum talhão importado contém a área pulverizada."
+    inicio = datetime.datetime.fromisoformat(resumo["inicio"])
+    mes = MESES[inicio.month - 1]
+    chaves = {chave_talhao(talhao["nome_fazenda"], talhao["talhao"]) for talhao in talhoes}
+    candidatos = [registro for registro in carregar_registros_do_ano(inicio.year)
+                  if registro.get("tipo_operacao") == "Operação Aérea" and registro.get("mes") == mes
+                  and chave_talhao(registro.get("nome_fazenda"), registro.get("talhao_aplicado")) in chaves]
+    if len(candidatos) != 1:
+        nomes = ", ".join(f"{talhao['nome_fazenda']}/{talhao['talhao']}" for talhao in talhoes)
+        return None, f"{len(candidatos)} operações aéreas em {mes} de {inicio.year} no talhão {nomes}."
+    return candidatos[0], None
+
+
+def _totais_dos_voos(voos):
+    """Totais da operação a partir dos resumos dos seus voos; as médias são ponderadas pelos minutos."""
+    def media(chave):
+        medidos = [(voo[chave], voo["minutos"]) for voo in voos.values() if voo[chave] is not None]
+        peso = sum(minutos for _, minutos in medidos)
+        return round(sum(valor * minutos for valor, minutos in medidos) / peso, 2) if peso else None
+
+    volumes = [voo["volume_litros"] for voo in voos.values() if voo["volume_litros"] is not None]
+    hectares_cobertos = sum(voo["hectares_cobertos"] for voo in voos.values())
+    volume = round(sum(volumes), 3) if volumes else None
+    return {
+        "minutos": round(sum(voo["minutos"] for voo in voos.values()), 2),
+        "hectares_aplicados": round(sum(voo["hectares_aplicados"] for voo in voos.values()), 4),
+        "hectares_cobertos": round(hectares_cobertos, 4),
+        "velocidade_media": media("velocidade_media"),
+        "altura_media": media("altura_media"),
+        "volume_litros": volume,
+        "dose_real": round(volume / hectares_cobertos, 3) if volume is not None and hectares_cobertos else None,
+    }
+
+
+@instrumentar
+def anexar_voo(id_registro, nome_log, resumo):
+    """Anexa o resumo de um log à operação e refaz os totais dela; devolve o registro gravado.
+
+    O voo fica em registro["telemetria"]["voos"][nome_log] (o mesmo log importado de novo substitui o
+    anterior). A velocidade e a altura da operação passam a ser as médias medidas nos voos.
+    """
+    registro = ler_registro(id_registro)
+    if registro is None:
+        raise ValueError(f"Operação {id_registro} não encontrada (ou num ano arquivado).")
+    voos = dict((registro.get("telemetria") or {}).get("voos", {}), **{nome_log: resumo})
+    registro["telemetria"] = dict(_totais_dos_voos(voos), voos=voos)
+    for campo, chave in (("velocidade", "velocidade_media"), ("altura", "altura_media")):
+        if registro["telemetria"][chave] is not None:
+            registro[campo] = registro["telemetria"][chave]
+    armazenamento.salvar_registro(registro)
+    return registro
+
+
+@instrumentar
+def ingerir_logs(caminhos, id_registro=None, largura_faixa=LARGURA_FAIXA, processos=None, gravar=True,
+                 tamanho_parte=TAMANHO_PARTE):
+    """Resume os logs e anexa cada um à sua operação (a de `id_registro` ou a encontrada por operacao_do_voo).
+
+    Devolve, por log, {"arquivo", "resumo", "operacao" (id ou None), "motivo" (por que ficou sem operação)}.
+    Com gravar=False só resume e procura as operações.
+    """
+    resultados = []
+    for caminho, resumo in resumir_logs(caminhos, largura_faixa, processos, tamanho_parte).items():
+        if id_registro is not None:
+            operacao, motivo = id_registro, None
+        else:
+            registro, motivo = operacao_do_voo(resumo)
+            operacao = registro["id"] if registro else None
+        if operacao is not None and gravar:
+            try:
+                anexar_voo(operacao, os.path.basename(caminho), resumo)
+            except ValueError as e:  # Operação inexistente ou ano arquivado
+                operacao, motivo = None, str(e)
+        resultados.append({"arquivo": caminho, "resumo": resumo, "operacao": operacao, "motivo": motivo})
+    return resultados
@@ -0,0 +1,69 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import importacao  # noqa: E402
+from relatorios import ABAS_EXPORTACAO  # noqa: E402
+
+COLUNAS_AEREA = ABAS_EXPORTACAO["Operação Aérea"][1]
+
+
+@pytest.fixture(autouse=True)
+def _pasta_temporaria(tmp_path, monkeypatch):
+    """Roda cada teste numa pasta vazia, longe do banco do app."""
+    monkeypatch.chdir(tmp_path)
+
+
+def _csv_aerea(produtos_por_linha, dose="2", dose_total="20"):
+    """Planilha Aérea com uma linha por produto, todas com os mesmos dados de operação."""
+    linhas = [",".join(COLUNAS_AEREA)]
+    for produto in produtos_por_linha:
+        linhas.append(f"Março,2024,Fazenda,T1,10,Soja,6,3,{produto},{dose},{dose_total},DJI,Ana,Em aberto")
+    return io.StringIO("\n".join(linhas) + "\n")
+
+
+def _produtos_das_operacoes(arquivo, tamanho_bloco=importacao.TAMANHO_BLOCO):
+    """Nomes dos produtos de cada operação montada a partir da planilha Aérea."""
+    resultado = {"operacoes": [], "gastos": [], "operacoes_rejeitadas": 0, "erros": []}
+    blocos = ((inicio, bloco) for _, inicio, bloco in importacao._ler_blocos("a.csv", arquivo, tamanho_bloco, ","))
+    importacao._importar_planilha(blocos, "Operação Aérea", resultado)
+    assert resultado["erros"] == []
+    return [[produto["nome"] for produto in operacao["produtos"]] for operacao in resultado["operacoes"]]
+
+
+def test_linhas_seguidas_com_os_mesmos_dados_formam_uma_operacao():
+    assert _produtos_das_operacoes(_csv_aerea(["A", "B"])) == [["A", "B"]]
+
+
+def test_produto_repetido_comeca_outra_operacao_com_os_mesmos_dados():
+    assert _produtos_das_operacoes(_csv_aerea(["A", "B", "A", "B"])) == [["A", "B"], ["A", "B"]]
+
+
+def test_operacao_repetida_cortada_entre_blocos():
+    assert _produtos_das_operacoes(_csv_aerea(["A", "B", "A", "C", "A"]), tamanho_bloco=2) == [
+        ["A", "B"], ["A", "C"], ["A"]]
+
+
+def test_importar_arquivos_conta_as_operacoes_repetidas():
+    resultado = importacao.importar_arquivos([("a.csv", _csv_aerea(["A", "A", "A"]))], gravar=False)
+    assert resultado["operacoes"] == 3
+    assert resultado["linhas_com_erro"] == 0
+
+
+def test_produto_so_com_dose_total_e_erro_da_linha():
+    resultado = importacao.importar_arquivos([("a.csv", _csv_aerea([""], dose=""))], gravar=False)
+    assert resultado["operacoes"] == 0
+    assert resultado["operacoes_rejeitadas"] == 1
+    assert [(erro["linha"], erro["campo"]) for erro in resultado["erros"]] == [(2, "Dose por Hectare")]
+
+
+def test_dose_total_informada_e_mantida():
+    resultado = {"operacoes": [], "gastos": [], "operacoes_rejeitadas": 0, "erros": []}
+    blocos = ((inicio, bloco) for _, inicio, bloco in importacao._ler_blocos("a.csv", _csv_aerea(["A"], dose_total="25"),
+                                                                             importacao.TAMANHO_BLOCO, ","))
+    importacao._importar_planilha(blocos, "Operação Aérea", resultado)
+    assert [produto["dose_total"] for produto in resultado["operacoes"][0]["produtos"]] == [25.0]